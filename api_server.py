@@ -0,0 +1,383 @@
+"""HTTP JSON API for the chat, search and resource pipeline, for partner apps such as a WhatsApp bot.
+
+A small asyncio HTTP/1.1 server with no dependencies beyond the standard library.
+Connections are kept alive between requests and served concurrently; model calls and
+searches run on a thread pool so a slow answer never blocks other connections.
+
+Every endpoint except /health needs a partner API key, sent as "Authorization: Bearer <key>"
+(or "X-API-Key: <key>"). Keys are configured as API_KEYS="partner=key,other_partner=key".
+Chat is limited per partner (the "partner" rate-limit policy) and, within a partner, per
+user_id, so changing user_id never buys more model calls than the partner's budget.
+
+Endpoints (all bodies are JSON):
+    GET  /health
+    POST /chat       {"message", "user_id", "locale"?, "stream"?} -> {"answer", "resources"}
+                     With "stream": true the reply is chunked newline-delimited JSON:
+                     {"delta": "..."} lines, then {"done": true, "resources": "..."}.
+    POST /search     {"query", "locale"?, "page"?} -> {"query", "suggestion", "total", "page", "pages", "groups"}
+    POST /resources  {"message", "locale"?} -> {"resources"}
+
+Run with:
+    API_KEYS="whatsapp_bot=<long random key>" python api_server.py [--host 127.0.0.1] [--port 8600] [--local-model]
+Load-test against the local model stand-in with:
+    python api_server.py --bench [--connections 50] [--requests 2000]
+"""
+import argparse
+import asyncio
+import contextvars
+import hmac
+import json
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app_logging import get_logger, set_log_context
+from kb_locales import DEFAULT_LOCALE, LOCALE_NAMES
+from rate_limit import consume, refund
+from support_core import LocalModel, answer, create_model, search, stream_answer, suggest_resources
+
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 64 * 1024
+KEEP_ALIVE_SECONDS = 15 # Idle connections are closed after this long
+WORKER_THREADS = 32 # Concurrent model calls and searches
+REQUEST_LOG_SAMPLE = 0.1 # Requests are high volume; failures are always logged
+REASONS = {200: "OK", 400: "Bad Request", 401: "Unauthorized", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large",
+           429: "Too Many Requests", 500: "Internal Server Error", 501: "Not Implemented", 503: "Service Unavailable"}
+
+
+_log = get_logger("api")
+
+
+class HttpError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+def _response_head(status, headers):
+    lines = [f"HTTP/1.1 {status} {REASONS.get(status, '')}"] + [f"{name}: {value}" for name, value in headers.items()]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+def _body_length(headers, repeated):
+    """Returns the request body length from Content-Length; raises HttpError for anything ambiguous.
+
+    Bodies are framed by Content-Length alone. A request that also (or only) sends
+    Transfer-Encoding, repeats Content-Length or gives it as anything but plain digits is
+    refused, since a proxy in front could frame it differently and pass the rest of the body
+    on as a second request.
+    """
+    if "transfer-encoding" in headers:
+        raise HttpError(501, "Transfer-Encoding is not supported; send the body with Content-Length.")
+    if "content-length" in repeated:
+        raise HttpError(400, "Repeated Content-Length header.")
+    value = headers.get("content-length", "0")
+    # int() would also accept "+5", " 5" and "5_0"
+    if not (value.isascii() and value.isdigit()):
+        raise HttpError(400, "Content-Length must be a non-negative integer.")
+    length = int(value)
+    if length > MAX_BODY_BYTES:
+        raise HttpError(413, "Request body too large.")
+    return length
+
+
+def load_api_keys(value=None):
+    """Parses API_KEYS ("partner=key,...") into {partner: key}."""
+    keys = {}
+    for item in (os.getenv("API_KEYS", "") if value is None else value).split(","):
+        partner, _, key = item.partition("=")
+        if partner.strip() and key.strip():
+            keys[partner.strip()] = key.strip()
+    return keys
+
+
+def _locale(body):
+    locale = body.get("locale") or DEFAULT_LOCALE
+    if locale not in LOCALE_NAMES:
+        raise HttpError(400, f"Unknown locale {locale!r}; expected one of {sorted(LOCALE_NAMES)}.")
+    return locale
+
+
+def _text_field(body, name):
+    value = body.get(name)
+    if not isinstance(value, str) or not value.strip():
+        raise HttpError(400, f"{name!r} must be a non-empty string.")
+    return value.strip()
+
+
+class ApiServer:
+    def __init__(self, model_instance, api_keys, workers=WORKER_THREADS, limit_partners=True):
+        self.model = model_instance
+        self._api_keys = {partner: key.encode("utf-8") for partner, key in api_keys.items()}
+        self._limit_partners = limit_partners
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="api-worker")
+
+    async def _run(self, function, *args):
+        # Copy the request's log context so records from the worker thread keep its session and path
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(self._executor, context.run, function, *args)
+
+    async def handle_connection(self, reader, writer):
+        """Serves requests on one connection until the client closes it or it sits idle."""
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEP_ALIVE_SECONDS)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    return
+                except asyncio.LimitOverrunError:
+                    await self._send_json(writer, 413, {"error": "Headers too large."}, keep_alive=False)
+                    return
+                request_line, *header_lines = head.decode("latin-1").split("\r\n")
+                try:
+                    method, path, version = request_line.split(" ", 2)
+                except ValueError:
+                    await self._send_json(writer, 400, {"error": "Malformed request line."}, keep_alive=False)
+                    return
+                headers, repeated = {}, set()
+                for line in header_lines:
+                    name, _, value = line.partition(":")
+                    if name:
+                        name = name.strip().lower()
+                        if name in headers:
+                            repeated.add(name)
+                        headers[name] = value.strip()
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+                try:
+                    length = _body_length(headers, repeated)
+                except HttpError as e:
+                    # Where this request ends is unknown, so nothing more can be read from the connection
+                    await self._send_json(writer, e.status, {"error": str(e)}, keep_alive=False)
+                    return
+                raw_body = await reader.readexactly(length) if length else b""
+                await self._dispatch(writer, method, path.split("?", 1)[0], headers, raw_body, keep_alive)
+                if not keep_alive:
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def _partner(self, headers):
+        """Returns the partner whose API key authenticates the request; raises 401 otherwise."""
+        supplied = headers.get("x-api-key", "")
+        scheme, _, credentials = headers.get("authorization", "").partition(" ")
+        if not supplied and scheme.lower() == "bearer":
+            supplied = credentials.strip()
+        supplied = supplied.encode("utf-8")
+        partner = None
+        for name, key in self._api_keys.items():
+            # Compare against every key in constant time, so timing reveals neither key nor partner
+            if hmac.compare_digest(supplied, key):
+                partner = name
+        if not supplied or partner is None:
+            raise HttpError(401, "A valid API key is required.", {"WWW-Authenticate": "Bearer"})
+        return partner
+
+    async def _dispatch(self, writer, method, path, headers, raw_body, keep_alive):
+        set_log_context(page=path) # Each connection runs in its own task, so this does not leak between requests
+        start = time.perf_counter()
+        status = 200
+        try:
+            if path == "/health":
+                await self._send_json(writer, 200, {"status": "ok"}, keep_alive)
+                return
+            routes = {"/chat": self._chat, "/search": self._search, "/resources": self._resources}
+            if path not in routes:
+                raise HttpError(404, f"No endpoint at {path}.")
+            if method != "POST":
+                raise HttpError(405, "Use POST.", {"Allow": "POST"})
+            partner = self._partner(headers)
+            set_log_context(session_id=f"api:{partner}", page=path)
+            try:
+                body = json.loads(raw_body or b"{}")
+            except ValueError:
+                raise HttpError(400, "Body must be JSON.")
+            if not isinstance(body, dict):
+                raise HttpError(400, "Body must be a JSON object.")
+            await routes[path](writer, body, keep_alive, partner)
+        except HttpError as e:
+            status = e.status
+            await self._send_json(writer, e.status, {"error": str(e)}, keep_alive, e.headers)
+        except Exception:
+            status = 500
+            _log.error("request_failed", exc_info=True, extra={"stage": "request", "method": method})
+            await self._send_json(writer, 500, {"error": "Something went wrong. Please try again."}, keep_alive)
+        _log.info("request", extra={
+            "stage": "request", "method": method, "status": status,
+            "duration_ms": round((time.perf_counter() - start) * 1000, 1), "sample": REQUEST_LOG_SAMPLE,
+        })
+
+    async def _send_json(self, writer, status, payload, keep_alive, extra_headers=None):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        headers = {"Content-Type": "application/json; charset=utf-8", "Content-Length": len(data),
+                   "Connection": "keep-alive" if keep_alive else "close"}
+        headers.update(extra_headers or {})
+        writer.write(_response_head(status, headers) + data)
+        await writer.drain()
+
+    async def _chat(self, writer, body, keep_alive, partner):
+        message = _text_field(body, "message")
+        user_id = _text_field(body, "user_id")
+        locale = _locale(body)
+        if self.model is None:
+            raise HttpError(503, "The AI chat is currently unavailable.")
+        # Each of a partner's users gets the same chat budget as a UI session, and the partner as
+        # a whole is capped, since user_id is whatever the partner sends
+        allowed, retry_after = consume("chat", f"api:{partner}:{user_id}")
+        if allowed and self._limit_partners:
+            allowed, retry_after = consume("partner", partner)
+            if not allowed:
+                refund("chat", f"api:{partner}:{user_id}") # The message was never answered
+        set_log_context(session_id=f"api:{partner}:{user_id}", page="/chat")
+        if not allowed:
+            raise HttpError(429, "Too many messages; please wait a moment.", {"Retry-After": max(1, round(retry_after))})
+        if not body.get("stream"):
+            await self._send_json(writer, 200, await self._run(answer, self.model, message, locale), keep_alive)
+        else:
+            await self._stream_chat(writer, message, locale, keep_alive)
+
+    async def _stream_chat(self, writer, message, locale, keep_alive):
+        """Relays answer pieces as chunked NDJSON while the model thread produces them."""
+        loop = asyncio.get_running_loop()
+        pieces = asyncio.Queue()
+        done = object()
+
+        def produce():
+            try:
+                for piece in stream_answer(self.model, message, locale):
+                    loop.call_soon_threadsafe(pieces.put_nowait, piece)
+            except Exception as e:
+                loop.call_soon_threadsafe(pieces.put_nowait, e)
+            finally:
+                loop.call_soon_threadsafe(pieces.put_nowait, done)
+
+        producer = loop.run_in_executor(self._executor, contextvars.copy_context().run, produce)
+        headers = {"Content-Type": "application/x-ndjson; charset=utf-8", "Transfer-Encoding": "chunked",
+                   "Connection": "keep-alive" if keep_alive else "close"}
+        writer.write(_response_head(200, headers))
+        while True:
+            piece = await pieces.get()
+            if piece is done:
+                break
+            if isinstance(piece, Exception):
+                _log.error("stream_failed", exc_info=piece, extra={"stage": "stream"})
+                line = {"error": "Something went wrong. Please try again."}
+            else:
+                line = {"delta": piece}
+            self._write_chunk(writer, line)
+            await writer.drain()
+        await producer
+        self._write_chunk(writer, {"done": True, "resources": suggest_resources(message, locale)})
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    @staticmethod
+    def _write_chunk(writer, payload):
+        data = (json.dumps(payload, ensure_ascii=False) + "\n").encode("utf-8")
+        writer.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+
+    async def _search(self, writer, body, keep_alive, partner):
+        query = body.get("query")
+        if not isinstance(query, str):
+            raise HttpError(400, "'query' must be a string.")
+        page = body.get("page", 0)
+        if not isinstance(page, int) or page < 0:
+            raise HttpError(400, "'page' must be a non-negative integer.")
+        await self._send_json(writer, 200, await self._run(search, query, _locale(body), page), keep_alive)
+
+    async def _resources(self, writer, body, keep_alive, partner):
+        message = _text_field(body, "message")
+        await self._send_json(writer, 200, {"resources": suggest_resources(message, _locale(body))}, keep_alive)
+
+
+async def serve(host, port, model_instance, api_keys):
+    api = ApiServer(model_instance, api_keys)
+    server = await asyncio.start_server(api.handle_connection, host, port, limit=MAX_HEADER_BYTES)
+    _log.info("listening", extra={"host": host, "port": port})
+    async with server:
+        await server.serve_forever()
+
+
+async def _bench_client(host, port, api_key, requests, latencies, payloads, client_id):
+    """One keep-alive connection sending requests back to back."""
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for i in range(requests):
+            path, body = payloads[i % len(payloads)]
+            if path == "/chat":
+                # Unique users and questions keep the bench from measuring the rate limiter or answer cache
+                body = {"message": f"{body['message']} ({client_id}.{i})", "user_id": f"bench_{client_id}_{i}"}
+            data = json.dumps(body).encode("utf-8")
+            start = time.perf_counter()
+            writer.write(
+                f"POST {path} HTTP/1.1\r\nHost: {host}\r\nAuthorization: Bearer {api_key}\r\nContent-Type: application/json\r\n"
+                f"Content-Length: {len(data)}\r\n\r\n".encode("latin-1") + data
+            )
+            await writer.drain()
+            head = await reader.readuntil(b"\r\n\r\n")
+            length = int(next(line.split(b":")[1] for line in head.split(b"\r\n") if line.lower().startswith(b"content-length")))
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - start)
+    finally:
+        writer.close()
+
+
+async def _benchmark(connections, requests, delay):
+    api_key = os.urandom(16).hex()
+    # Requests still authenticate, but the partner budget is lifted so the bench measures the server, not the limiter
+    api = ApiServer(LocalModel(delay=delay), {"bench": api_key}, limit_partners=False)
+    server = await asyncio.start_server(api.handle_connection, "127.0.0.1", 0, limit=MAX_HEADER_BYTES)
+    host, port = server.sockets[0].getsockname()[:2]
+    run_id = os.urandom(4).hex()
+    payloads = [
+        ("/chat", {"message": "What causes miscarriage?"}), ("/search", {"query": "bleeding after miscarriage"}),
+        ("/chat", {"message": "How do I cope with grief?"}), ("/resources", {"message": "I need grief support"}),
+    ]
+    latencies = []
+    async with server:
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            _bench_client(host, port, api_key, requests // connections, latencies, payloads[c % len(payloads):] + payloads, f"{run_id}.{c}")
+            for c in range(connections)
+        ))
+        elapsed = time.perf_counter() - start
+    latencies.sort()
+    print(
+        f"{len(latencies)} requests over {connections} keep-alive connections in {elapsed:.2f}s: "
+        f"{len(latencies) / elapsed:,.0f} req/s, p50 {statistics.median(latencies) * 1000:.1f} ms, "
+        f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:.1f} ms (local model delay {delay * 1000:.0f} ms)"
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP JSON API for chat, search and resource suggestions.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8600)
+    parser.add_argument("--local-model", action="store_true", help="Answer with the offline stand-in instead of Gemini.")
+    parser.add_argument("--bench", action="store_true", help="Load-test an in-process server backed by the local model.")
+    parser.add_argument("--connections", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--model-delay", type=float, default=0.2, help="Seconds the local model takes per answer.")
+    args = parser.parse_args(argv)
+    if args.bench:
+        asyncio.run(_benchmark(args.connections, args.requests, args.model_delay))
+        return
+    api_keys = load_api_keys()
+    if not api_keys:
+        raise SystemExit('Set API_KEYS="partner=key,..." to give each partner app its own key.')
+    if args.local_model:
+        model_instance = LocalModel(delay=args.model_delay)
+    else:
+        try:
+            model_instance = create_model()
+        except Exception as e:
+            _log.warning("model_unavailable", extra={"error": str(e), "hint": "/chat will return 503; use --local-model to test without Gemini"})
+            model_instance = None
+    asyncio.run(serve(args.host, args.port, model_instance, api_keys))
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,8 @@ import os
 import json
 
 # Import utility functions
+from app_logging import get_logger, set_log_context, timed
+from kb_locales import LOCALE_NAMES
 from utils import (
     _load_knowledge_base,
     _configure_gemini,
@@ -10,6 +12,7 @@ from utils import (
     _initialize_firebase_app,
     _apply_custom_css,
     _render_footer,
+    _save_session,
 )
 
 # Import page rendering functions
@@ -22,16 +25,20 @@ from pages import (
     about_project
 )
 
+_log = get_logger("app")
+RENDER_LOG_SAMPLE = 0.1 # Every rerun renders a page, so only a tenth of render timings are logged
+
 def main():
     """Main function to run the Streamlit application."""
     st.set_page_config(page_title="SafeHaven: Miscarriage Support System", layout="wide")
 
-    # Load knowledge base and configure Gemini API once
-    _load_knowledge_base()
-    _configure_gemini()
-
     # Initialize session state variables
     _initialize_session_state()
+    set_log_context(session_id=st.session_state.user_id, page=st.session_state.current_page)
+
+    # Load the knowledge base for the session's locale and configure Gemini API once
+    _load_knowledge_base()
+    _configure_gemini()
 
     # Initialize Firebase
     _initialize_firebase_app()
@@ -50,6 +57,8 @@ def main():
             <div class='app-tagline'>Caring support when you need it</div>
         </div>
         """, unsafe_allow_html=True)
+        # Language picker; search, retrieval and resource suggestions follow the chosen locale
+        st.selectbox("Language", list(LOCALE_NAMES), format_func=LOCALE_NAMES.get, key="locale")
 
     with top_right:
         nav1, nav2, nav3, nav4, nav5, nav6 = st.columns(6)
@@ -83,22 +92,34 @@ def main():
         This AI cannot provide personalized medical or psychological advice.
     """)
 
+    # Shown once, on the run that resumed: whoever holds the link can read the restored journal
+    if st.session_state.pop("resume_notice", False):
+        st.info(
+            "Your conversation and journal were restored from this page's link. "
+            "Anyone with the link can see them, so please don't share or bookmark it on a shared device."
+        )
+
     # --- RENDER SELECTED PAGE ---
-    if st.session_state.current_page == "Chat with AI":
-        chat_with_ai.render()
-    elif st.session_state.current_page == "Journal & Reflections":
-        journal_reflections.render()
-    elif st.session_state.current_page == "Community Forum":
-        community_forum.render()
-    elif st.session_state.current_page == "Knowledge Base Search":
-        knowledge_base_search.render()
-    elif st.session_state.current_page == "FAQs":
-        faqs.render()
-    elif st.session_state.current_page == "About This Project":
-        about_project.render()
+    set_log_context(session_id=st.session_state.user_id, page=st.session_state.current_page) # The nav may have changed it
+    with timed(_log, "render", sample=RENDER_LOG_SAMPLE):
+        if st.session_state.current_page == "Chat with AI":
+            chat_with_ai.render()
+        elif st.session_state.current_page == "Journal & Reflections":
+            journal_reflections.render()
+        elif st.session_state.current_page == "Community Forum":
+            community_forum.render()
+        elif st.session_state.current_page == "Knowledge Base Search":
+            knowledge_base_search.render()
+        elif st.session_state.current_page == "FAQs":
+            faqs.render()
+        elif st.session_state.current_page == "About This Project":
+            about_project.render()
 
     # Footer
     _render_footer()
 
+    # Keep what changed in this run, so a reconnect or worker restart resumes here
+    _save_session()
+
 if __name__ == "__main__":
     main()
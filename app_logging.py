@@ -0,0 +1,177 @@
+"""Structured JSON logging that never blocks request threads.
+
+Every record is one JSON line with the time, level, subsystem, event, and — where known —
+the session id, page, stage and duration. Records are handed to a bounded queue and
+written by a background listener thread, so a slow or blocked stderr never holds up a
+Streamlit script run or an API request; if the queue fills up, records are dropped and
+counted rather than waited on.
+
+Configuration (environment):
+    LOG_LEVEL=INFO                          default level for every subsystem
+    LOG_LEVELS=chat=DEBUG,cache=WARNING     per-subsystem overrides
+    LOG_SAMPLING=cache.hit=0.01             keep this fraction of a high-volume event
+    LOG_FILE=/var/log/support.jsonl         write there instead of stderr
+
+Use:
+    log = get_logger("chat")
+    log.info("answered", extra={"stage": "model", "duration_ms": 812})
+    with timed(log, "search", query_terms=3):
+        ...
+"""
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+
+ROOT_LOGGER = "support"
+QUEUE_SIZE = 10_000
+_STANDARD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "sample"}
+
+_session_id = contextvars.ContextVar("session_id", default=None)
+_page = contextvars.ContextVar("page", default=None)
+
+
+def set_log_context(session_id=None, page=None):
+    """Tags every record logged from the current thread or task with a session and page."""
+    _session_id.set(session_id)
+    _page.set(page)
+
+
+def _parse_pairs(value):
+    pairs = {}
+    for item in value.split(","):
+        name, _, setting = item.partition("=")
+        if name.strip() and setting.strip():
+            pairs[name.strip()] = setting.strip()
+    return pairs
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        payload = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "subsystem": record.name.removeprefix(f"{ROOT_LOGGER}."),
+            "event": record.getMessage(),
+            "session_id": getattr(record, "session_id", None),
+            "page": getattr(record, "page", None),
+        }
+        for name, value in vars(record).items():
+            if name not in _STANDARD_ATTRIBUTES and name not in payload:
+                payload[name] = value
+        if record.exc_info:
+            payload["exception"] = "".join(traceback.format_exception(*record.exc_info)).rstrip()
+        elif record.exc_text:
+            payload["exception"] = record.exc_text
+        return json.dumps({k: v for k, v in payload.items() if v is not None}, ensure_ascii=False, default=str)
+
+
+class _ContextFilter(logging.Filter):
+    """Stamps records with the calling thread's session and page, and drops sampled-out records before they are queued."""
+
+    def __init__(self, sampling):
+        super().__init__()
+        self._sampling = sampling # "subsystem.event" -> fraction kept
+
+    def filter(self, record):
+        if getattr(record, "session_id", None) is None:
+            record.session_id = _session_id.get()
+        if getattr(record, "page", None) is None:
+            record.page = _page.get()
+        rate = self._sampling.get(f"{record.name.removeprefix(ROOT_LOGGER + '.')}.{record.msg}", getattr(record, "sample", None))
+        if rate is not None and rate < 1:
+            if random.random() >= rate:
+                return False
+            record.sample_rate = rate # Lets readers scale counts back up
+        return True
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that drops records instead of blocking when the queue is full.
+
+    The next record that does get through carries the number dropped before it.
+    """
+
+    dropped = 0
+
+    def prepare(self, record):
+        # Render the message and traceback now, while the objects they reference are still alive,
+        # but leave the JSON encoding and the write to the listener thread
+        record.msg, record.args = record.getMessage(), None
+        if record.exc_info:
+            record.exc_text = "".join(traceback.format_exception(*record.exc_info)).rstrip()
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        if self.dropped:
+            record.dropped_records = self.dropped
+        try:
+            self.queue.put_nowait(record)
+            self.dropped = 0
+        except queue.Full:
+            self.dropped += 1
+
+
+_configured = False
+_configure_lock = threading.Lock()
+_listener = None
+
+
+def configure_logging():
+    """Sets up the queue handler and listener thread once per process."""
+    global _configured, _listener
+    with _configure_lock:
+        if _configured:
+            return
+        log_file = os.getenv("LOG_FILE", "")
+        output = logging.FileHandler(log_file, encoding="utf-8") if log_file else logging.StreamHandler(sys.stderr)
+        output.setFormatter(JsonFormatter())
+        handler = _DroppingQueueHandler(queue.Queue(maxsize=QUEUE_SIZE))
+        handler.addFilter(_ContextFilter({
+            event: float(rate) for event, rate in _parse_pairs(os.getenv("LOG_SAMPLING", "")).items()
+        }))
+        root = logging.getLogger(ROOT_LOGGER)
+        root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+        root.addHandler(handler)
+        root.propagate = False # Keep our JSON lines out of Streamlit's own log output
+        for subsystem, level in _parse_pairs(os.getenv("LOG_LEVELS", "")).items():
+            logging.getLogger(f"{ROOT_LOGGER}.{subsystem}").setLevel(level.upper())
+        _listener = logging.handlers.QueueListener(handler.queue, output, respect_handler_level=False)
+        _listener.start()
+        atexit.register(_listener.stop) # Writes whatever is still queued when the process exits
+        _configured = True
+
+
+def get_logger(subsystem):
+    """Returns the logger for a subsystem (e.g. "chat", "api", "cache"), configuring logging on first use."""
+    configure_logging()
+    return logging.getLogger(f"{ROOT_LOGGER}.{subsystem}")
+
+
+@contextmanager
+def timed(logger, stage, level=logging.INFO, sample=None, **fields):
+    """Logs one record for a stage when it finishes, with its duration and outcome.
+
+    Failures are logged at ERROR with the traceback and re-raised.
+    """
+    start = time.perf_counter()
+    try:
+        yield fields # Callers may add fields, e.g. fields["source"] = "cache"
+    except Exception:
+        logger.error(f"{stage}_failed", exc_info=True, extra=dict(
+            fields, stage=stage, duration_ms=round((time.perf_counter() - start) * 1000, 1)
+        ))
+        raise
+    logger.log(level, stage, extra=dict(
+        fields, stage=stage, duration_ms=round((time.perf_counter() - start) * 1000, 1), sample=sample
+    ))
@@ -0,0 +1,62 @@
+"""Private on-disk location for the app's own files: the shared cache, session snapshots and
+knowledge base artifacts that cannot be written next to their source.
+
+Everything lives under APP_DATA_DIR (default ~/.cache/support_app), a directory owned by
+the app's user with 0700 permissions. Files another user owns, or could have replaced, are
+refused rather than read: several of them hold private journal text, and the app trusts what
+it reads back.
+"""
+import os
+import stat
+
+APP_DATA_DIR = os.getenv("APP_DATA_DIR") or os.path.join(
+    os.getenv("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"), "support_app"
+)
+
+
+def _check_owner(path, info):
+    # Windows has no uids; there the directory's ACLs are left to the platform defaults
+    if hasattr(os, "getuid") and info.st_uid != os.getuid():
+        raise PermissionError(f"{path} is owned by another user")
+
+
+def private_dir(*parts):
+    """Returns APP_DATA_DIR joined with parts, creating each level with 0700 permissions.
+
+    Raises PermissionError if a level is a symlink or belongs to another user.
+    """
+    levels = [APP_DATA_DIR]
+    for part in parts:
+        levels.append(os.path.join(levels[-1], part))
+    for path in levels:
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        info = os.lstat(path)
+        if not stat.S_ISDIR(info.st_mode):
+            raise PermissionError(f"{path} is not a directory")
+        _check_owner(path, info)
+        if stat.S_IMODE(info.st_mode) & 0o077:
+            os.chmod(path, 0o700)
+    return levels[-1]
+
+
+def private_file(path, create=False):
+    """Checks that an existing file belongs to this user and tightens it to 0600; returns the path.
+
+    A missing file is created empty with 0600 permissions if create is set, and otherwise left
+    missing. Raises PermissionError for symlinks and files owned by another user.
+    """
+    try:
+        info = os.lstat(path)
+    except FileNotFoundError:
+        if create:
+            try:
+                os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600))
+            except FileExistsError:
+                return private_file(path) # Created meanwhile by another process; check whose it is
+        return path
+    if not stat.S_ISREG(info.st_mode):
+        raise PermissionError(f"{path} is not a regular file")
+    _check_owner(path, info)
+    if stat.S_IMODE(info.st_mode) & 0o077:
+        os.chmod(path, 0o600)
+    return path
@@ -0,0 +1,157 @@
+"""Near-duplicate detection for community posts with MinHash signatures and LSH banding.
+
+Each post is reduced to a fixed-size MinHash signature. The signature is split into bands,
+and each band is hashed into a bucket; posts that share any bucket are candidates, and
+only candidates are compared. A sliding window of recent posts bounds the buckets, so a
+check costs the same however many posts the forum has.
+
+Signatures are stored on the post documents, so after a restart the window is refilled
+from the latest posts without recomputing anything. The store is also how the windows of
+separate worker processes stay in step: every REFRESH_SECONDS at most, each process loads
+the posts stored since its last refresh, so a flood spread across workers is still seen.
+"""
+import hashlib
+import random
+import threading
+import time
+from collections import deque
+
+from text_analysis import tokenize
+
+NUM_PERMUTATIONS = 64
+BANDS = 16 # 16 bands of 4 rows puts the LSH threshold near a Jaccard similarity of 0.5
+ROWS_PER_BAND = NUM_PERMUTATIONS // BANDS
+DUPLICATE_THRESHOLD = 0.8 # Estimated Jaccard similarity at or above which posts count as duplicates
+WINDOW_POSTS = 500 # Recent posts kept for comparison...
+WINDOW_SECONDS = 24 * 60 * 60 # ...and for at most this long
+SHINGLE_WORDS = 3
+SHINGLE_CHARS = 5 # Used instead of word shingles for very short posts
+REFRESH_SECONDS = 2 # How stale a process's window may get with respect to posts made through other processes
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_rng = random.Random(20250718) # Fixed seed: stored signatures must stay comparable across restarts
+_PERMUTATIONS = [(_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME)) for _ in range(NUM_PERMUTATIONS)]
+
+
+def _shingles(text):
+    """Returns the set of overlapping word (or, for short posts, character) shingles of a post.
+
+    Words are normalized but not stemmed or filtered, so only genuinely repeated wording matches.
+    For ASCII text this is the plain lowercase split stored signatures were made with.
+    """
+    words = tokenize(text)
+    if len(words) >= SHINGLE_WORDS:
+        return {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+    joined = " ".join(words)
+    return {joined[i:i + SHINGLE_CHARS] for i in range(max(1, len(joined) - SHINGLE_CHARS + 1))}
+
+
+def minhash(text):
+    """Returns the MinHash signature of a post as a list of NUM_PERMUTATIONS ints."""
+    hashes = [
+        int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "little")
+        for shingle in _shingles(text)
+    ]
+    return [min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in _PERMUTATIONS]
+
+
+def similarity(signature_a, signature_b):
+    """Estimates the Jaccard similarity of two posts from their signatures."""
+    return sum(a == b for a, b in zip(signature_a, signature_b)) / NUM_PERMUTATIONS
+
+
+def _bands(signature):
+    return [(band, hash(tuple(signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]))) for band in range(BANDS)]
+
+
+class DuplicateDetector:
+    """LSH index over a sliding window of recent post signatures."""
+
+    def __init__(self, window_posts=WINDOW_POSTS, window_seconds=WINDOW_SECONDS):
+        self._window_posts = window_posts
+        self._window_seconds = window_seconds
+        self._window = deque() # (post id, user id, posted at, signature), oldest first
+        self._buckets = {} # (band, band hash) -> set of post ids
+        self._posts = {} # post id -> (user id, signature)
+        self._stored_until = None # Newest stored timestamp loaded so far
+        self._refreshed_at = float("-inf")
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._window)
+
+    def _evict(self, now):
+        while self._window and (len(self._window) > self._window_posts or now - self._window[0][2] > self._window_seconds):
+            post_id, _, _, signature = self._window.popleft()
+            self._posts.pop(post_id, None)
+            for key in _bands(signature):
+                bucket = self._buckets.get(key)
+                if bucket is not None:
+                    bucket.discard(post_id)
+                    if not bucket:
+                        del self._buckets[key]
+
+    def find_duplicate(self, signature, now=None):
+        """Returns (post id, user id, similarity) of the closest recent near-duplicate, or None."""
+        now = time.time() if now is None else now
+        with self._lock:
+            self._evict(now)
+            candidates = set()
+            for key in _bands(signature):
+                candidates.update(self._buckets.get(key, ()))
+            best = None
+            for post_id in candidates:
+                user_id, other = self._posts[post_id]
+                score = similarity(signature, other)
+                if score >= DUPLICATE_THRESHOLD and (best is None or score > best[2]):
+                    best = (post_id, user_id, score)
+            return best
+
+    def add(self, post_id, user_id, signature, posted_at=None):
+        """Adds a post to the window."""
+        posted_at = time.time() if posted_at is None else posted_at
+        with self._lock:
+            if post_id in self._posts:
+                return
+            self._window.append((post_id, user_id, posted_at, signature))
+            self._posts[post_id] = (user_id, signature)
+            for key in _bands(signature):
+                self._buckets.setdefault(key, set()).add(post_id)
+            self._evict(posted_at)
+
+    def load(self, posts):
+        """Refills the window from stored posts, oldest first: dicts with id, userId, posted_at and minhash."""
+        for post in posts:
+            signature = post.get("minhash")
+            if signature and len(signature) == NUM_PERMUTATIONS:
+                self.add(post["id"], post.get("userId"), signature, post["posted_at"])
+            with self._lock:
+                self._stored_until = max(self._stored_until or post["posted_at"], post["posted_at"])
+
+    def refresh(self, load_recent, now=None):
+        """Loads posts stored since the last refresh, at most once every REFRESH_SECONDS.
+
+        load_recent(limit, since) returns stored posts as load() takes them, posted at or after
+        since (a timestamp, or None for the latest ones). Posts already in the window are skipped.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            if now - self._refreshed_at < REFRESH_SECONDS:
+                return
+            self._refreshed_at = now # Concurrent sessions skip the read rather than repeat it
+            since = self._stored_until
+        self.load(load_recent(self._window_posts, since))
+
+
+_detectors = {} # collection path -> DuplicateDetector, shared by every session in the process
+_detectors_lock = threading.Lock()
+
+
+def get_duplicate_detector(collection_path, load_recent):
+    """Returns the shared detector for a post collection, brought up to date with load_recent(limit, since)."""
+    with _detectors_lock:
+        detector = _detectors.get(collection_path)
+        if detector is None:
+            detector = _detectors[collection_path] = DuplicateDetector()
+    detector.refresh(load_recent) # Outside the lock, so a slow store read never holds up other collections
+    return detector
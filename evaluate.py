@@ -0,0 +1,173 @@
+"""Batch evaluation of the chat pipeline over a file of questions.
+
+Each question goes through the same precomputed-answer lookup, routing, prompt building and
+resource suggestions as the chat page, on a bounded pool of workers, against Gemini or the
+offline stand-in. One JSON line per question is written with its source ("precomputed" or
+"model"), the route, prompt size, bytes actually sent, latency, token counts and output,
+followed by aggregate throughput, sources and token totals on stderr.
+
+Input is JSONL, one {"question": "...", "locale": "sw", "id": "..."} per line; only
+"question" is required. Answers are never read from or written to the shared cache, so
+latencies and token counts of model answers reflect real model calls.
+
+    python evaluate.py questions.jsonl [-o results.jsonl] [--workers 8] [--local-model]
+                       [--knowledge-base path/to/edited_knowledge_base.txt] [--prefix-cache local]
+"""
+import argparse
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from faq_answers import find_precomputed
+from kb_artifact import load_artifact
+from kb_locales import DEFAULT_LOCALE, get_knowledge_base
+from prompt_templates import LocalPrefixCache, estimate_tokens, prompt_parts, route, send_prompt, set_prefix_cache
+from support_core import LocalModel, create_model, suggest_resources
+
+DEFAULT_WORKERS = 8
+
+
+def read_questions(path):
+    """Reads question records from a JSONL file, skipping blank lines."""
+    questions = []
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if not isinstance(record.get("question"), str) or not record["question"].strip():
+                raise ValueError(f"{path}:{line_number}: each line needs a non-empty \"question\".")
+            record.setdefault("id", str(line_number))
+            record.setdefault("locale", DEFAULT_LOCALE)
+            questions.append(record)
+    return questions
+
+
+def evaluate_question(model_instance, knowledge_base_for, record):
+    """Runs one question through the pipeline and returns its result record."""
+    question = record["question"].strip()
+    knowledge_base = knowledge_base_for(record["locale"])
+    start = time.perf_counter()
+    # As in support_core.answer: a precomputed answer is served without building a prompt
+    precomputed = find_precomputed(question, record["locale"], knowledge_base)
+    if precomputed is not None:
+        entry, score = precomputed
+        return {
+            "id": record["id"],
+            "question": question,
+            "locale": record["locale"],
+            "source": "precomputed",
+            "precomputed_from": entry["source"], # "curated" or "generated"
+            "match_score": round(score, 3),
+            "route": None,
+            "kb_version": knowledge_base.version,
+            "prompt_bytes": 0,
+            "prefix_tokens": 0,
+            "resources": suggest_resources(question, record["locale"]),
+            "bytes_sent": 0,
+            "answer": entry["answer"],
+            "error": None,
+            "latency_ms": round((time.perf_counter() - start) * 1000, 1),
+            "prompt_tokens": 0,
+            "output_tokens": 0,
+            "tokens_estimated": False,
+        }
+    prefix, suffix = prompt_parts(knowledge_base, question, record["locale"])
+    result = {
+        "id": record["id"],
+        "question": question,
+        "locale": record["locale"],
+        "source": "model",
+        "route": route(question, record["locale"]),
+        "kb_version": knowledge_base.version,
+        "prompt_bytes": prefix.size + len(suffix.encode("utf-8")),
+        "prefix_tokens": prefix.tokens,
+        "resources": suggest_resources(question, record["locale"]),
+    }
+    start = time.perf_counter()
+    try:
+        response, result["bytes_sent"] = send_prompt(model_instance, prefix, suffix)
+        result["answer"] = response.text or ""
+        result["error"] = None
+    except Exception as e:
+        response = None
+        result["bytes_sent"] = 0
+        result["answer"] = ""
+        result["error"] = str(e)
+    result["latency_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None:
+        result["prompt_tokens"] = usage.prompt_token_count
+        result["output_tokens"] = usage.candidates_token_count
+        result["tokens_estimated"] = isinstance(model_instance, LocalModel)
+    else:
+        result["prompt_tokens"] = prefix.tokens + estimate_tokens(suffix)
+        result["output_tokens"] = estimate_tokens(result["answer"])
+        result["tokens_estimated"] = True
+    return result
+
+
+def summarize(results, elapsed):
+    """Returns aggregate throughput, latency and token totals for a run."""
+    latencies = sorted(result["latency_ms"] for result in results)
+    routes, sources = {}, {}
+    for result in results:
+        sources[result["source"]] = sources.get(result["source"], 0) + 1
+        if result["route"] is not None: # Precomputed answers are never routed
+            routes[result["route"]] = routes.get(result["route"], 0) + 1
+    return {
+        "questions": len(results),
+        "errors": sum(1 for result in results if result["error"]),
+        "elapsed_s": round(elapsed, 2),
+        "questions_per_s": round(len(results) / elapsed, 2) if elapsed else None,
+        "latency_p50_ms": latencies[len(latencies) // 2] if latencies else None,
+        "latency_p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else None,
+        "prompt_bytes": sum(result["prompt_bytes"] for result in results),
+        "bytes_sent": sum(result["bytes_sent"] for result in results),
+        "prompt_tokens": sum(result["prompt_tokens"] for result in results),
+        "output_tokens": sum(result["output_tokens"] for result in results),
+        "sources": sources,
+        "routes": routes,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a JSONL file of questions through the chat pipeline.")
+    parser.add_argument("questions", help="JSONL file with one {\"question\": ...} per line.")
+    parser.add_argument("-o", "--output", help="Where to write per-question results (default: stdout).")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Questions evaluated at once.")
+    parser.add_argument("--local-model", action="store_true", help="Answer with the offline stand-in instead of Gemini.")
+    parser.add_argument("--model-delay", type=float, default=0.2, help="Seconds the local model takes per answer.")
+    parser.add_argument("--prefix-cache", choices=["local"], help="Reference prompt prefixes through the local stand-in cache.")
+    parser.add_argument("--knowledge-base", help="Evaluate against this knowledge base file or directory for every locale.")
+    args = parser.parse_args(argv)
+
+    questions = read_questions(args.questions)
+    if args.prefix_cache == "local":
+        set_prefix_cache(LocalPrefixCache())
+    model_instance = LocalModel(delay=args.model_delay) if args.local_model else create_model()
+    if args.knowledge_base:
+        override = load_artifact(args.knowledge_base)
+        knowledge_base_for = lambda locale: override
+    else:
+        knowledge_base_for = get_knowledge_base
+
+    output = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    results = []
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, args.workers)) as pool:
+            # map() keeps input order while up to `workers` questions are in flight
+            for result in pool.map(lambda record: evaluate_question(model_instance, knowledge_base_for, record), questions):
+                results.append(result)
+                output.write(json.dumps(result, ensure_ascii=False) + "\n")
+                output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    print(json.dumps(summarize(results, time.perf_counter() - start), indent=2), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""Precomputed answers for frequently asked questions, served without a model call.
+
+Two kinds of answers are stored:
+  * the curated FAQ answers shown on the FAQs page, which are always valid;
+  * model answers to a configurable list of canonical questions (canonical_questions.jsonl),
+    generated offline and tied to the knowledge base sections they were generated from.
+
+Incoming chat questions are matched against the stored questions with a TF-IDF
+nearest-neighbour lookup; a match above PRECOMPUTED_MIN_SCORE that also contains every
+significant word of the incoming question is answered straight from the store, and anything
+else falls through to the live model. A question that adds its own context ("... I'm 44")
+therefore reaches the model, which sees that context. A generated answer is ignored once a
+knowledge base section or prompt template it depends on changes, until the job is rerun;
+the job only regenerates those answers:
+
+    python faq_answers.py [--questions canonical_questions.jsonl] [-o precomputed_answers.json] [--local-model]
+    python faq_answers.py --check  # Which sample questions would be answered from the store
+"""
+import argparse
+import json
+import math
+import os
+import threading
+
+from app_logging import get_logger
+from kb_locales import DEFAULT_LOCALE, get_knowledge_base
+from prompt_templates import answer_fingerprint, prompt_parts, send_prompt
+from text_analysis import analyze, text_key
+
+CANONICAL_QUESTIONS_PATH = os.getenv("CANONICAL_QUESTIONS_PATH", "canonical_questions.jsonl")
+PRECOMPUTED_ANSWERS_PATH = os.getenv("PRECOMPUTED_ANSWERS_PATH", "precomputed_answers.json")
+PRECOMPUTED_MIN_SCORE = float(os.getenv("PRECOMPUTED_MIN_SCORE", "0.8")) # Cosine similarity needed to skip the model
+MIN_SIGNIFICANT_CHARS = 3 # Shorter words are mostly pieces of contractions ("I'm" -> "m"); numbers always count
+
+_log = get_logger("faq")
+
+# Curated answers, shown on the FAQs page and served directly to matching chat questions
+FAQS = [
+    ("What is a miscarriage?",
+     "A miscarriage is the spontaneous loss of a pregnancy before the 20th week. It's a common occurrence, affecting about 10-20% of known pregnancies."),
+    ("What causes miscarriage?",
+     "Most miscarriages (around 80%) are caused by chromosomal abnormalities in the embryo, meaning the baby isn't developing as it should. Other causes can include hormonal imbalances, uterine abnormalities, infections, or certain chronic health conditions in the mother. Lifestyle factors generally do not cause miscarriage."),
+    ("Is it my fault if I have a miscarriage?",
+     "Absolutely not. Miscarriages are rarely caused by anything a person did or didn't do. It's a common misconception that stress, exercise, or minor falls can cause miscarriage, but this is generally untrue. The vast majority are due to factors beyond anyone's control."),
+    ("What are the common symptoms of miscarriage?",
+     "Common symptoms include vaginal bleeding (which can range from light spotting to heavy bleeding), abdominal cramping or pain, and the passing of tissue or fluid from the vagina. However, some people may experience a \"missed miscarriage\" with no outward symptoms."),
+    ("How long does the physical recovery take after a miscarriage?",
+     "Physical recovery varies for each individual, but it typically takes a few days to a few weeks. Bleeding and cramping may last for a week or two. It's important to follow your healthcare provider's advice for post-miscarriage care."),
+    ("How long does the emotional recovery take?",
+     "Emotional recovery is highly individual and can take much longer than physical recovery. Grief is a natural response, and it's normal to experience a range of emotions, including sadness, anger, guilt, and anxiety. There's no set timeline for healing, and seeking emotional support can be very helpful."),
+    ("When can I try to conceive again after a miscarriage?",
+     "This is a question best answered by your healthcare provider, as it depends on individual circumstances and the type of miscarriage. Medically, many providers suggest waiting for at least one normal menstrual cycle before trying again, but emotional readiness is also a key factor."),
+]
+
+
+def normalize_question(question, locale=DEFAULT_LOCALE):
+    """Returns the normalized form used to compare questions exactly: stemmed, case-folded words joined by spaces."""
+    return text_key(question, locale)
+
+
+def significant_terms(question, locale=DEFAULT_LOCALE):
+    """Returns the stemmed words of a question that a stored question must also contain to answer it."""
+    return {term for term in analyze(question, locale) if len(term) >= MIN_SIGNIFICANT_CHARS or term.isdigit()}
+
+
+class AnswerIndex:
+    """TF-IDF nearest-neighbour index over stored questions for one locale.
+
+    Questions are compared by their stemmed words; stopwords are kept, since "when" and
+    "how long" tell questions apart, and weigh little through their IDF. Only stored
+    questions sharing a term with the incoming one are scored, through an inverted index,
+    so a lookup costs a few dictionary reads however many answers exist. A stored question
+    missing any significant word of the incoming one is never a match, however high its score.
+    """
+
+    def __init__(self, entries, locale=DEFAULT_LOCALE):
+        self._entries = entries
+        self._locale = locale
+        self._exact = {normalize_question(entry["question"], locale): i for i, entry in enumerate(entries)}
+        documents = [set(analyze(entry["question"], locale, keep_stopwords=True)) for entry in entries]
+        doc_freq = {}
+        for terms in documents:
+            for term in terms:
+                doc_freq[term] = doc_freq.get(term, 0) + 1
+        count = len(documents)
+        self._idf = {term: math.log((1 + count) / (1 + df)) + 1 for term, df in doc_freq.items()}
+        self._unseen_idf = math.log(1 + count) + 1 # Words no stored question uses count fully against a match
+        self._terms = documents
+        self._postings = {}
+        self._norms = []
+        for i, terms in enumerate(documents):
+            for term in terms:
+                self._postings.setdefault(term, []).append(i)
+            self._norms.append(math.sqrt(sum(self._idf[term] ** 2 for term in terms)) or 1.0)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def match(self, question):
+        """Returns (entry, cosine similarity) for the closest stored question, or (None, 0.0)."""
+        exact = self._exact.get(normalize_question(question, self._locale))
+        if exact is not None:
+            return self._entries[exact], 1.0
+        terms = set(analyze(question, self._locale, keep_stopwords=True))
+        if not terms:
+            return None, 0.0
+        query_norm = math.sqrt(sum(self._idf.get(term, self._unseen_idf) ** 2 for term in terms))
+        scores = {}
+        for term in terms:
+            weight = self._idf.get(term)
+            if weight is None:
+                continue
+            for i in self._postings[term]:
+                scores[i] = scores.get(i, 0.0) + weight * weight
+        required = significant_terms(question, self._locale)
+        scores = {i: score for i, score in scores.items() if required <= self._terms[i]}
+        if not scores:
+            return None, 0.0
+        best = max(scores, key=lambda i: scores[i] / self._norms[i])
+        return self._entries[best], scores[best] / (self._norms[best] * query_norm)
+
+
+_indexes = {} # (store path, store mtime, locale, knowledge base version) -> AnswerIndex
+_indexes_lock = threading.Lock()
+
+
+def _read_store(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"answers": []}
+
+
+def is_current(entry, knowledge_base):
+    """Checks whether a generated answer still matches the prompt template and knowledge base sections it was generated from."""
+    # Even with an unchanged knowledge base version the prompt template may have changed
+    return entry.get("depends_on") == answer_fingerprint(knowledge_base, entry["question"], entry["locale"])
+
+
+def answer_index(locale, knowledge_base, path=PRECOMPUTED_ANSWERS_PATH):
+    """Returns the index of answers valid for a locale and knowledge base.
+
+    Rebuilt only when the store file or the knowledge base version changes.
+    """
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+    key = (path, mtime, locale, knowledge_base.version)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            entries = [
+                {"question": question, "answer": text, "source": "curated"}
+                for question, text in FAQS if locale == DEFAULT_LOCALE
+            ]
+            entries += [
+                entry for entry in _read_store(path)["answers"]
+                if entry["locale"] == locale and is_current(entry, knowledge_base)
+            ]
+            # Only the current generation of each locale is kept
+            for stale in [k for k in _indexes if k[2] == locale]:
+                del _indexes[stale]
+            index = _indexes[key] = AnswerIndex(entries, locale)
+        return index
+
+
+def find_precomputed(question, locale, knowledge_base, min_score=PRECOMPUTED_MIN_SCORE):
+    """Returns (stored answer entry, score) if a stored question is close enough, otherwise None."""
+    entry, score = answer_index(locale, knowledge_base).match(question)
+    if entry is None or score < min_score:
+        return None
+    return entry, score
+
+
+def read_canonical_questions(path):
+    """Reads {"question", "locale"?} records from a JSONL file."""
+    questions = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                questions.append((record["question"].strip(), record.get("locale", DEFAULT_LOCALE)))
+    return questions
+
+
+def generate_answers(model_instance, questions, previous=()):
+    """Answers canonical questions with the live pipeline; returns store entries tagged with what they depend on.
+
+    Entries in previous that are still current are kept instead of asking the model again.
+    """
+    reusable = {(entry["question"], entry["locale"]): entry for entry in previous}
+    answers, kept = [], 0
+    for question, locale in questions:
+        knowledge_base = get_knowledge_base(locale)
+        depends_on = answer_fingerprint(knowledge_base, question, locale)
+        entry = reusable.get((question, locale))
+        if entry is not None and entry.get("depends_on") == depends_on:
+            answers.append(dict(entry, kb_version=knowledge_base.version, depends_on=depends_on))
+            kept += 1
+            continue
+        response, _ = send_prompt(model_instance, *prompt_parts(knowledge_base, question, locale))
+        if response.text:
+            answers.append({
+                "question": question,
+                "locale": locale,
+                "kb_version": knowledge_base.version,
+                "depends_on": depends_on,
+                "answer": response.text,
+                "source": "generated",
+            })
+        else:
+            _log.warning("no_answer_generated", extra={"stage": "precompute", "question": question})
+    _log.info("answers_generated", extra={"stage": "precompute", "generated": len(answers) - kept, "kept": kept})
+    return answers
+
+
+# (question, whether a curated answer may serve it); questions adding personal context must reach the model
+CHECK_QUESTIONS = [
+    ("When can I try to conceive again after a miscarriage?", True),
+    ("when can i try to conceive again after miscarriage", True),
+    ("What causes a miscarriage?", True),
+    ("When can I try to conceive again after a miscarriage? I'm 44", False),
+    ("When can I try to conceive again after a miscarriage with twins?", False),
+    ("How long does the physical recovery take after a miscarriage at 12 weeks?", False),
+    ("Is it my fault if I have a miscarriage after drinking coffee?", False),
+]
+
+
+def _check():
+    """Matches CHECK_QUESTIONS against the curated answers; returns whether every one was routed as expected."""
+    index = AnswerIndex([{"question": question, "answer": text, "source": "curated"} for question, text in FAQS])
+    ok = True
+    for question, expected in CHECK_QUESTIONS:
+        entry, score = index.match(question)
+        served = entry is not None and score >= PRECOMPUTED_MIN_SCORE
+        ok = ok and served == expected
+        print(f"{'ok  ' if served == expected else 'FAIL'} {'store' if served else 'model'} {score:.2f} {question}")
+    return ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate precomputed answers for canonical chat questions.")
+    parser.add_argument("--questions", default=CANONICAL_QUESTIONS_PATH, help="JSONL file of canonical questions.")
+    parser.add_argument("-o", "--output", default=PRECOMPUTED_ANSWERS_PATH, help="Where to write the answer store.")
+    parser.add_argument("--local-model", action="store_true", help="Answer with the offline stand-in instead of Gemini.")
+    parser.add_argument("--check", action="store_true", help="Check which sample questions the curated answers would serve.")
+    args = parser.parse_args(argv)
+    if args.check:
+        raise SystemExit(0 if _check() else 1)
+
+    from support_core import LocalModel, create_model
+
+    model_instance = LocalModel(delay=0) if args.local_model else create_model()
+    previous = _read_store(args.output)["answers"]
+    answers = generate_answers(model_instance, read_canonical_questions(args.questions), previous)
+    temp_path = args.output + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump({"answers": answers}, f, ensure_ascii=False, indent=1)
+    os.replace(temp_path, args.output) # Running app processes never see a half-written store
+    print(f"Wrote {len(answers)} precomputed answers to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+from bisect import bisect_left, bisect_right, insort
+
+from kb_locales import DEFAULT_LOCALE
+from text_analysis import TOKEN_RE, analyze, normalize_token, stem
+
+SNIPPET_RADIUS = 80 # Characters shown on each side of the first hit
+
+
+def _tokenize(text, locale):
+    """Yields (term, start, end) for every word in the text, with terms analyzed like queries.
+
+    Stopwords are kept: a journal is small and any word the user remembers should find it.
+    """
+    for match in TOKEN_RE.finditer(text):
+        yield stem(normalize_token(match.group()), locale), match.start(), match.end()
+
+
+class JournalIndex:
+    """Incremental inverted index over a single user's journal entries.
+
+    Entries are added one at a time as they are saved, so the index never has to be
+    rebuilt. Entry ids are positions in st.session_state.journal_entries. Words are matched
+    by their stems in the index's locale, so "visit" finds "visits" and "cafe" finds "Café".
+    """
+
+    def __init__(self, locale=DEFAULT_LOCALE):
+        self.locale = locale
+        self._postings = {} # term -> {entry_id: [(start, end), ...]}
+        self._entries = [] # entry_id -> {"timestamp": ..., "content": ...}
+        self._by_time = [] # Sorted (timestamp, entry_id) pairs for date-range queries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add_entry(self, timestamp, content):
+        """Indexes one new entry and returns its id."""
+        entry_id = len(self._entries)
+        self._entries.append({"timestamp": timestamp, "content": content})
+        for term, start, end in _tokenize(content, self.locale):
+            self._postings.setdefault(term, {}).setdefault(entry_id, []).append((start, end))
+        # Entries normally arrive in time order, so this is an append in practice
+        insort(self._by_time, (timestamp, entry_id))
+        return entry_id
+
+    def sync(self, entries):
+        """Indexes any entries in the list that the index has not seen yet."""
+        for entry in entries[len(self._entries):]:
+            self.add_entry(entry["timestamp"], entry["content"])
+
+    def search(self, query="", start=None, end=None, limit=20):
+        """Returns the newest entries matching every query term within the date range.
+
+        start and end are timestamp strings in the journal's "%Y-%m-%d %H:%M:%S" format
+        (a bare "%Y-%m-%d" works too); either may be None for an open range.
+        """
+        terms = analyze(query, self.locale, keep_stopwords=True)
+
+        # Restrict to the date range first using the sorted timestamps
+        lo = bisect_left(self._by_time, (start,)) if start else 0
+        hi = bisect_right(self._by_time, (end + "\uffff",)) if end else len(self._by_time)
+        in_range = self._by_time[lo:hi]
+
+        if terms:
+            postings = [self._postings.get(term, {}) for term in set(terms)]
+            postings.sort(key=len) # Intersect starting from the rarest term
+            matches = set(postings[0])
+            for posting in postings[1:]:
+                matches.intersection_update(posting)
+                if not matches:
+                    return []
+            candidates = [entry_id for _, entry_id in reversed(in_range) if entry_id in matches]
+        else:
+            postings = []
+            candidates = [entry_id for _, entry_id in reversed(in_range)]
+
+        results = []
+        for entry_id in candidates[:limit]:
+            entry = self._entries[entry_id]
+            spans = sorted(span for posting in postings for span in posting[entry_id])
+            results.append({
+                "id": entry_id,
+                "timestamp": entry["timestamp"],
+                "content": entry["content"],
+                "snippet": _highlight_snippet(entry["content"], spans),
+            })
+        return results
+
+
+def _highlight_snippet(content, spans):
+    """Returns a window of the content around the first hit with every hit in it bolded."""
+    if not spans:
+        window_start, window_end = 0, min(len(content), 2 * SNIPPET_RADIUS)
+    else:
+        window_start = max(0, spans[0][0] - SNIPPET_RADIUS)
+        window_end = min(len(content), spans[0][1] + SNIPPET_RADIUS)
+
+    parts = ["…" if window_start > 0 else ""]
+    cursor = window_start
+    for start, end in spans:
+        if start < cursor or end > window_end:
+            continue
+        parts.append(content[cursor:start])
+        parts.append(f"**{content[start:end]}**")
+        cursor = end
+    parts.append(content[cursor:window_end])
+    if window_end < len(content):
+        parts.append("…")
+    return "".join(parts).replace("\n", " ")
@@ -0,0 +1,772 @@
+"""Compiles the knowledge base into a versioned binary index the app can memory-map.
+
+Usage:
+    python kb_artifact.py knowledge_base.txt [-o knowledge_base.kbc]
+    python kb_artifact.py path/to/corpus_dir/ [-o corpus.kbc]
+
+The source is either one markdown file or a directory of .txt/.md files. Compilation
+streams over memory-mapped source files and spills the section table, chunk table,
+token stream and sorted postings runs to temporary files, so peak memory depends on
+the vocabulary size rather than the corpus size. The artifact does not copy the text:
+it stores byte offsets into the source files, which are memory-mapped again at read
+time so only the chunks actually used are ever turned into Python strings.
+
+Every section and chunk carries a content hash. When a stale artifact is recompiled, chunks
+whose bytes are unchanged reuse the previous artifact's tokens instead of being tokenized
+again, and diff_sections() reports which sections an edit touched, so caches keyed by
+section fingerprints only lose the entries that depend on them.
+
+Every table is a flat uint32 array in native byte order, so loading is a header read
+plus memoryview casts.
+"""
+import argparse
+import hashlib
+import heapq
+import json
+import mmap
+import os
+import re
+import shutil
+import struct
+import tempfile
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter
+
+from app_logging import get_logger
+from app_storage import APP_DATA_DIR, private_dir, private_file
+from text_analysis import TOKEN_RE, normalize_token
+
+FORMAT_VERSION = 6 # Bump whenever the layout or the tokenizer changes
+MAGIC = b"SHKB"
+BYTE_ORDER_MARK = 0x01020304
+ARTIFACT_SUFFIX = ".kbc"
+CORPUS_EXTENSIONS = (".txt", ".md")
+HEADING_RE = re.compile(rb"^(#{1,6})[ \t]+(.*?)[ \t]*\r?$")
+CHUNK_MAX_BYTES = 1500 # Paragraphs longer than this are split at line boundaries
+RUN_PAIRS = 500_000 # (term, chunk) pairs buffered before a sorted run is spilled to disk
+COPY_BLOCK = 1 << 20
+NO_PARENT = 0xFFFFFFFF
+MAX_FILE_BYTES = 0xFFFFFFFF # Offsets are uint32, so each source file must stay under 4 GiB
+HASH_BYTES = 8 # Size of the section and chunk content hashes
+
+# Section records: level, parent, file, title_start, title_end (into the section_titles block), start
+SECTION_FIELDS = 6
+# Chunk records: section, file, start, end, token_start, token_end
+CHUNK_FIELDS = 6
+
+BLOCKS = (
+    "files", "sections", "chunks", "tokens", "token_spans", "vocab_offsets", "vocab", "vocab_sorted",
+    "doc_freq", "term_freq", "posting_offsets", "postings", "section_titles", "section_hashes", "chunk_hashes",
+    "chunk_order",
+)
+SPILLED_BLOCKS = (
+    "sections", "chunks", "tokens", "token_spans", "postings", "section_titles", "section_hashes", "chunk_hashes",
+    "chunk_order",
+)
+# Tables merged from sorted runs of packed (key << 32 | chunk) pairs: postings are keyed by term
+# id, chunk_order by the first 4 bytes of the chunk hash, so chunks can be found by hash with bisect
+MERGED_BLOCKS = ("postings", "chunk_order")
+_HEADER = struct.Struct("=4sII32sQQ") # magic, version, byte order mark, corpus sha256, total tokens, total bytes
+_BLOCK = struct.Struct("=QQ") # offset, length in bytes
+
+_log = get_logger("kb")
+
+
+def _content_hash(data):
+    return hashlib.blake2b(data, digest_size=HASH_BYTES).digest()
+
+
+def _hash_key(digest):
+    return int.from_bytes(digest[:4], "big")
+
+
+def _token_spans(text, base):
+    """Yields (term, start, end) for each token, with byte offsets into the source file.
+
+    Terms are normalized with text_analysis, so the index holds case-folded, accent-free
+    words while the offsets still point at the original spelling. The text must have been
+    decoded with surrogateescape so re-encoding gives back the original bytes.
+    """
+    if text.isascii():
+        for match in TOKEN_RE.finditer(text):
+            yield match.group().lower(), base + match.start(), base + match.end()
+        return
+    byte_pos, char_pos = base, 0
+    for match in TOKEN_RE.finditer(text):
+        byte_pos += len(text[char_pos:match.start()].encode("utf-8", "surrogateescape"))
+        token_start = byte_pos
+        byte_pos += len(match.group().encode("utf-8"))
+        char_pos = match.end()
+        term = normalize_token(match.group())
+        if term: # A run of stray combining accents normalizes to nothing
+            yield term, token_start, byte_pos
+
+
+def _corpus_root(source_path):
+    """Returns the directory that corpus file paths are stored relative to."""
+    if os.path.isdir(source_path):
+        return source_path
+    return os.path.dirname(source_path) or "."
+
+
+def _corpus_files(source_path):
+    """Lists the corpus files under a source, relative to its root, in a stable order."""
+    if not os.path.isdir(source_path):
+        if not os.path.isfile(source_path):
+            raise FileNotFoundError(source_path)
+        return [os.path.basename(source_path)]
+    paths = []
+    for directory, _, names in os.walk(source_path):
+        for name in names:
+            if name.endswith(CORPUS_EXTENSIONS):
+                paths.append(os.path.relpath(os.path.join(directory, name), source_path))
+    return sorted(paths)
+
+
+def default_artifact_path(source_path):
+    """Returns where the artifact for a knowledge base file or directory lives by default."""
+    if os.path.isdir(source_path):
+        return source_path.rstrip("/\\") + ARTIFACT_SUFFIX
+    return os.path.splitext(source_path)[0] + ARTIFACT_SUFFIX
+
+
+class _TermRemap(dict):
+    """Maps a previous artifact's term ids to the new artifact's, adding terms on first use."""
+
+    def __init__(self, previous, term_id):
+        super().__init__()
+        self._previous = previous
+        self._term_id = term_id
+
+    def __missing__(self, old_id):
+        new_id = self[old_id] = self._term_id(self._previous.vocabulary[old_id])
+        return new_id
+
+
+class _IndexBuilder:
+    """Streams corpus files into spilled tables and sorted postings runs.
+
+    Given the previous artifact, chunks whose bytes are unchanged copy its tokens instead
+    of being tokenized again.
+    """
+
+    def __init__(self, work_dir, previous=None):
+        self._work_dir = work_dir
+        self._previous = previous
+        self._remap = _TermRemap(previous, self._term_id) if previous is not None else None
+        self.reused_chunks = 0
+        self._spills = {name: open(os.path.join(work_dir, name), "w+b") for name in SPILLED_BLOCKS}
+        self._term_ids = {}
+        self._vocab = bytearray()
+        self._vocab_offsets = array("I", [0])
+        self._doc_freq = array("I")
+        self._term_freq = array("I")
+        self._runs = {name: array("Q") for name in MERGED_BLOCKS} # Packed (key << 32 | chunk) pairs
+        self._run_paths = {name: [] for name in MERGED_BLOCKS}
+        self._file_count = 0
+        self._section_count = 0
+        self._chunk_count = 0
+        self._token_count = 0
+        self._byte_count = 0
+
+    def add_file(self, root, path):
+        """Indexes one corpus file and returns its file table entry."""
+        file_id = self._file_count
+        self._file_count += 1
+        with open(os.path.join(root, path), "rb") as f:
+            stat = os.fstat(f.fileno())
+            if stat.st_size > MAX_FILE_BYTES:
+                raise ValueError(f"{path} is larger than 4 GiB; split it into several files.")
+            digest = hashlib.file_digest(f, "sha256").hexdigest()
+            if stat.st_size:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    self._index_file(file_id, mapped)
+            else:
+                self._add_section(0, NO_PARENT, file_id, b"", 0)
+                self._spills["section_hashes"].write(_content_hash(b""))
+        self._byte_count += stat.st_size
+        return {"path": path, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest}
+
+    def _index_file(self, file_id, mapped):
+        # Each file gets a level-0 root section so chunks before the first heading have a home
+        stack = [(0, self._add_section(0, NO_PARENT, file_id, b"", 0))]
+        chunk_start = None
+        section_start = 0 # Each section's own bytes, up to the next heading, are hashed
+        offset = 0
+        for line in iter(mapped.readline, b""):
+            line_end = offset + len(line)
+            heading = HEADING_RE.match(line.rstrip(b"\n"))
+            if heading:
+                self._add_chunk(mapped, stack[-1][1], file_id, chunk_start, offset)
+                chunk_start = None
+                self._spills["section_hashes"].write(_content_hash(mapped[section_start:offset]))
+                section_start = offset
+                level = len(heading.group(1))
+                while len(stack) > 1 and stack[-1][0] >= level:
+                    stack.pop()
+                section_id = self._add_section(level, stack[-1][1], file_id, heading.group(2), offset)
+                stack.append((level, section_id))
+            elif not line.strip() or line.strip() == b"---":
+                self._add_chunk(mapped, stack[-1][1], file_id, chunk_start, offset)
+                chunk_start = None
+            elif chunk_start is None:
+                chunk_start = offset
+            elif line_end - chunk_start > CHUNK_MAX_BYTES:
+                self._add_chunk(mapped, stack[-1][1], file_id, chunk_start, offset)
+                chunk_start = offset
+            offset = line_end
+        self._add_chunk(mapped, stack[-1][1], file_id, chunk_start, offset)
+        self._spills["section_hashes"].write(_content_hash(mapped[section_start:offset]))
+
+    def _add_section(self, level, parent, file_id, title, start):
+        # Titles are copied into the artifact so an old version can still name its sections after the source changed
+        title_start = self._spills["section_titles"].tell()
+        self._spills["section_titles"].write(title)
+        array("I", (level, parent, file_id, title_start, title_start + len(title), start)).tofile(self._spills["sections"])
+        self._section_count += 1
+        return self._section_count - 1
+
+    def _term_id(self, term):
+        term_id = self._term_ids.get(term)
+        if term_id is None:
+            term_id = self._term_ids[term] = len(self._term_ids)
+            self._vocab += term.encode("utf-8")
+            self._vocab_offsets.append(len(self._vocab))
+            self._doc_freq.append(0)
+            self._term_freq.append(0)
+        return term_id
+
+    def _add_chunk(self, mapped, section_id, file_id, start, end):
+        if start is None:
+            return
+        data = mapped[start:end]
+        if not data.strip():
+            return
+        chunk_id = self._chunk_count
+        self._chunk_count += 1
+        digest = _content_hash(data)
+        self._spills["chunk_hashes"].write(digest)
+        self._add_pair("chunk_order", _hash_key(digest), chunk_id)
+        previous_id = self._previous.find_chunk(digest) if self._previous is not None else None
+        if previous_id is not None:
+            term_ids, spans = self._reuse_chunk(previous_id, start)
+            self.reused_chunks += 1
+        else:
+            term_ids, spans = array("I"), array("I")
+            for term, token_start, token_end in _token_spans(data.decode("utf-8", "surrogateescape"), start):
+                term_ids.append(self._term_id(term))
+                spans.extend((token_start, token_end))
+        token_start = self._token_count
+        self._token_count += len(term_ids)
+        term_ids.tofile(self._spills["tokens"])
+        spans.tofile(self._spills["token_spans"])
+        array("I", (section_id, file_id, start, end, token_start, self._token_count)).tofile(self._spills["chunks"])
+
+        for term_id, count in Counter(term_ids).items():
+            self._term_freq[term_id] += count
+            self._doc_freq[term_id] += 1
+            self._add_pair("postings", term_id, chunk_id)
+
+    def _reuse_chunk(self, previous_id, start):
+        """Copies the terms and token offsets of an identical chunk from the previous artifact."""
+        chunk = self._previous.chunk(previous_id)
+        term_ids = array("I", map(self._remap.__getitem__, self._previous.tokens[chunk["token_start"]:chunk["token_end"]]))
+        old_spans = self._previous._token_spans[2 * chunk["token_start"]:2 * chunk["token_end"]]
+        shift = start - chunk["start"] # The chunk may have moved within its file
+        spans = array("I", old_spans) if not shift else array("I", [offset + shift for offset in old_spans])
+        return term_ids, spans
+
+    def _add_pair(self, name, key, chunk_id):
+        self._runs[name].append(key << 32 | chunk_id)
+        if len(self._runs[name]) >= RUN_PAIRS:
+            self._spill_run(name)
+
+    def _spill_run(self, name):
+        if not self._runs[name]:
+            return
+        path = os.path.join(self._work_dir, f"{name}.run{len(self._run_paths[name])}")
+        with open(path, "wb") as f:
+            array("Q", sorted(self._runs[name])).tofile(f)
+        self._run_paths[name].append(path)
+        self._runs[name] = array("Q")
+
+    def _merge_runs(self, name):
+        """K-way merges the sorted runs of a table into its chunk ids, grouped by key."""
+        self._spill_run(name)
+        table = self._spills[name]
+        buffer = array("I")
+        for packed in heapq.merge(*(_read_run(path) for path in self._run_paths[name])):
+            buffer.append(packed & 0xFFFFFFFF)
+            if len(buffer) >= RUN_PAIRS:
+                buffer.tofile(table)
+                buffer = array("I")
+        buffer.tofile(table)
+
+    def write(self, files, artifact_path):
+        """Assembles the artifact from the in-memory and spilled tables."""
+        for name in MERGED_BLOCKS:
+            self._merge_runs(name)
+        posting_offsets = array("I", [0])
+        for doc_freq in self._doc_freq:
+            posting_offsets.append(posting_offsets[-1] + doc_freq)
+        # Term ids are assigned in first-seen order; this permutation gives sorted order for lookups
+        vocab_sorted = array("I", (term_id for _, term_id in sorted(self._term_ids.items())))
+
+        corpus_digest = hashlib.sha256("".join(entry["sha256"] for entry in files).encode("ascii")).digest()
+        in_memory = {
+            "files": json.dumps(files).encode("utf-8"),
+            "vocab_offsets": self._vocab_offsets.tobytes(),
+            "vocab": bytes(self._vocab),
+            "vocab_sorted": vocab_sorted.tobytes(),
+            "doc_freq": self._doc_freq.tobytes(),
+            "term_freq": self._term_freq.tobytes(),
+            "posting_offsets": posting_offsets.tobytes(),
+        }
+        for spill in self._spills.values():
+            spill.flush()
+
+        lengths = {name: len(in_memory[name]) if name in in_memory else self._spills[name].tell() for name in BLOCKS}
+        tmp_path = f"{artifact_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as out:
+            out.write(_HEADER.pack(MAGIC, FORMAT_VERSION, BYTE_ORDER_MARK, corpus_digest, self._token_count, self._byte_count))
+            offset = _HEADER.size + _BLOCK.size * len(BLOCKS)
+            layout = []
+            for name in BLOCKS:
+                offset += -offset % 8 # Keep every block 8-byte aligned for the uint32 casts
+                out.write(_BLOCK.pack(offset, lengths[name]))
+                layout.append((name, offset))
+                offset += lengths[name]
+            for name, block_offset in layout:
+                out.write(b"\0" * (block_offset - out.tell()))
+                if name in in_memory:
+                    out.write(in_memory[name])
+                else:
+                    self._spills[name].seek(0)
+                    shutil.copyfileobj(self._spills[name], out, COPY_BLOCK)
+        os.replace(tmp_path, artifact_path) # Readers with the old file mapped keep their view
+
+    def close(self):
+        for spill in self._spills.values():
+            spill.close()
+
+
+def _read_run(path):
+    """Yields the packed pairs of one sorted run, a block at a time."""
+    with open(path, "rb") as f:
+        while True:
+            block = array("Q")
+            block.frombytes(f.read(COPY_BLOCK))
+            if not block:
+                return
+            yield from block
+
+
+def write_artifact(source_path, artifact_path=None, previous=None):
+    """Compiles the knowledge base with bounded memory and atomically replaces the artifact on disk.
+
+    previous is an earlier artifact of the same knowledge base; its unchanged chunks are reused.
+    """
+    artifact_path = artifact_path or default_artifact_path(source_path)
+    root = _corpus_root(source_path)
+    paths = _corpus_files(source_path)
+    work_dir = tempfile.mkdtemp(prefix="kbc-", dir=os.path.dirname(os.path.abspath(artifact_path)))
+    start = time.perf_counter()
+    builder = _IndexBuilder(work_dir, previous)
+    try:
+        files = [builder.add_file(root, path) for path in paths]
+        builder.write(files, artifact_path)
+    finally:
+        builder.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+    _log.info("compiled", extra={
+        "stage": "compile", "artifact": artifact_path, "chunks": builder._chunk_count,
+        "reused_chunks": builder.reused_chunks, "duration_ms": round((time.perf_counter() - start) * 1000, 1),
+    })
+    return artifact_path
+
+
+class _Vocabulary:
+    """Read-only term list backed by the artifact's vocab blob, indexed by term id."""
+
+    def __init__(self, blob, offsets, sorted_ids):
+        self._blob = blob
+        self._offsets = offsets
+        self._sorted_ids = sorted_ids
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, term_id):
+        return str(self._blob[self._offsets[term_id]:self._offsets[term_id + 1]], "utf-8")
+
+    def sorted_term(self, rank):
+        """Returns the term at a position in sorted order."""
+        return self[self._sorted_ids[rank]]
+
+    def index(self, term):
+        """Returns the id of a term, or None if it is not in the vocabulary."""
+        rank = bisect_left(range(len(self)), term, key=self.sorted_term)
+        if rank < len(self) and self.sorted_term(rank) == term:
+            return self._sorted_ids[rank]
+        return None
+
+
+class KnowledgeBaseArtifact:
+    """A compiled knowledge base, read straight out of a memory-mapped artifact.
+
+    Text is never held as a whole: chunk and section text is read by offset from the
+    memory-mapped source files on demand.
+    """
+
+    def __init__(self, buffer, source_path):
+        self._buffer = buffer
+        view = memoryview(buffer)
+        magic, version, byte_order, digest, total_tokens, total_bytes = _HEADER.unpack_from(view)
+        if magic != MAGIC or version != FORMAT_VERSION or byte_order != BYTE_ORDER_MARK:
+            raise ValueError(f"Unsupported knowledge base artifact (format {version}, expected {FORMAT_VERSION}).")
+        self.source_path = source_path
+        self.source_sha256 = digest.hex()
+        self.total_tokens = total_tokens
+        self.corpus_size = total_bytes
+
+        blocks = {}
+        for i, name in enumerate(BLOCKS):
+            offset, length = _BLOCK.unpack_from(view, _HEADER.size + i * _BLOCK.size)
+            blocks[name] = view[offset:offset + length]
+        self.files = json.loads(str(blocks["files"], "utf-8"))
+        self._sections = blocks["sections"].cast("I")
+        self._chunks = blocks["chunks"].cast("I")
+        self.tokens = blocks["tokens"].cast("I")
+        self._token_spans = blocks["token_spans"].cast("I") # Byte (start, end) of each token in its file
+        self.doc_freq = blocks["doc_freq"].cast("I")
+        self.term_freq = blocks["term_freq"].cast("I")
+        self._posting_offsets = blocks["posting_offsets"].cast("I")
+        self._postings = blocks["postings"].cast("I")
+        self._section_titles = blocks["section_titles"]
+        self._section_hashes = blocks["section_hashes"]
+        self._chunk_hashes = blocks["chunk_hashes"]
+        self._chunk_order = blocks["chunk_order"].cast("I") # Chunk ids ordered by the first 4 bytes of their hash
+        self.vocabulary = _Vocabulary(blocks["vocab"], blocks["vocab_offsets"].cast("I"), blocks["vocab_sorted"].cast("I"))
+        self._root = _corpus_root(source_path)
+        self._maps = {} # file id -> mmap of the source file, opened on first read
+        self._section_lookup = {}
+        self._derived = {}
+        self._derived_locks = {} # name -> lock held while that structure is built
+        self._derived_lock = threading.Lock() # Guards _derived_locks only, never a build
+
+    @property
+    def version(self):
+        """Short content hash identifying this knowledge base version."""
+        return self.source_sha256[:16]
+
+    @property
+    def section_count(self):
+        return len(self._sections) // SECTION_FIELDS
+
+    @property
+    def chunk_count(self):
+        return len(self._chunks) // CHUNK_FIELDS
+
+    def read(self, file_id, start, end):
+        """Decodes a byte range of one source file."""
+        mapped = self._maps.get(file_id)
+        if mapped is None:
+            if not self.files[file_id]["size"]:
+                return ""
+            with open(os.path.join(self._root, self.files[file_id]["path"]), "rb") as f:
+                mapped = self._maps[file_id] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return str(mapped[start:end], "utf-8", "replace")
+
+    def text(self):
+        """Returns the whole corpus as one string. Only use this for small knowledge bases."""
+        return "\n".join(self.read(file_id, 0, entry["size"]) for file_id, entry in enumerate(self.files))
+
+    def section(self, section_id):
+        """Returns one section record as a dict."""
+        level, parent, file_id, title_start, title_end, start = (
+            self._sections[section_id * SECTION_FIELDS:(section_id + 1) * SECTION_FIELDS]
+        )
+        body_end = self.files[file_id]["size"]
+        if section_id + 1 < self.section_count and self._sections[(section_id + 1) * SECTION_FIELDS + 2] == file_id:
+            body_end = self._sections[(section_id + 1) * SECTION_FIELDS + 5]
+        title = self.files[file_id]["path"] if level == 0 else str(self._section_titles[title_start:title_end], "utf-8", "replace")
+        return {
+            "id": section_id,
+            "level": level,
+            "parent": None if parent == NO_PARENT else parent,
+            "file": file_id,
+            "title": title,
+            "start": start,
+            "body_end": body_end,
+        }
+
+    def find_section(self, title_prefix):
+        """Returns the first section whose title starts with the prefix (case-insensitive), or None."""
+        title_prefix = title_prefix.lower()
+        if title_prefix not in self._section_lookup:
+            found = None
+            for section_id in range(self.section_count):
+                section = self.section(section_id)
+                if section["level"] and section["title"].lower().startswith(title_prefix):
+                    found = section
+                    break
+            self._section_lookup[title_prefix] = found
+        return self._section_lookup[title_prefix]
+
+    def _subtree_end(self, section):
+        """Returns the id one past a section's last subsection."""
+        for section_id in range(section["id"] + 1, self.section_count):
+            level, _, file_id = self._sections[section_id * SECTION_FIELDS:section_id * SECTION_FIELDS + 3]
+            if file_id != section["file"] or level <= section["level"]:
+                return section_id
+        return self.section_count
+
+    def section_subtree(self, section):
+        """Returns the ids of a section and all of its subsections."""
+        return range(section["id"], self._subtree_end(section))
+
+    def section_text(self, section, max_bytes=None):
+        """Returns the text of a section including its subsections, optionally truncated."""
+        following = self._subtree_end(section)
+        if following < self.section_count and self._sections[following * SECTION_FIELDS + 2] == section["file"]:
+            end = self._sections[following * SECTION_FIELDS + 5]
+        else:
+            end = self.files[section["file"]]["size"]
+        if max_bytes is not None:
+            end = min(end, section["start"] + max_bytes)
+        return self.read(section["file"], section["start"], end)
+
+    def chunk(self, chunk_id):
+        """Returns one chunk record as a dict."""
+        section, file_id, start, end, token_start, token_end = (
+            self._chunks[chunk_id * CHUNK_FIELDS:(chunk_id + 1) * CHUNK_FIELDS]
+        )
+        return {
+            "id": chunk_id, "section": section, "file": file_id, "start": start, "end": end,
+            "token_start": token_start, "token_end": token_end,
+        }
+
+    def chunk_text(self, chunk):
+        return self.read(chunk["file"], chunk["start"], chunk["end"])
+
+    def token_span(self, token):
+        """Returns the (start, end) byte offsets of a token position in its source file."""
+        return self._token_spans[2 * token], self._token_spans[2 * token + 1]
+
+    def postings(self, term_id):
+        """Returns the ascending chunk ids containing a term, as a memoryview into the artifact."""
+        return self._postings[self._posting_offsets[term_id]:self._posting_offsets[term_id + 1]]
+
+    def section_hash(self, section_id):
+        """Returns the content hash of a section's own text, from its heading to the next heading."""
+        return bytes(self._section_hashes[section_id * HASH_BYTES:(section_id + 1) * HASH_BYTES])
+
+    def fingerprint(self, section_ids):
+        """Returns a short hash of the content of some sections.
+
+        Anything derived from just these sections can be keyed by it: the key only changes
+        when one of them is edited, whatever else changes in the knowledge base.
+        """
+        digest = hashlib.blake2b(digest_size=HASH_BYTES)
+        for section_hash in sorted(self.section_hash(section_id) for section_id in set(section_ids)):
+            digest.update(section_hash)
+        return digest.hexdigest()
+
+    def section_trails(self):
+        """Returns {"file › heading › subheading": section hash} for comparing versions."""
+        def build(kb):
+            trails, names = {}, []
+            for section_id in range(kb.section_count):
+                section = kb.section(section_id)
+                names[section["level"]:] = [section["title"]] # level 0 is the file itself
+                trail = " › ".join(names)
+                while trail in trails: # Repeated headings are told apart by their order
+                    trail += " ›"
+                trails[trail] = kb.section_hash(section_id)
+            return trails
+        return self.derived("section_trails", build)
+
+    def chunk_hash(self, chunk_id):
+        """Returns the content hash of a chunk's bytes."""
+        return bytes(self._chunk_hashes[chunk_id * HASH_BYTES:(chunk_id + 1) * HASH_BYTES])
+
+    def find_chunk(self, digest):
+        """Returns the id of a chunk with this content hash, or None.
+
+        Bisects the memory-mapped chunk_order table, so an incremental build never loads
+        the previous artifact's hashes into memory.
+        """
+        key = _hash_key(digest)
+        rank = bisect_left(range(len(self._chunk_order)), key, key=lambda rank: _hash_key(self.chunk_hash(self._chunk_order[rank])))
+        # Chunks sharing the 4-byte key sit next to each other; compare their full hashes
+        while rank < len(self._chunk_order):
+            chunk_id = self._chunk_order[rank]
+            chunk_digest = self.chunk_hash(chunk_id)
+            if _hash_key(chunk_digest) != key:
+                break
+            if chunk_digest == digest:
+                return chunk_id
+            rank += 1
+        return None
+
+    def term_stats(self, term):
+        """Returns (document frequency, collection frequency) for a term, or (0, 0) if unseen."""
+        term_id = self.vocabulary.index(term)
+        if term_id is None:
+            return 0, 0
+        return self.doc_freq[term_id], self.term_freq[term_id]
+
+    def derived(self, name, build):
+        """Returns a structure derived from this knowledge base, building it once on first use.
+
+        Derived indexes live as long as the artifact, so they are shared by every session
+        and rebuilt only when a new knowledge base version is loaded. Each name is built under
+        its own lock, so a slow build (one waiting on the shared cache, say) holds up only
+        callers of that name, not searches and prompts using the others.
+        """
+        if name in self._derived:
+            return self._derived[name]
+        with self._derived_lock:
+            lock = self._derived_locks.setdefault(name, threading.Lock())
+        with lock:
+            if name not in self._derived:
+                self._derived[name] = build(self)
+            return self._derived[name]
+
+    def is_stale(self):
+        """Checks whether the source files changed since this artifact was compiled."""
+        try:
+            paths = _corpus_files(self.source_path)
+        except OSError:
+            return False # No source to compare against, so the artifact is all we have
+        if paths != [entry["path"] for entry in self.files]:
+            return True
+        for entry in self.files:
+            path = os.path.join(self._root, entry["path"])
+            stat = os.stat(path)
+            if stat.st_size == entry["size"] and stat.st_mtime_ns == entry["mtime_ns"]:
+                continue
+            # The file was touched; only a content change makes the artifact stale
+            with open(path, "rb") as f:
+                if hashlib.file_digest(f, "sha256").hexdigest() != entry["sha256"]:
+                    return True
+        return False
+
+
+def diff_sections(old, new):
+    """Compares two versions of a knowledge base section by section.
+
+    Returns {"added": [...], "removed": [...], "changed": [...], "unchanged": count}, with
+    sections named by their heading trail.
+    """
+    old_trails, new_trails = old.section_trails(), new.section_trails()
+    return {
+        "added": [trail for trail in new_trails if trail not in old_trails],
+        "removed": [trail for trail in old_trails if trail not in new_trails],
+        "changed": [trail for trail, digest in new_trails.items() if old_trails.get(trail, digest) != digest],
+        "unchanged": sum(1 for trail, digest in new_trails.items() if old_trails.get(trail) == digest),
+    }
+
+
+def _map_artifact(artifact_path, source_path):
+    with open(artifact_path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return KnowledgeBaseArtifact(mapped, source_path)
+
+
+def _fallback_artifact_path(artifact_path):
+    """Where an artifact goes when its own directory is read-only: the app's private directory,
+    under a name that keeps knowledge bases with the same file name apart."""
+    full_path = os.path.abspath(artifact_path)
+    digest = hashlib.sha1(full_path.encode("utf-8")).hexdigest()[:12]
+    return os.path.join(APP_DATA_DIR, "artifacts", f"{digest}-{os.path.basename(full_path)}")
+
+
+def _build_in_memory(source_path, previous):
+    """Compiles into an unlinked private temp file and maps it; nothing is left for a later start to find."""
+    fd, path = tempfile.mkstemp(suffix=".kbc") # Created 0600
+    os.close(fd)
+    try:
+        write_artifact(source_path, path, previous)
+        return _map_artifact(path, source_path)
+    finally:
+        try:
+            os.unlink(path) # The mapping stays valid
+        except OSError:
+            pass
+
+
+def load_artifact(source_path, artifact_path=None):
+    """Memory-maps the compiled artifact for a knowledge base, recompiling it if stale.
+
+    If the artifact is missing, from an older format or out of date it is rebuilt in-process,
+    reusing whatever an out-of-date artifact already indexed. When the artifact's directory
+    is read-only it is kept in the app's private directory instead, and looked up there on
+    later starts; if that cannot be written either, the build is served from memory.
+    """
+    artifact_path = artifact_path or default_artifact_path(source_path)
+    fallback_path = _fallback_artifact_path(artifact_path)
+    previous = None
+    for path in (artifact_path, fallback_path):
+        try:
+            if path == fallback_path:
+                private_file(path) # Never map a file another user could have planted
+            candidate = _map_artifact(path, source_path)
+        except (OSError, ValueError, struct.error):
+            continue
+        if not candidate.is_stale():
+            return candidate
+        previous = previous or candidate
+
+    try:
+        write_artifact(source_path, artifact_path, previous)
+        artifact = _map_artifact(artifact_path, source_path)
+    except PermissionError:
+        try:
+            private_dir("artifacts")
+            write_artifact(source_path, fallback_path, previous)
+            artifact = _map_artifact(fallback_path, source_path)
+        except PermissionError as e:
+            _log.warning("artifact_not_saved", extra={"stage": "compile", "artifact": artifact_path, "error": str(e)})
+            artifact = _build_in_memory(source_path, previous)
+    if previous is not None:
+        changes = diff_sections(previous, artifact)
+        _log.info("reindexed", extra={
+            "stage": "compile", "version": artifact.version, "previous_version": previous.version,
+            "sections_changed": len(changes["changed"]), "sections_added": len(changes["added"]),
+            "sections_removed": len(changes["removed"]), "sections_unchanged": changes["unchanged"],
+        })
+    return artifact
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compile a markdown knowledge base into a binary artifact.")
+    parser.add_argument("source", nargs="?", default="knowledge_base.txt", help="Markdown file or directory of .txt/.md files.")
+    parser.add_argument("-o", "--output", help="Artifact path (defaults to the source path with a .kbc suffix).")
+    args = parser.parse_args(argv)
+
+    artifact_path = args.output or default_artifact_path(args.source)
+    try:
+        previous = _map_artifact(artifact_path, args.source)
+    except (OSError, ValueError, struct.error):
+        previous = None
+    write_artifact(args.source, artifact_path, previous)
+    artifact = _map_artifact(artifact_path, args.source)
+    if previous is not None:
+        changes = diff_sections(previous, artifact)
+        print(
+            f"Sections since {previous.version}: {len(changes['changed'])} changed, {len(changes['added'])} added, "
+            f"{len(changes['removed'])} removed, {changes['unchanged']} unchanged."
+        )
+    print(
+        f"Wrote {artifact_path}: version {artifact.version}, {len(artifact.files)} files, "
+        f"{artifact.section_count} sections, {artifact.chunk_count} chunks, "
+        f"{artifact.total_tokens} tokens, {len(artifact.vocabulary)} terms."
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import heapq
+from array import array
+from bisect import bisect_left
+
+from shared_cache import pack_arrays, pack_strings, shared_index, unpack_arrays, unpack_strings
+from text_analysis import normalize
+
+DEFAULT_COMPLETIONS = 5
+PRECOMPUTED_PREFIX_LENGTH = 3 # Top completions for prefixes this short are stored, since their ranges are the widest
+PRECOMPUTED_COMPLETIONS = 10
+MIN_TERM_LENGTH = 3 # Shorter terms are not worth suggesting
+INDEX_VERSION = 2 # Bump when the key normalization changes, so shared copies built the old way are not loaded
+
+
+class PrefixIndex:
+    """Sorted-array prefix index over knowledge base terms and headings, weighted by frequency.
+
+    A prefix maps to a contiguous range of the sorted keys; short prefixes, whose ranges
+    can cover much of the vocabulary, have their top completions precomputed.
+    """
+
+    def __init__(self, knowledge_base):
+        vocabulary = knowledge_base.vocabulary
+        entries = {} # key -> (weight, display text)
+        for term_id in range(len(vocabulary)):
+            term = vocabulary[term_id]
+            if len(term) >= MIN_TERM_LENGTH and not term.isdigit():
+                entries[term] = (knowledge_base.term_freq[term_id], term)
+        # Headings rank alongside the most frequent terms
+        heading_weight = max(knowledge_base.term_freq, default=1)
+        for section_id in range(knowledge_base.section_count):
+            section = knowledge_base.section(section_id)
+            if section["level"]:
+                entries[normalize(section["title"])] = (heading_weight, section["title"])
+
+        self._keys = sorted(entries)
+        self._weights = array("I", (entries[key][0] for key in self._keys))
+        self._display = [entries[key][1] for key in self._keys]
+
+        groups = {}
+        for key_id, key in enumerate(self._keys):
+            for length in range(1, min(len(key), PRECOMPUTED_PREFIX_LENGTH) + 1):
+                groups.setdefault(key[:length], []).append(key_id)
+        self._top = {
+            prefix: heapq.nlargest(PRECOMPUTED_COMPLETIONS, key_ids, key=self._weights.__getitem__)
+            for prefix, key_ids in groups.items()
+        }
+
+    def to_bytes(self):
+        """Serializes the index for the shared cache."""
+        prefixes = sorted(self._top)
+        offsets, key_ids = array("I", [0]), array("I")
+        for prefix in prefixes:
+            key_ids.extend(self._top[prefix])
+            offsets.append(len(key_ids))
+        return pack_arrays(
+            pack_strings(self._keys), self._weights, pack_strings(self._display), pack_strings(prefixes), offsets, key_ids
+        )
+
+    @classmethod
+    def from_bytes(cls, data, knowledge_base):
+        """Loads an index written by to_bytes."""
+        key_bytes, weights, display_bytes, prefix_bytes, offsets, key_ids = unpack_arrays(data)
+        index = cls.__new__(cls)
+        index._keys, index._weights, index._display = unpack_strings(key_bytes), weights, unpack_strings(display_bytes)
+        prefixes = unpack_strings(prefix_bytes)
+        if (not len(index._keys) == len(weights) == len(index._display) or len(offsets) != len(prefixes) + 1
+                or max(key_ids, default=0) >= len(weights)):
+            raise ValueError("Malformed prefix index")
+        index._top = {prefix: key_ids[offsets[i]:offsets[i + 1]].tolist() for i, prefix in enumerate(prefixes)}
+        return index
+
+    def complete(self, prefix, k=DEFAULT_COMPLETIONS, min_weight=0):
+        """Returns up to k completions for a prefix weighing more than min_weight, most frequent first."""
+        prefix = normalize(prefix) # Same folding as the vocabulary, so "café" completes like "cafe"
+        if not prefix:
+            return []
+        if len(prefix) <= PRECOMPUTED_PREFIX_LENGTH and k <= PRECOMPUTED_COMPLETIONS:
+            key_ids = self._top.get(prefix, [])[:k]
+        else:
+            lo = bisect_left(self._keys, prefix)
+            hi = bisect_left(self._keys, prefix + "\U0010ffff", lo)
+            key_ids = heapq.nlargest(k, range(lo, hi), key=self._weights.__getitem__)
+        return [self._display[key_id] for key_id in key_ids if self._weights[key_id] > min_weight]
+
+
+def prefix_index(knowledge_base):
+    """Returns the shared prefix index for a knowledge base, building it on first use."""
+    return shared_index(knowledge_base, f"prefix_index:{INDEX_VERSION}", PrefixIndex)
+
+
+def complete_query(knowledge_base, query, k=DEFAULT_COMPLETIONS):
+    """Returns completed versions of a partly typed query.
+
+    Headings are matched against the whole query; terms complete its last word. A last word
+    that is already a knowledge base term is kept unless a completion is more frequent than
+    it, so "how to" is not rewritten into "how too".
+    """
+    stripped = query.strip()
+    if not stripped:
+        return []
+    index = prefix_index(knowledge_base)
+    head, _, last_word = stripped.rpartition(" ")
+    completions = [title for title in index.complete(stripped, k) if " " in title]
+    term_id = knowledge_base.vocabulary.index(normalize(last_word))
+    word_weight = knowledge_base.term_freq[term_id] if term_id is not None else 0
+    for term in index.complete(last_word, k, min_weight=word_weight):
+        completions.append(f"{head} {term}".strip())
+    return [completion for completion in dict.fromkeys(completions) if normalize(completion) != normalize(stripped)][:k]
@@ -0,0 +1,119 @@
+import heapq
+from array import array
+
+from shared_cache import pack_arrays, pack_strings, shared_index, unpack_arrays, unpack_strings
+
+MAX_VERIFIED_CANDIDATES = 40 # Only the terms sharing the most trigrams are checked with the full edit distance
+
+
+def _trigrams(term):
+    """Returns the distinct padded character trigrams of a term."""
+    padded = f"${term}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def max_edit_distance(term):
+    """Returns how many typos are tolerated for a term of this length."""
+    if len(term) <= 2:
+        return 0
+    return 1 if len(term) <= 5 else 2
+
+
+def edit_distance(a, b, limit):
+    """Returns the Damerau-Levenshtein (optimal string alignment) distance, or limit + 1 once it is exceeded."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2, previous = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1) # Transposed letters count as one typo
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+class TrigramIndex:
+    """Character-trigram index over a knowledge base vocabulary for typo-tolerant lookups.
+
+    Only terms sharing enough trigrams with the misspelling are ever compared, so a lookup
+    touches a few posting lists instead of the whole vocabulary.
+    """
+
+    def __init__(self, knowledge_base):
+        self.attach(knowledge_base)
+        postings = {}
+        self._lengths = array("B")
+        for term_id in range(len(self._vocabulary)):
+            term = self._vocabulary[term_id]
+            self._lengths.append(min(len(term), 255))
+            for trigram in _trigrams(term):
+                postings.setdefault(trigram, array("I")).append(term_id)
+        self._postings = postings
+
+    def attach(self, knowledge_base):
+        """Points the index at the vocabulary it was built from."""
+        self._vocabulary = knowledge_base.vocabulary
+        self._doc_freq = knowledge_base.doc_freq
+
+    def to_bytes(self):
+        """Serializes the index for the shared cache; the vocabulary lives in the artifact and is not included."""
+        trigrams = sorted(self._postings)
+        offsets, term_ids = array("I", [0]), array("I")
+        for trigram in trigrams:
+            term_ids.extend(self._postings[trigram])
+            offsets.append(len(term_ids))
+        return pack_arrays(self._lengths, pack_strings(trigrams), offsets, term_ids)
+
+    @classmethod
+    def from_bytes(cls, data, knowledge_base):
+        """Loads an index written by to_bytes and attaches it to its knowledge base."""
+        lengths, trigram_bytes, offsets, term_ids = unpack_arrays(data)
+        trigrams = unpack_strings(trigram_bytes)
+        if len(lengths) != len(knowledge_base.vocabulary) or len(offsets) != len(trigrams) + 1 or max(term_ids, default=0) >= len(lengths):
+            raise ValueError("Trigram index does not match the knowledge base")
+        index = cls.__new__(cls)
+        index.attach(knowledge_base)
+        index._lengths = lengths
+        index._postings = {trigram: term_ids[offsets[i]:offsets[i + 1]] for i, trigram in enumerate(trigrams)}
+        return index
+
+    def correct(self, term):
+        """Returns (closest term, edit distance) for a misspelled term, or None if nothing is close.
+
+        Ties are broken in favour of the term that appears in more chunks.
+        """
+        limit = max_edit_distance(term)
+        if not limit:
+            return None
+        query_trigrams = _trigrams(term)
+        shared = {}
+        for trigram in query_trigrams:
+            for term_id in self._postings.get(trigram, ()):
+                shared[term_id] = shared.get(term_id, 0) + 1
+
+        # Each edit changes at most three trigrams, so anything sharing fewer cannot be within the limit
+        required = max(1, len(query_trigrams) - 3 * limit)
+        candidates = [
+            (count, self._doc_freq[term_id], term_id) for term_id, count in shared.items()
+            if count >= required and abs(self._lengths[term_id] - len(term)) <= limit
+        ]
+        best = None
+        for _, _, term_id in heapq.nlargest(MAX_VERIFIED_CANDIDATES, candidates):
+            candidate = self._vocabulary[term_id]
+            distance = edit_distance(term, candidate, limit)
+            if distance > limit:
+                continue
+            rank = (distance, -self._doc_freq[term_id])
+            if best is None or rank < best[0]:
+                best = (rank, candidate, distance)
+        return None if best is None else (best[1], best[2])
+
+
+def trigram_index(knowledge_base):
+    """Returns the shared trigram index for a knowledge base, building it on first use."""
+    return shared_index(knowledge_base, "trigram_index", TrigramIndex)
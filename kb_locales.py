@@ -0,0 +1,66 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from kb_artifact import load_artifact
+
+DEFAULT_LOCALE = "en"
+LOCALE_NAMES = {"en": "English", "sw": "Kiswahili"} # Locales offered in the language picker
+# The default locale's knowledge base: a markdown file or a directory of .txt/.md files.
+# Other locales live next to it as knowledge_base.<locale>.txt or a knowledge_base.<locale>/ directory.
+KNOWLEDGE_BASE_PATH = os.getenv("KNOWLEDGE_BASE_PATH", "knowledge_base.txt")
+MAX_LOADED_KNOWLEDGE_BASES = int(os.getenv("MAX_LOADED_KNOWLEDGE_BASES", "3"))
+STALE_CHECK_SECONDS = 5 # How often a cached knowledge base is checked against its source files
+
+# Process-wide LRU of loaded knowledge bases, shared by every session: source path -> (artifact, last staleness check)
+_loaded = OrderedDict()
+_loaded_lock = threading.Lock() # Held only to look up, publish and evict, never while compiling
+_in_flight = {} # source path -> lock held by the one caller checking or compiling that source
+
+
+def knowledge_base_path(locale):
+    """Returns the knowledge base source for a locale, falling back to the default locale's."""
+    if locale == DEFAULT_LOCALE:
+        return KNOWLEDGE_BASE_PATH
+    base, ext = os.path.splitext(KNOWLEDGE_BASE_PATH.rstrip("/\\"))
+    for candidate in (f"{base}.{locale}{ext}", f"{base}.{locale}"):
+        if os.path.exists(candidate):
+            return candidate
+    return KNOWLEDGE_BASE_PATH
+
+
+def get_knowledge_base(locale=DEFAULT_LOCALE):
+    """Returns the compiled knowledge base for a locale, loading and indexing it on first use.
+
+    At most MAX_LOADED_KNOWLEDGE_BASES stay mapped; the least recently used is dropped first,
+    so memory follows the locales people are actually using.
+    """
+    source = knowledge_base_path(locale)
+    with _loaded_lock:
+        artifact, checked_at = _loaded.get(source, (None, 0))
+        if artifact is not None:
+            _loaded.move_to_end(source)
+            if time.monotonic() - checked_at < STALE_CHECK_SECONDS:
+                return artifact
+        guard = _in_flight.setdefault(source, threading.Lock())
+
+    # Staleness checks and compiles run outside _loaded_lock, so other knowledge bases stay
+    # available; one caller per source does the work, and callers that already have a copy
+    # keep using it meanwhile instead of waiting
+    if not guard.acquire(blocking=artifact is None):
+        return artifact
+    try:
+        with _loaded_lock:
+            current, checked_at = _loaded.get(source, (None, 0))
+        if current is not None and time.monotonic() - checked_at < STALE_CHECK_SECONDS:
+            return current # Refreshed by the caller that held the guard before us
+        fresh = current if current is not None and not current.is_stale() else load_artifact(source)
+        with _loaded_lock:
+            _loaded[source] = (fresh, time.monotonic())
+            _loaded.move_to_end(source)
+            while len(_loaded) > MAX_LOADED_KNOWLEDGE_BASES:
+                _loaded.popitem(last=False)
+        return fresh
+    finally:
+        guard.release()
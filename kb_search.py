@@ -0,0 +1,240 @@
+import html
+import math
+import threading
+from collections import OrderedDict
+
+from kb_fuzzy import trigram_index
+from kb_locales import DEFAULT_LOCALE
+from text_analysis import STOPWORDS, analyze, stem, tokenize
+
+PROMPT_CORPUS_BYTES = 200_000 # Knowledge bases up to this size are sent to the model whole
+COMMON_TERM_RATIO = 0.2 # Terms in more chunks than this share add little to retrieval scoring
+PAGE_SIZE = 10 # Result passages per search page
+SNIPPET_RADIUS = 120 # Bytes of context shown on each side of a passage's first hit
+RANKING_CACHE_SIZE = 64 # Recent query rankings kept per knowledge base for paging
+
+
+def stem_index(knowledge_base, locale=DEFAULT_LOCALE):
+    """Returns {stem: vocabulary terms with that stem}, built once per knowledge base version and locale."""
+    def build(kb):
+        stems = {}
+        for term_id in range(len(kb.vocabulary)):
+            term = kb.vocabulary[term_id]
+            stems.setdefault(stem(term, locale), []).append(term)
+        return {key: tuple(terms) for key, terms in stems.items()}
+    return knowledge_base.derived(f"stem_index:{locale}", build)
+
+
+def analyze_query(knowledge_base, query, locale=DEFAULT_LOCALE):
+    """Splits a query into (term, weight, typed, variants) tuples, replacing misspelled terms with their closest vocabulary term.
+
+    variants are the vocabulary terms sharing the term's stem, any of which matches. Exact
+    terms weigh 1.0 and corrected terms less the further they are from what was typed, so
+    corrections rank below exact matches. Terms with no close match get weight 0.
+    Stopwords are dropped unless the query has nothing else.
+    """
+    stems = stem_index(knowledge_base, locale)
+    typed_terms = list(dict.fromkeys(tokenize(query)))
+    stopwords = STOPWORDS.get(locale, STOPWORDS[DEFAULT_LOCALE])
+    analyzed = []
+    for typed in [term for term in typed_terms if term not in stopwords] or typed_terms:
+        variants = stems.get(stem(typed, locale))
+        if variants:
+            analyzed.append((typed, 1.0, typed, variants))
+            continue
+        correction = trigram_index(knowledge_base).correct(typed)
+        if correction is None:
+            analyzed.append((typed, 0.0, typed, ()))
+        else:
+            term, distance = correction
+            analyzed.append((term, 1 / (1 + distance), typed, stems.get(stem(term, locale), (term,))))
+    return tuple(analyzed)
+
+
+def did_you_mean(analyzed):
+    """Returns the corrected query to suggest, or None if nothing was corrected."""
+    if all(term == typed for term, _, typed, _ in analyzed):
+        return None
+    return " ".join(term for term, _, _, _ in analyzed)
+
+
+def _ranked_chunks(knowledge_base, analyzed):
+    """Returns ids of chunks containing every term, best first, scored by weighted tf-idf.
+
+    Cached so paging through results does not rank the same query again. The cache hangs off
+    the knowledge base, so it is dropped together with it instead of keeping it mapped.
+    """
+    rankings, lock = knowledge_base.derived("rankings", lambda kb: (OrderedDict(), threading.Lock()))
+    with lock:
+        ranked = rankings.get(analyzed)
+        if ranked is not None:
+            rankings.move_to_end(analyzed)
+            return ranked
+    ranked = _rank_chunks(knowledge_base, analyzed)
+    with lock:
+        rankings[analyzed] = ranked
+        while len(rankings) > RANKING_CACHE_SIZE:
+            rankings.popitem(last=False)
+    return ranked
+
+
+def _rank_chunks(knowledge_base, analyzed):
+    if not analyzed or any(weight == 0 for _, weight, _, _ in analyzed):
+        return ()
+    groups = [] # (weight, ids of the term's variants) per query term
+    for _, weight, _, variants in analyzed:
+        term_ids = [term_id for term_id in map(knowledge_base.vocabulary.index, variants) if term_id is not None]
+        if not term_ids:
+            return () # Analyzed against another knowledge base, e.g. before a locale switch
+        groups.append((weight, term_ids))
+    postings = sorted(
+        (set().union(*(knowledge_base.postings(term_id) for term_id in term_ids)) for _, term_ids in groups), key=len
+    )
+    matches = postings[0] # Start from the rarest term so the working set stays small
+    for posting in postings[1:]:
+        matches.intersection_update(posting)
+        if not matches:
+            return ()
+
+    chunk_count = knowledge_base.chunk_count
+    scores = {}
+    for chunk_id in matches:
+        chunk = knowledge_base.chunk(chunk_id)
+        tokens = knowledge_base.tokens[chunk["token_start"]:chunk["token_end"]].tolist()
+        score = 0.0
+        for weight, term_ids in groups:
+            for term_id in term_ids:
+                count = tokens.count(term_id)
+                if count:
+                    idf = math.log(1 + chunk_count / knowledge_base.doc_freq[term_id])
+                    score += weight * idf * (1 + math.log(count))
+        scores[chunk_id] = score
+    return tuple(sorted(scores, key=lambda chunk_id: (-scores[chunk_id], chunk_id)))
+
+
+def _section_path(knowledge_base, section_id):
+    """Returns the heading trail of a section, e.g. "GENERAL INFORMATION › DEFINITION"."""
+    titles = []
+    while section_id is not None:
+        section = knowledge_base.section(section_id)
+        # File-level sections only help tell files apart in a multi-file corpus
+        if section["level"] or len(knowledge_base.files) > 1:
+            titles.append(section["title"])
+        section_id = section["parent"]
+    return " › ".join(reversed(titles))
+
+
+def _inside_link(text_before):
+    """Checks whether the text that follows would sit inside a URL or a markdown link target."""
+    word = text_before[text_before.rfind(" ") + 1:]
+    return "://" in word or text_before.rfind("](") > text_before.rfind(")")
+
+
+def _snippet(knowledge_base, chunk, term_ids):
+    """Returns a window of the chunk around its first hit, with every hit in it wrapped in <mark>.
+
+    Hits and window edges come from the stored token offsets, so the window never splits a word
+    and only the window's bytes are read. Corpus text is HTML-escaped, so the snippet is safe
+    to render as HTML.
+    """
+    spans = [knowledge_base.token_span(position) for position in range(chunk["token_start"], chunk["token_end"])]
+    hits = [
+        span for position, span in zip(range(chunk["token_start"], chunk["token_end"]), spans)
+        if knowledge_base.tokens[position] in term_ids
+    ]
+    first_start, first_end = hits[0]
+    if first_start - SNIPPET_RADIUS <= chunk["start"]:
+        window_start = chunk["start"]
+    else:
+        window_start = next(start for start, _ in spans if start >= first_start - SNIPPET_RADIUS)
+    if first_end + SNIPPET_RADIUS >= chunk["end"]:
+        window_end = chunk["end"]
+    else:
+        window_end = max(end for _, end in spans if end <= first_end + SNIPPET_RADIUS)
+
+    parts = ["…" if window_start > chunk["start"] else ""]
+    cursor = window_start
+    for start, end in hits:
+        if start < cursor or end > window_end:
+            continue
+        before = knowledge_base.read(chunk["file"], cursor, start)
+        if _inside_link("".join(parts) + before):
+            continue # Marking up a URL would break the link, so leave it as plain text
+        parts.append(html.escape(before))
+        parts.append(f"<mark>{html.escape(knowledge_base.read(chunk['file'], start, end))}</mark>")
+        cursor = end
+    parts.append(html.escape(knowledge_base.read(chunk["file"], cursor, window_end)))
+    if window_end < chunk["end"]:
+        parts.append("…")
+    return " ".join("".join(parts).split())
+
+
+def search_page(knowledge_base, analyzed, page=0, page_size=PAGE_SIZE):
+    """Returns one fixed-size page of ranked results, grouped by section.
+
+    Takes the output of analyze_query. Only the chunks on the requested page are read
+    from disk, and only their snippet windows are decoded.
+    """
+    ranked = _ranked_chunks(knowledge_base, tuple(analyzed))
+    pages = max(1, math.ceil(len(ranked) / page_size))
+    page = min(max(page, 0), pages - 1)
+    term_ids = {knowledge_base.vocabulary.index(variant) for _, _, _, variants in analyzed for variant in variants}
+    groups = {} # section id -> group, in order of each section's best-ranked hit
+    for chunk_id in ranked[page * page_size:(page + 1) * page_size]:
+        chunk = knowledge_base.chunk(chunk_id)
+        if chunk["section"] not in groups:
+            # Headings come from the corpus too and are rendered next to the snippets
+            groups[chunk["section"]] = {"section": html.escape(_section_path(knowledge_base, chunk["section"])), "hits": []}
+        groups[chunk["section"]]["hits"].append(_snippet(knowledge_base, chunk, term_ids))
+    return {"total": len(ranked), "page": page, "pages": pages, "groups": list(groups.values())}
+
+
+def retrieve_chunks(knowledge_base, query, max_bytes, locale=DEFAULT_LOCALE):
+    """Returns the texts of the best-matching chunks for a query, in corpus order, within a byte budget."""
+    chunk_count = knowledge_base.chunk_count
+    stems = stem_index(knowledge_base, locale)
+    scores = {}
+    for term in set(analyze(query, locale)):
+        for variant in stems.get(term, ()):
+            term_id = knowledge_base.vocabulary.index(variant)
+            doc_freq = knowledge_base.doc_freq[term_id]
+            if doc_freq > COMMON_TERM_RATIO * chunk_count:
+                continue
+            weight = chunk_count / doc_freq
+            for chunk_id in knowledge_base.postings(term_id):
+                scores[chunk_id] = scores.get(chunk_id, 0) + weight
+
+    selected, used = [], 0
+    for chunk_id in sorted(scores, key=scores.get, reverse=True):
+        chunk = knowledge_base.chunk(chunk_id)
+        size = chunk["end"] - chunk["start"]
+        if used + size > max_bytes:
+            continue
+        selected.append(chunk)
+        used += size
+    return [knowledge_base.chunk_text(chunk) for chunk in sorted(selected, key=lambda chunk: chunk["id"])]
+
+
+def relevant_sections(knowledge_base, query, locale=DEFAULT_LOCALE):
+    """Returns the ids of the sections with a chunk mentioning any of the query's words, in any inflection.
+
+    As in retrieval, words found throughout the knowledge base are ignored, so an empty set
+    means the query could draw on any section.
+    """
+    stems = stem_index(knowledge_base, locale)
+    sections = set()
+    for term in set(analyze(query, locale)):
+        for variant in stems.get(term, ()):
+            term_id = knowledge_base.vocabulary.index(variant)
+            if knowledge_base.doc_freq[term_id] > COMMON_TERM_RATIO * knowledge_base.chunk_count:
+                continue
+            for chunk_id in knowledge_base.postings(term_id):
+                sections.add(knowledge_base.chunk(chunk_id)["section"])
+    return sections
+
+
+def context_text(knowledge_base, query, max_bytes=PROMPT_CORPUS_BYTES, locale=DEFAULT_LOCALE):
+    """Returns the knowledge base text to put in a prompt: all of it if small, otherwise the chunks relevant to the query."""
+    if knowledge_base.corpus_size <= max_bytes:
+        return knowledge_base.text()
+    return "\n\n".join(retrieve_chunks(knowledge_base, query, max_bytes, locale))
@@ -0,0 +1,200 @@
+"""In-process stand-in for the parts of the Firestore client the app uses.
+
+Supports collection(path).add/document/where/order_by/limit/stream, document
+references with get/update/delete, and write batches, with the same call shapes as
+google.cloud.firestore, so forum and archival code can run without a Firebase project:
+
+    db = LocalFirestore()                       # or LocalFirestore("forum.json") to persist
+    posts = db.collection("artifacts/app/public/data/community_posts")
+    posts.add({"content": "hi", "timestamp": SERVER_TIMESTAMP})
+"""
+import copy
+import json
+import operator
+import os
+import threading
+import uuid
+from datetime import datetime, timezone
+
+try:
+    from firebase_admin.firestore import SERVER_TIMESTAMP
+except ImportError:
+    SERVER_TIMESTAMP = object() # Same role as firestore.SERVER_TIMESTAMP when Firebase is not installed
+
+DESCENDING = "DESCENDING" # Values of firestore.Query.DESCENDING / ASCENDING
+ASCENDING = "ASCENDING"
+_OPERATORS = {
+    "<": operator.lt, "<=": operator.le, "==": operator.eq, "!=": operator.ne, ">=": operator.ge, ">": operator.gt,
+    "in": lambda value, options: value in options,
+    "array_contains": lambda value, item: isinstance(value, list) and item in value,
+}
+
+
+class LocalDocumentSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+        self.exists = data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data)
+
+    def get(self, field):
+        return (self._data or {}).get(field)
+
+
+class LocalDocumentReference:
+    def __init__(self, collection, doc_id):
+        self._collection = collection
+        self.id = doc_id
+
+    def get(self):
+        with self._collection._db._lock:
+            return LocalDocumentSnapshot(self, copy.deepcopy(self._collection._docs.get(self.id)))
+
+    def set(self, data):
+        self._collection._write(self.id, data)
+
+    def update(self, fields):
+        with self._collection._db._lock:
+            if self.id not in self._collection._docs:
+                raise KeyError(f"No document to update: {self.id}")
+            self._collection._write(self.id, dict(self._collection._docs[self.id], **fields))
+
+    def delete(self):
+        with self._collection._db._lock:
+            self._collection._docs.pop(self.id, None)
+            self._collection._db._changed()
+
+
+class LocalQuery:
+    def __init__(self, collection, filters=(), ordering=(), limit_count=None):
+        self._collection = collection
+        self._filters = filters
+        self._ordering = ordering
+        self._limit = limit_count
+
+    def where(self, field, op, value):
+        return LocalQuery(self._collection, self._filters + ((field, _OPERATORS[op], value),), self._ordering, self._limit)
+
+    def order_by(self, field, direction=ASCENDING):
+        return LocalQuery(self._collection, self._filters, self._ordering + ((field, direction),), self._limit)
+
+    def limit(self, count):
+        return LocalQuery(self._collection, self._filters, self._ordering, count)
+
+    def stream(self):
+        with self._collection._db._lock:
+            items = [
+                (doc_id, data) for doc_id, data in self._collection._docs.items()
+                # As in Firestore, documents missing a filtered or ordered field are left out
+                if all(field in data and test(data[field], value) for field, test, value in self._filters)
+                and all(field in data for field, _ in self._ordering)
+            ]
+            for field, direction in reversed(self._ordering):
+                items.sort(key=lambda item: item[1][field], reverse=direction == DESCENDING)
+            if self._limit is not None:
+                items = items[:self._limit]
+            snapshots = [
+                LocalDocumentSnapshot(LocalDocumentReference(self._collection, doc_id), copy.deepcopy(data))
+                for doc_id, data in items
+            ]
+        return iter(snapshots)
+
+    def get(self):
+        return list(self.stream())
+
+
+class LocalCollectionReference(LocalQuery):
+    def __init__(self, db, path):
+        super().__init__(self)
+        self._db = db
+        self.id = path.rsplit("/", 1)[-1]
+        self._docs = db._collections.setdefault(path, {})
+
+    def _write(self, doc_id, data):
+        with self._db._lock:
+            self._docs[doc_id] = {
+                field: datetime.now(timezone.utc) if value is SERVER_TIMESTAMP else copy.deepcopy(value)
+                for field, value in data.items()
+            }
+            self._db._changed()
+
+    def document(self, doc_id=None):
+        return LocalDocumentReference(self, doc_id or uuid.uuid4().hex[:20])
+
+    def add(self, data):
+        reference = self.document()
+        reference.set(data)
+        return datetime.now(timezone.utc), reference
+
+
+class LocalWriteBatch:
+    """Applies queued deletes and updates together on commit."""
+
+    def __init__(self, db):
+        self._db = db
+        self._operations = []
+
+    def delete(self, reference):
+        self._operations.append(reference.delete)
+
+    def update(self, reference, fields):
+        self._operations.append(lambda: reference.update(fields))
+
+    def set(self, reference, data):
+        self._operations.append(lambda: reference.set(data))
+
+    def commit(self):
+        with self._db._lock:
+            self._db._batching = True
+            try:
+                for operation in self._operations:
+                    operation()
+            finally:
+                self._db._batching = False
+            self._db._changed()
+        self._operations = []
+
+
+class LocalFirestore:
+    """A Firestore client kept in memory, optionally saved to a JSON file after every write."""
+
+    def __init__(self, path=None):
+        self._path = path
+        self._lock = threading.RLock()
+        self._batching = False
+        self._collections = {}
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for collection_path, docs in json.load(f).items():
+                    self._collections[collection_path] = {doc_id: _decode(data) for doc_id, data in docs.items()}
+
+    def collection(self, path):
+        return LocalCollectionReference(self, path)
+
+    def batch(self):
+        return LocalWriteBatch(self)
+
+    def _changed(self):
+        if not self._path or self._batching:
+            return
+        temp_path = f"{self._path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                collection_path: {doc_id: _encode(data) for doc_id, data in docs.items()}
+                for collection_path, docs in self._collections.items()
+            }, f)
+        os.replace(temp_path, self._path)
+
+
+def _encode(data):
+    return {field: {"$datetime": value.isoformat()} if isinstance(value, datetime) else value for field, value in data.items()}
+
+
+def _decode(data):
+    return {
+        field: datetime.fromisoformat(value["$datetime"]) if isinstance(value, dict) and "$datetime" in value else value
+        for field, value in data.items()
+    }
@@ -0,0 +1,207 @@
+"""Moderation for community forum posts.
+
+Cheap checks run inline before a post is written: one compiled regex pass for blocked
+terms, crisis language and links, plus the per-user posting rate limit. Heavier checks, such as
+asking the model to classify the post, run on a background worker queue after the post
+is published and can hide it afterwards.
+
+Benchmark the inline path and the queue with:
+    python moderation.py --bench
+"""
+import argparse
+import os
+import queue
+import re
+import threading
+import time
+
+from app_logging import get_logger
+from rate_limit import consume
+
+BLOCKED_TERMS = [
+    # Scam and spam phrases seen on health forums; extend with MODERATION_BLOCKED_TERMS="term one,term two"
+    "casino", "crypto giveaway", "forex signals", "loan offer", "work from home offer", "viagra",
+    "whatsapp me for", "dm me for", "guaranteed cure", "abortion pills for sale",
+] + [term.strip() for term in os.getenv("MODERATION_BLOCKED_TERMS", "").split(",") if term.strip()]
+CRISIS_TERMS = [
+    "suicide", "suicidal", "kill myself", "end my life", "want to die", "self harm", "self-harm",
+    "hurt myself", "no reason to live", "kujiua", "nataka kufa",
+]
+LINK_SHORTENERS = ["bit.ly", "tinyurl.com", "t.co", "goo.gl", "ow.ly", "is.gd", "cutt.ly"]
+MAX_LINKS = 2 # More links than this in one post is treated as spam
+WORKER_QUEUE_SIZE = 1000
+
+CRISIS_MESSAGE = (
+    "It sounds like you may be going through something very painful right now. You don't have to face it alone. "
+    "Please reach out to someone you trust, or to a crisis line or helpline such as Befrienders Kenya or "
+    "Marie Stopes Kenya. If you are in immediate danger, contact local emergency services."
+)
+
+
+_log = get_logger("moderation")
+
+
+def _alternation(terms):
+    return "|".join(re.escape(term) for term in sorted(terms, key=len, reverse=True))
+
+
+# One pass over the post finds every category at once
+RULES_RE = re.compile(
+    rf"(?P<blocked>\b(?:{_alternation(BLOCKED_TERMS)})\b)"
+    rf"|(?P<crisis>\b(?:{_alternation(CRISIS_TERMS)})\b)"
+    rf"|(?P<link>(?:https?://|www\.)(?P<host>[^\s/?#]+)\S*)",
+    re.IGNORECASE,
+)
+SHORTENERS = {host.lower() for host in LINK_SHORTENERS}
+
+
+def check_rules(content):
+    """Runs the compiled rules over a post and returns (reasons to reject, crisis flag)."""
+    reasons = []
+    crisis = False
+    links = 0
+    for match in RULES_RE.finditer(content):
+        if match.lastgroup == "blocked":
+            reasons.append("blocked_term")
+        elif match.lastgroup == "crisis":
+            crisis = True
+        else:
+            links += 1
+            if match.group("host").lower().removeprefix("www.") in SHORTENERS:
+                reasons.append("link_shortener")
+    if links > MAX_LINKS:
+        reasons.append("too_many_links")
+    return sorted(set(reasons)), crisis
+
+
+def moderate_post(user_id, content):
+    """Runs the inline checks and returns {"action": "allow" | "reject", "reasons": [...], "crisis": bool, "retry_after": seconds}.
+
+    Crisis language does not block a post, since reaching out is the point of the forum;
+    it is flagged so the poster can be shown crisis resources.
+    """
+    reasons, crisis = check_rules(content)
+    retry_after = 0
+    if not reasons:
+        # Only posts that would otherwise be published spend a token
+        allowed, retry_after = consume("post", user_id)
+        if not allowed:
+            reasons = ["rate_limited"]
+    return {"action": "reject" if reasons else "allow", "reasons": reasons, "crisis": crisis, "retry_after": retry_after}
+
+
+def model_check(model_instance, content):
+    """Asks the model whether a post breaks the forum rules. Returns a list of reasons, empty if it is fine."""
+    prompt = f"""
+    You moderate a peer support forum for people who have experienced miscarriage.
+    Reply with exactly one word: OK if the post below is acceptable, or REMOVE if it is spam, harassment,
+    hateful, sexually explicit, or gives dangerous medical instructions.
+    Post: {content}
+    """
+    response = model_instance.generate_content([prompt])
+    verdict = (response.text or "").strip().upper()
+    return ["model_flagged"] if verdict.startswith("REMOVE") else []
+
+
+class ModerationWorker:
+    """Background thread that runs slow checks on published posts and hides the ones that fail."""
+
+    def __init__(self, maxsize=WORKER_QUEUE_SIZE):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._thread = threading.Thread(target=self._run, name="moderation-worker", daemon=True)
+        self._thread.start()
+
+    def submit(self, doc_ref, content, check):
+        """Queues a published post for a slow check(content) -> reasons. Returns False if the queue is full."""
+        try:
+            self._queue.put_nowait((doc_ref, content, check))
+            return True
+        except queue.Full:
+            _log.warning("queue_full", extra={"stage": "model_check"})
+            return False
+
+    def join(self):
+        """Blocks until every queued post has been checked."""
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            doc_ref, content, check = self._queue.get()
+            try:
+                reasons = check(content)
+                if reasons:
+                    doc_ref.update({"hidden": True, "moderation_reasons": reasons})
+            except Exception:
+                _log.error("model_check_failed", exc_info=True, extra={"stage": "model_check"})
+            finally:
+                self._queue.task_done()
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def get_moderation_worker():
+    """Returns the process-wide moderation worker, starting it on first use."""
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = ModerationWorker()
+        return _worker
+
+
+def _benchmark(posts, check_delay):
+    samples = [
+        "Today is hard. I keep thinking about the baby we lost at 10 weeks and I feel so alone.",
+        "Sending love to everyone here. Talking to my partner really helped, and so did the NHS pages.",
+        "Make money fast! WhatsApp me for forex signals www.example.com http://bit.ly/x http://a.b http://c.d",
+        "I don't see any reason to go on, I want to die some days.",
+    ]
+    start = time.perf_counter()
+    for i in range(posts):
+        reasons, crisis = check_rules(samples[i % len(samples)])
+    elapsed = time.perf_counter() - start
+    print(f"Inline rules: {posts} posts in {elapsed:.3f}s, {posts / elapsed:,.0f} posts/s, {elapsed / posts * 1e6:.1f} µs/post")
+
+    start = time.perf_counter()
+    for i in range(posts):
+        consume("post", f"user_{i % 500}", now=i * 0.01)
+    elapsed = time.perf_counter() - start
+    print(f"Rate check:   {posts} checks in {elapsed:.3f}s, {elapsed / posts * 1e6:.1f} µs/check")
+
+    class _FakeDoc:
+        def update(self, fields):
+            pass
+
+    def slow_check(content):
+        time.sleep(check_delay) # Stands in for a model call
+        return []
+
+    worker = ModerationWorker(maxsize=posts)
+    queued = min(posts, 2000)
+    start = time.perf_counter()
+    for i in range(queued):
+        worker.submit(_FakeDoc(), samples[i % len(samples)], slow_check)
+    enqueue = time.perf_counter() - start
+    worker.join()
+    total = time.perf_counter() - start
+    print(
+        f"Worker queue: {queued} posts enqueued in {enqueue:.3f}s ({enqueue / queued * 1e6:.1f} µs/post), "
+        f"drained in {total:.3f}s with a {check_delay * 1000:.0f} ms stand-in check"
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Community post moderation tools.")
+    parser.add_argument("--bench", action="store_true", help="Benchmark the inline checks and the worker queue.")
+    parser.add_argument("--posts", type=int, default=100_000, help="Number of posts to run through the inline checks.")
+    parser.add_argument("--check-delay", type=float, default=0.001, help="Seconds the stand-in slow check takes.")
+    args = parser.parse_args(argv)
+    if args.bench:
+        _benchmark(args.posts, args.check_delay)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,8 @@
 import streamlit as st
-from utils import KNOWLEDGE_BASE, _suggest_resources
+from app_logging import get_logger, timed
+from utils import _get_locale
+from rate_limit import consume, describe_wait
+from support_core import answer
 
 def render():
     """Renders the Chat with AI page with enhanced layout and single integrated input + send."""
@@ -49,6 +52,11 @@ def render():
             """, unsafe_allow_html=True)
     st.markdown("</div>", unsafe_allow_html=True) # Close chat-container
 
+    # Shown once after a message was held back by the rate limit
+    if st.session_state.get("chat_notice"):
+        st.info(st.session_state.chat_notice)
+        st.session_state.chat_notice = ""
+
     # --- Chat Input (WhatsApp style) ---
     # Use st.form for input submission to prevent immediate reruns
     # Set clear_on_submit=True to automatically clear the text_input after submission
@@ -74,62 +82,43 @@ def render():
                 st.rerun() # Rerun to update chat history after new messages are appended
 
 
+_log = get_logger("chat")
+
+
 def handle_chat_send(model_instance, user_input): # Added user_input as a parameter
     """Handles the logic for sending a user message and receiving an AI response."""
     user_input = user_input.strip() # Use the passed user_input
     if not user_input:
         return
 
-    st.session_state.messages.append({"role": "user", "content": user_input})
+    # Each message spends a token from the user's chat bucket before any model call is made
+    allowed, retry_after = consume("chat", st.session_state.user_id)
+    if not allowed:
+        _log.info("rate_limited", extra={"stage": "chat", "retry_after": round(retry_after, 1)})
+        st.session_state.chat_notice = (
+            f"You're sending messages a little quickly. Please take a breath and try again in {describe_wait(retry_after)}."
+        )
+        return
 
-    base_instructions = """
-    You are a compassionate and empathetic information assistant specializing in general knowledge about miscarriage.
-    Your primary goal is to provide accurate, general information and point users towards types of support, always emphasizing seeking professional medical and psychological help.
-    Do NOT provide medical diagnosis, personalized medical advice, or therapeutic counseling.
-    """
-
-    knowledge_base_section = f"""
-    --- KNOWLEDGE BASE ---
-    {KNOWLEDGE_BASE}
-    """
-
-    if any(k in user_input.lower() for k in ["myth", "fact", "misconceptions"]):
-        full_prompt = f"""{base_instructions}
-        {knowledge_base_section}
-        Answer this based ONLY on the "MYTHS AND FACTS ABOUT MISCARRIAGE" section:
-        User: {user_input}
-        """
-    elif any(k in user_input.lower() for k in ["talk", "communicate", "say", "phrases"]):
-        full_prompt = f"""{base_instructions}
-        {knowledge_base_section}
-        Answer this based ONLY on the "HOW TO TALK ABOUT MISCARRIAGE & WHAT TO SAY" section:
-        User: {user_input}
-        """
-    else:
-        full_prompt = f"""{base_instructions}
-        {knowledge_base_section}
-        User: {user_input}
-        """
+    st.session_state.messages.append({"role": "user", "content": user_input})
 
     try:
-        # Use the passed model_instance
-        response = model_instance.generate_content([full_prompt])  # Wrapped in list
-        assistant_response = response.text if response.text else "I wasn't able to provide an answer at the moment."
+        # Use the passed model_instance; prompt building and caching are shared with the HTTP API
+        with timed(_log, "answer", locale=_get_locale()) as fields:
+            result = answer(model_instance, user_input, _get_locale())
+            fields["source"] = result["source"]
+        assistant_response = result["answer"]
 
-        resource_suggestion = _suggest_resources(user_input)
+        resource_suggestion = result["resources"]
         if resource_suggestion:
             assistant_response += f"\n\n**Resource Suggestion:** {resource_suggestion}"
 
         st.session_state.messages.append({"role": "assistant", "content": assistant_response})
-    except Exception as e:
+    except Exception:
+        # Already logged with its traceback by timed()
         st.session_state.messages.append({
             "role": "assistant",
             "content": "I'm sorry, something went wrong. Please try again."
         })
-        # --- ENHANCED DEBUGGING LINE ---
-        import traceback
-        print(f"DEBUG: Error during Gemini generate_content(): {e}")
-        traceback.print_exc() # Print full traceback to terminal
-        # --- END ENHANCED DEBUGGING LINE ---
 
     # No st.rerun() here, it's handled by the form submission in render()
@@ -1,7 +1,129 @@
 import streamlit as st
-from datetime import datetime
+import html
+import os
+from datetime import datetime, timezone
+from functools import partial
 import firebase_admin
 from firebase_admin import firestore
+from moderation import CRISIS_MESSAGE, get_moderation_worker, model_check, moderate_post
+from dedup import get_duplicate_detector, minhash
+from post_archive import search_archive
+from rate_limit import describe_wait
+from shared_cache import SharedCache, get_shared_cache
+
+# Set MODERATION_MODEL_CHECK=1 to have the model review each post in the background after it is published
+MODERATION_MODEL_CHECK = os.getenv("MODERATION_MODEL_CHECK", "") == "1"
+REJECTION_MESSAGES = {
+    "blocked_term": "Your message contains content that isn't allowed in this community.",
+    "link_shortener": "Please share full links rather than shortened ones.",
+    "too_many_links": "Your message contains too many links. Please share at most two.",
+    "rate_limited": "You're posting a little quickly. Please take a moment and try again in {wait}.",
+    "duplicate": "You've already shared this message recently. It's still there for the community to see.",
+}
+FEED_SNAPSHOT_TTL = 2 # Seconds a feed snapshot is shared between processes before Firestore is read again
+FEED_SNAPSHOT_VERSION = 1 # Bump when the snapshot's post fields change
+
+
+def _submit_post(content):
+    """Checks a post for near-duplicates, moderates it and writes it to Firestore.
+
+    Sets community_post_message (and community_post_reason when the post is rejected).
+    """
+    # Firestore collection path for public data
+    collection_path = f"artifacts/{st.session_state.app_id}/public/data/community_posts"
+    collection_ref = st.session_state.db.collection(collection_path)
+
+    # Compare against recent posts through the shared LSH index, refreshed with posts made through other processes
+    signature = minhash(content)
+    detector = get_duplicate_detector(collection_path, partial(_load_recent_signatures, collection_ref))
+    duplicate = detector.find_duplicate(signature)
+    if duplicate is not None and duplicate[1] == st.session_state.user_id:
+        # The same user reposting the same message is rejected outright, before it can spend a rate-limit token
+        st.session_state.community_post_message = "rejected"
+        st.session_state.community_post_reason = "duplicate"
+        return
+
+    # Cheap inline checks; rejected posts never reach Firestore
+    verdict = moderate_post(st.session_state.user_id, content)
+    if verdict["action"] == "reject":
+        st.session_state.community_post_message = "rejected"
+        st.session_state.community_post_reason = verdict["reasons"][0]
+        st.session_state.community_post_retry_after = verdict["retry_after"]
+        return
+
+    new_post = {
+        "userId": st.session_state.user_id,
+        "content": content,
+        "timestamp": firestore.SERVER_TIMESTAMP,
+        "hidden": False,
+        "flags": ["crisis"] if verdict["crisis"] else [],
+        "minhash": signature, # Stored so the detector can be refilled after a restart without a rescan
+    }
+    if duplicate is not None:
+        new_post["duplicate_of"] = duplicate[0] # Another user's near-copy is collapsed under the original in the feed
+    _, doc_ref = collection_ref.add(new_post)
+    detector.add(doc_ref.id, st.session_state.user_id, signature)
+    get_shared_cache().delete(_feed_key(collection_path)) # The poster should see their post straight away
+
+    gemini_model = st.session_state.get("gemini_model")
+    if MODERATION_MODEL_CHECK and gemini_model is not None:
+        # The slow model check runs off the request path and can hide the post later
+        get_moderation_worker().submit(doc_ref, content, partial(model_check, gemini_model))
+    st.session_state.community_post_message = "crisis" if verdict["crisis"] else "success"
+
+
+def _feed_key(collection_path):
+    return SharedCache.key("feed", FEED_SNAPSHOT_VERSION, collection_path)
+
+
+def _read_feed(collection_ref):
+    """Reads the latest visible posts, with near-duplicates collapsed under their original."""
+    docs = collection_ref.order_by("timestamp", direction=firestore.Query.DESCENDING).limit(50).stream()
+    posts = []
+    for doc in docs:
+        post_data = doc.to_dict()
+        if post_data.get("hidden"):
+            continue # Hidden by the background moderation check
+        if isinstance(post_data.get("timestamp"), datetime):
+            timestamp_str = post_data.get("timestamp").strftime("%Y-%m-%d %H:%M:%S")
+        else:
+            try:
+                timestamp_str = post_data.get("timestamp").to_datetime().strftime("%Y-%m-%d %H:%M:%S")
+            except AttributeError:
+                timestamp_str = "N/A"
+
+        posts.append({
+            "id": doc.id,
+            "userId": post_data.get("userId", "Anonymous"),
+            "content": post_data.get("content", ""),
+            "timestamp": timestamp_str,
+            "duplicate_of": post_data.get("duplicate_of"),
+            "similar_count": 0,
+        })
+    # Collapse near-duplicates under their original when both are in the window
+    by_id = {post["id"]: post for post in posts}
+    for post in posts:
+        if post["duplicate_of"] in by_id:
+            by_id[post["duplicate_of"]]["similar_count"] += 1
+    return [post for post in posts if post["duplicate_of"] not in by_id]
+
+
+def _load_recent_signatures(collection_ref, limit, since=None):
+    """Reads the stored MinHash signatures of the most recent posts, posted at or after since if given, oldest first."""
+    query = collection_ref
+    if since is not None:
+        query = query.where("timestamp", ">=", datetime.fromtimestamp(since, timezone.utc))
+    recent = []
+    for doc in query.order_by("timestamp", direction=firestore.Query.DESCENDING).limit(limit).stream():
+        post_data = doc.to_dict()
+        if isinstance(post_data.get("timestamp"), datetime) and post_data.get("minhash"):
+            recent.append({
+                "id": doc.id,
+                "userId": post_data.get("userId"),
+                "posted_at": post_data["timestamp"].timestamp(),
+                "minhash": post_data["minhash"],
+            })
+    return list(reversed(recent))
 
 def render():
     """Renders the Community Forum page."""
@@ -43,17 +165,7 @@ def render():
                     # Do not return here, allow the rest of the page to render
                 else:
                     try:
-                        # Firestore collection path for public data
-                        collection_ref = st.session_state.db.collection(
-                            f"artifacts/{st.session_state.app_id}/public/data/community_posts"
-                        )
-                        new_post = {
-                            "userId": st.session_state.user_id,
-                            "content": community_post_content, # Use the captured value
-                            "timestamp": firestore.SERVER_TIMESTAMP
-                        }
-                        collection_ref.add(new_post)
-                        st.session_state.community_post_message = "success" # Set a success message flag
+                        _submit_post(community_post_content)
                     except Exception as e:
                         st.error(f"Error posting message: {e}")
             else:
@@ -63,6 +175,19 @@ def render():
         if "community_post_message" in st.session_state and st.session_state.community_post_message == "success":
             st.success("Your message has been posted!")
             st.session_state.community_post_message = "" # Clear message after display
+        elif "community_post_message" in st.session_state and st.session_state.community_post_message == "crisis":
+            st.success("Your message has been posted!")
+            st.info(CRISIS_MESSAGE)
+            st.session_state.community_post_message = "" # Clear message after display
+        elif "community_post_message" in st.session_state and st.session_state.community_post_message == "rejected":
+            message = REJECTION_MESSAGES.get(st.session_state.get("community_post_reason"), "Your message could not be posted.")
+            wait = describe_wait(st.session_state.get("community_post_retry_after", 0))
+            if st.session_state.get("community_post_reason") == "rate_limited":
+                # Being rate limited is not an error; keep the tone gentle
+                st.info(message.format(wait=wait))
+            else:
+                st.warning(message)
+            st.session_state.community_post_message = "" # Clear message after display
         elif "community_post_message" in st.session_state and st.session_state.community_post_message == "warning":
             st.warning("Please write something before posting to the community.")
             st.session_state.community_post_message = "" # Clear message after display
@@ -73,35 +198,19 @@ def render():
 
         posts_container = st.empty()
 
-        @st.cache_data(ttl=1) # Cache for 1 second to avoid excessive reads
         def get_community_posts():
             # Ensure Firebase and db are initialized before attempting to use db
             if not (st.session_state.get("firebase_app_initialized") and st.session_state.get("db")):
                 return [] # Return empty list if Firebase is not ready
 
             try:
-                collection_ref = st.session_state.db.collection(
-                    f"artifacts/{st.session_state.app_id}/public/data/community_posts"
+                collection_path = f"artifacts/{st.session_state.app_id}/public/data/community_posts"
+                # One process reads the feed from Firestore; the others reuse its snapshot for a few seconds
+                return get_shared_cache().get_or_compute(
+                    _feed_key(collection_path),
+                    partial(_read_feed, st.session_state.db.collection(collection_path)),
+                    ttl=FEED_SNAPSHOT_TTL,
                 )
-                docs = collection_ref.order_by("timestamp", direction=firestore.Query.DESCENDING).limit(50).stream()
-                posts = []
-                for doc in docs:
-                    post_data = doc.to_dict()
-                    if isinstance(post_data.get("timestamp"), datetime):
-                        timestamp_str = post_data.get("timestamp").strftime("%Y-%m-%d %H:%M:%S")
-                    else:
-                        try:
-                            timestamp_str = post_data.get("timestamp").to_datetime().strftime("%Y-%m-%d %H:%M:%S")
-                        except AttributeError:
-                            timestamp_str = "N/A"
-
-                    posts.append({
-                        "id": doc.id,
-                        "userId": post_data.get("userId", "Anonymous"),
-                        "content": post_data.get("content", ""),
-                        "timestamp": timestamp_str
-                    })
-                return posts
             except Exception as e:
                 st.error(f"Error fetching community posts: {e}")
                 return []
@@ -109,12 +218,36 @@ def render():
         posts_data = get_community_posts()
         if posts_data:
             for post in posts_data:
+                similar_note = f" · {post['similar_count']} similar posts" if post["similar_count"] else ""
                 st.markdown(f"""
                 <div class="community-post">
-                    <div class="community-post-header">Posted by: {post['userId']}</div>
-                    <div class="community-post-content">{post['content']}</div>
-                    <div class="community-post-timestamp">{post['timestamp']}</div>
+                    <div class="community-post-header">Posted by: {html.escape(post['userId'])}</div>
+                    <div class="community-post-content">{html.escape(post['content'])}</div>
+                    <div class="community-post-timestamp">{post['timestamp']}{similar_note}</div>
                 </div>
                 """, unsafe_allow_html=True)
         else:
             st.info("No community posts yet. Be the first to share!")
+
+        # Posts older than the retention window live in the archive, not Firestore
+        with st.expander("Search older posts"):
+            with st.form(key="archive_search_form"):
+                archive_query = st.text_input("Words to look for", key="archive_search_input")
+                search_button = st.form_submit_button(label="Search")
+            if search_button:
+                collection_path = f"artifacts/{st.session_state.get('app_id')}/public/data/community_posts"
+                try:
+                    archived_posts = search_archive(collection_path, archive_query)
+                except Exception as e:
+                    st.error(f"Error searching older posts: {e}")
+                    archived_posts = []
+                if not archived_posts:
+                    st.info("No older posts match your search.")
+                for post in archived_posts:
+                    st.markdown(f"""
+                    <div class="community-post">
+                        <div class="community-post-header">Posted by: {html.escape(post.get('userId', 'Anonymous'))}</div>
+                        <div class="community-post-content">{html.escape(post.get('content', ''))}</div>
+                        <div class="community-post-timestamp">{post['timestamp']}</div>
+                    </div>
+                    """, unsafe_allow_html=True)
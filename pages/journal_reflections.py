@@ -1,5 +1,7 @@
 import streamlit as st
 from datetime import datetime
+from journal_index import JournalIndex
+from utils import _get_locale
 
 def render():
     """Renders the Journal & Reflections page."""
@@ -26,6 +28,7 @@ def render():
             if journal_entry_text_area_value.strip(): # Use .strip() to check for non-whitespace content
                 timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
                 st.session_state.journal_entries.append({"timestamp": timestamp, "content": journal_entry_text_area_value})
+                st.session_state.journal_index.add_entry(timestamp, journal_entry_text_area_value) # Index incrementally, no rebuild
                 st.session_state.journal_message = "success"
                 st.session_state.current_journal_text = "" # Clear the text area by updating session state
             else:
@@ -44,8 +47,47 @@ def render():
             st.session_state.journal_message = "" # Clear message after display
 
         if st.session_state.journal_entries:
+            st.markdown("---")
+            st.subheader("Search Your Journal:")
+            _render_journal_search()
+
             st.markdown("---")
             st.subheader("Your Journal Entries (Current Session):")
             for i, entry in enumerate(reversed(st.session_state.journal_entries)):
                 with st.expander(f"Entry from {entry['timestamp']}"):
                     st.markdown(entry['content'])
+
+
+def _render_journal_search():
+    """Renders the journal search form and its highlighted results."""
+    journal_index = st.session_state.journal_index
+    if journal_index.locale != _get_locale():
+        # Words are stemmed per language, so a language switch reindexes the (small) journal
+        journal_index = st.session_state.journal_index = JournalIndex(_get_locale())
+    journal_index.sync(st.session_state.journal_entries) # Catch up on entries saved before the index existed
+
+    with st.form(key='journal_search_form'):
+        query = st.text_input("Search for words in your entries:", key="journal_search_query")
+        col1, col2 = st.columns(2)
+        with col1:
+            start_date = st.date_input("From", value=None, key="journal_search_start")
+        with col2:
+            end_date = st.date_input("To", value=None, key="journal_search_end")
+        search_button = st.form_submit_button(label='Search Journal')
+
+    if not search_button:
+        return
+    if not query.strip() and start_date is None and end_date is None:
+        st.info("Enter a word or pick dates to search your journal.")
+        return
+
+    results = journal_index.search(
+        query,
+        start=start_date.isoformat() if start_date else None,
+        end=end_date.isoformat() if end_date else None,
+    )
+    if not results:
+        st.info("No journal entries match your search.")
+        return
+    for result in results:
+        st.markdown(f"**{result['timestamp']}** — {result['snippet']}")
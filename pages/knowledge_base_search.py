@@ -1,5 +1,7 @@
 import streamlit as st
-from utils import KNOWLEDGE_BASE # Import global knowledge base
+from utils import _get_knowledge_base, _get_locale
+from kb_search import analyze_query, did_you_mean, search_page
+from kb_autocomplete import complete_query
 
 def render():
     """Renders the Knowledge Base Search page."""
@@ -18,18 +20,32 @@ def render():
             st.session_state.last_search_query_submitted = search_query
 
             if search_query.strip(): # Use .strip() to check for actual content
-                results = []
-                # Simple case-insensitive search
-                for line in KNOWLEDGE_BASE.splitlines(): # Use KNOWLEDGE_BASE (uppercase) here
-                    if search_query.lower() in line.lower():
-                        results.append(line)
-                st.session_state.search_results = results
+                # Look terms up in the compiled index, correcting typos, and read only the matching chunks
+                knowledge_base = _get_knowledge_base()
+                analyzed = analyze_query(knowledge_base, search_query, _get_locale())
+                st.session_state.search_analyzed = analyzed
+                # Only the first page is kept in session state; other pages are fetched on demand
+                st.session_state.search_results = search_page(knowledge_base, analyzed)
+                st.session_state.search_suggestion = did_you_mean(analyzed)
             else:
-                # If the search query is empty (or only whitespace), set results to an empty list
-                st.session_state.search_results = []
+                # If the search query is empty (or only whitespace), store an empty page of results
+                st.session_state.search_analyzed = ()
+                st.session_state.search_results = search_page(_get_knowledge_base(), ())
+                st.session_state.search_suggestion = None
                 # Also, set the last submitted query to empty if the input was empty
                 st.session_state.last_search_query_submitted = ""
 
+        # Replace the stored page with the previous or next one
+        def _change_page_callback(step):
+            st.session_state.search_results = search_page(
+                _get_knowledge_base(), st.session_state.search_analyzed, st.session_state.search_results["page"] + step
+            )
+
+        # Fill the search box with a suggested completion and run the search straight away
+        def _apply_completion_callback(completion):
+            st.session_state.knowledge_search_query_input = completion
+            _perform_search_callback()
+
         with st.form(key='knowledge_search_form'):
             # Define the text input widget. Its value is tied to a session state key.
             st.text_input(
@@ -40,16 +56,37 @@ def render():
             # Use on_click to trigger the search callback
             submit_button = st.form_submit_button(label='Search', on_click=_perform_search_callback)
 
+        # Completions for what is in the search box, from the prefix index shared by all sessions
+        completions = complete_query(_get_knowledge_base(), st.session_state.get("knowledge_search_query_input", ""))
+        if completions:
+            st.caption("Suggestions:")
+            for column, completion in zip(st.columns(len(completions)), completions):
+                with column:
+                    st.button(completion, key=f"kb_completion_{completion}", on_click=_apply_completion_callback, args=(completion,))
+
         # Display search results
         # This block will execute on every rerun, displaying the results stored in session state
         if st.session_state.search_results is not None:
             st.markdown("---")
             # Display the search term that was actually used for the results
             st.subheader(f"Search Results for '{st.session_state.last_search_query_submitted}':")
+            if st.session_state.get("search_suggestion"):
+                st.info(f"Did you mean **{st.session_state.search_suggestion}**? Showing results for that instead.")
 
-            if st.session_state.search_results:
-                for line in st.session_state.search_results:
-                    st.markdown(f"- {line}")
+            results = st.session_state.search_results
+            if results["total"]:
+                st.caption(f"{results['total']} matching passages · page {results['page'] + 1} of {results['pages']}")
+                for group in results["groups"]:
+                    # One markdown call per section, with hits highlighted from the index's token offsets
+                    st.markdown(f"**{group['section']}**\n\n" + "\n\n".join(group["hits"]), unsafe_allow_html=True)
+                if results["pages"] > 1:
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        st.button("← Previous", key="kb_search_prev", disabled=results["page"] == 0,
+                                  on_click=_change_page_callback, args=(-1,))
+                    with col2:
+                        st.button("Next →", key="kb_search_next", disabled=results["page"] + 1 >= results["pages"],
+                                  on_click=_change_page_callback, args=(1,))
             else:
                 # Differentiate between no results for a valid query and an empty query submission
                 if st.session_state.last_search_query_submitted:
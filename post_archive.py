@@ -0,0 +1,272 @@
+"""Hot/cold tiering for community posts.
+
+The Firestore collection only holds recent posts. A retention job moves posts older than
+POST_RETENTION_DAYS into a cold archive of gzip-compressed JSONL segments on local disk,
+one or more per month, and deletes them from Firestore. The newest KEEP_RECENT_POSTS are
+never archived, so a quiet forum still shows a full feed.
+
+Segments are written to a temporary file and renamed into place before any post is
+deleted, so a crash can at worst leave a post in both tiers; readers keep one copy of
+each post id. Old history is searched on demand with search_archive(): each segment has
+a small sidecar listing the words it contains, so only segments that can match are
+decompressed.
+
+    python post_archive.py --app-id <project id> [--days 30] [--dry-run]
+    python post_archive.py --local-store forum.json --app-id demo   # against the local Firestore stand-in
+    python post_archive.py --bench [--posts 20000]                  # seeds a stand-in and measures the job
+"""
+import argparse
+import functools
+import gzip
+import json
+import os
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from app_logging import get_logger
+from text_analysis import analyze
+
+POST_RETENTION_DAYS = float(os.getenv("POST_RETENTION_DAYS", "30"))
+POST_ARCHIVE_DIR = os.getenv("POST_ARCHIVE_DIR", "post_archive")
+KEEP_RECENT_POSTS = 50 # Matches the feed size
+ARCHIVE_BATCH_SIZE = 400 # Firestore allows 500 writes per batch
+ARCHIVE_CACHE_SEGMENTS = 24 # Decompressed segments kept for repeated searches
+SEGMENT_SUFFIX = ".jsonl.gz"
+TERMS_SUFFIX = ".terms.gz" # Sidecar with the analyzed words of a segment
+SEARCH_RESULTS = 20
+DESCENDING = "DESCENDING" # Same value as firestore.Query.DESCENDING
+ARCHIVED_FIELDS = ("userId", "content", "hidden", "flags", "duplicate_of", "moderation_reasons")
+
+_log = get_logger("archive")
+
+
+def collection_path(app_id):
+    """Returns the Firestore path of an app's community posts."""
+    return f"artifacts/{app_id}/public/data/community_posts"
+
+
+def archive_location(posts_path, archive_dir=POST_ARCHIVE_DIR):
+    """Returns the directory holding the archive segments of a posts collection."""
+    return os.path.join(archive_dir, *posts_path.split("/"))
+
+
+def _archive_record(doc):
+    post_data = doc.to_dict()
+    record = {"id": doc.id, "timestamp": post_data["timestamp"].astimezone(timezone.utc).isoformat()}
+    # Signatures only matter for duplicate checks against recent posts, so they stay behind
+    record.update({field: post_data[field] for field in ARCHIVED_FIELDS if field in post_data})
+    return record
+
+
+def _write_segment(location, month, records):
+    """Writes records as a new compressed segment for a month; returns its size in bytes."""
+    os.makedirs(location, exist_ok=True)
+    base = os.path.join(location, f"{month}-{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:6]}")
+    terms = set()
+    for record in records:
+        terms.update(analyze(record.get("content", ""), cache=False))
+    size = 0
+    # The sidecar goes first, so a segment is never visible without it
+    for suffix, lines in ((TERMS_SUFFIX, sorted(terms)), (SEGMENT_SUFFIX, (json.dumps(record, ensure_ascii=False) for record in records))):
+        temp_path = base + suffix + ".tmp"
+        with gzip.open(temp_path, "wt", encoding="utf-8") as f:
+            for line in lines:
+                f.write(line + "\n")
+        with open(temp_path, "rb") as f:
+            os.fsync(f.fileno()) # On disk before the originals are deleted
+        os.replace(temp_path, base + suffix)
+        size += os.path.getsize(base + suffix)
+    return size
+
+
+def _archive_cutoff(posts_ref, older_than, keep_recent):
+    """Returns the timestamp before which posts are archived: the age limit, or older if fewer posts are newer."""
+    if keep_recent:
+        recent = list(posts_ref.order_by("timestamp", direction=DESCENDING).limit(keep_recent).stream())
+        if len(recent) < keep_recent:
+            return None # Nothing is old enough to leave the feed
+        return min(older_than, recent[-1].to_dict()["timestamp"])
+    return older_than
+
+
+def archive_posts(db, posts_path, archive_dir=POST_ARCHIVE_DIR, retention_days=POST_RETENTION_DAYS,
+                  keep_recent=KEEP_RECENT_POSTS, batch_size=ARCHIVE_BATCH_SIZE, dry_run=False, now=None):
+    """Moves posts older than the retention period from Firestore into the cold archive.
+
+    Returns {"archived", "segments", "bytes_written", "duration_ms"}.
+    """
+    start = time.perf_counter()
+    posts_ref = db.collection(posts_path)
+    location = archive_location(posts_path, archive_dir)
+    cutoff = _archive_cutoff(posts_ref, (now or datetime.now(timezone.utc)) - timedelta(days=retention_days), keep_recent)
+    stats = {"archived": 0, "segments": 0, "bytes_written": 0}
+    while cutoff is not None:
+        docs = list(posts_ref.where("timestamp", "<", cutoff).order_by("timestamp").limit(batch_size).stream())
+        if not docs:
+            break
+        by_month = {}
+        for doc in docs:
+            record = _archive_record(doc)
+            by_month.setdefault(record["timestamp"][:7], []).append(record)
+        if dry_run:
+            stats["archived"] += len(docs)
+            break
+        for month, records in by_month.items():
+            stats["bytes_written"] += _write_segment(location, month, records)
+            stats["segments"] += 1
+        batch = db.batch()
+        for doc in docs:
+            batch.delete(doc.reference)
+        batch.commit()
+        stats["archived"] += len(docs)
+        if len(docs) < batch_size:
+            break
+    stats["duration_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    _log.info("archived", extra=dict(stats, stage="archive", collection=posts_path, dry_run=dry_run))
+    return stats
+
+
+@functools.lru_cache(maxsize=1024)
+def _segment_terms(path):
+    """Returns the words a segment contains, or None if it has no sidecar."""
+    try:
+        with gzip.open(path[:-len(SEGMENT_SUFFIX)] + TERMS_SUFFIX, "rt", encoding="utf-8") as f:
+            return frozenset(line.rstrip("\n") for line in f)
+    except FileNotFoundError:
+        return None
+
+
+@functools.lru_cache(maxsize=ARCHIVE_CACHE_SEGMENTS)
+def _read_segment(path, mtime_ns):
+    """Returns (record, analyzed terms) pairs for one segment; cached until the file changes."""
+    entries = []
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            entries.append((record, frozenset(analyze(record.get("content", ""), cache=False))))
+    return tuple(entries)
+
+
+def _segments(location, since=None, until=None):
+    """Lists segment paths, newest month first, skipping months outside [since, until]."""
+    try:
+        names = [name for name in os.listdir(location) if name.endswith(SEGMENT_SUFFIX)]
+    except FileNotFoundError:
+        return []
+    months = lambda name: name[:7]
+    return [
+        os.path.join(location, name) for name in sorted(names, reverse=True)
+        if (since is None or months(name) >= since.strftime("%Y-%m")) and (until is None or months(name) <= until.strftime("%Y-%m"))
+    ]
+
+
+def search_archive(posts_path, query="", since=None, until=None, limit=SEARCH_RESULTS, archive_dir=POST_ARCHIVE_DIR):
+    """Returns archived visible posts containing every word of the query, newest first.
+
+    An empty query lists the newest archived posts. since/until (datetimes) narrow the
+    months read, so only the segments that can match are decompressed.
+    """
+    terms = set(analyze(query))
+    found = {}
+    month = None
+    for path in _segments(archive_location(posts_path, archive_dir), since, until):
+        # Months are read newest first; once one has filled the page, older months cannot improve it
+        if len(found) >= limit and os.path.basename(path)[:7] != month:
+            break
+        month = os.path.basename(path)[:7]
+        segment_terms = _segment_terms(path)
+        if terms and segment_terms is not None and not terms <= segment_terms:
+            continue # Segments are immutable, so the sidecar can be trusted for good
+        for record, post_terms in _read_segment(path, os.stat(path).st_mtime_ns):
+            if record.get("hidden") or record["id"] in found or not terms <= post_terms:
+                continue
+            posted_at = datetime.fromisoformat(record["timestamp"])
+            if (since is None or posted_at >= since) and (until is None or posted_at <= until):
+                found[record["id"]] = dict(record, timestamp=posted_at.strftime("%Y-%m-%d %H:%M:%S"))
+    return sorted(found.values(), key=lambda post: post["timestamp"], reverse=True)[:limit]
+
+
+def archive_size(posts_path, archive_dir=POST_ARCHIVE_DIR):
+    """Returns (segments, compressed bytes) held in the archive of a collection."""
+    paths = _segments(archive_location(posts_path, archive_dir))
+    sidecars = [path[:-len(SEGMENT_SUFFIX)] + TERMS_SUFFIX for path in paths]
+    return len(paths), sum(os.path.getsize(path) for path in paths + sidecars if os.path.exists(path))
+
+
+def _benchmark(posts, retention_days):
+    import random
+    import tempfile
+
+    from local_firestore import SERVER_TIMESTAMP, LocalFirestore
+
+    rng = random.Random(7)
+    words = "grief baby loss partner hospital bleeding hope today week support love scan doctor family tired".split()
+    db = LocalFirestore()
+    path = collection_path("bench")
+    posts_ref = db.collection(path)
+    now = datetime.now(timezone.utc)
+    for i in range(posts):
+        posts_ref.add({
+            "userId": f"user_{i % 300}", "content": " ".join(rng.choice(words) for _ in range(40)),
+            "timestamp": now - timedelta(days=365 * i / posts), "hidden": False, "flags": [], "minhash": list(range(64)),
+        })
+    raw_bytes = sum(len(json.dumps(doc.to_dict(), default=str)) for doc in posts_ref.stream())
+    posts_ref.add({"userId": "user_0", "content": "posted just now", "timestamp": SERVER_TIMESTAMP})
+
+    with tempfile.TemporaryDirectory() as archive_dir:
+        stats = archive_posts(db, path, archive_dir, retention_days)
+        hot = sum(1 for _ in posts_ref.stream())
+        print(
+            f"Archived {stats['archived']} of {posts + 1} posts in {stats['duration_ms']:.0f} ms into {stats['segments']} segments; "
+            f"{hot} posts stay hot. Archive is {stats['bytes_written'] / 1024:.0f} KiB; the posts were {raw_bytes / 1024:.0f} KiB of JSON in Firestore."
+        )
+        for query in ("hospital bleeding", "zzz"):
+            start = time.perf_counter()
+            results = search_archive(path, query, archive_dir=archive_dir)
+            cold = time.perf_counter() - start
+            start = time.perf_counter()
+            search_archive(path, query, archive_dir=archive_dir)
+            warm = time.perf_counter() - start
+            print(f"Search {query!r}: {len(results)} results, {cold * 1000:.1f} ms cold, {warm * 1000:.1f} ms cached")
+
+
+def _firestore_client(local_store):
+    if local_store:
+        from local_firestore import LocalFirestore
+
+        return LocalFirestore(local_store)
+    import firebase_admin
+    from firebase_admin import credentials, firestore
+
+    config = os.getenv("FIREBASE_CONFIG")
+    if not config:
+        raise SystemExit("Set FIREBASE_CONFIG to the service account JSON (or a path to it), or use --local-store.")
+    if os.path.exists(config):
+        with open(config, encoding="utf-8") as f:
+            config = f.read()
+    return firestore.client(firebase_admin.initialize_app(credentials.Certificate(json.loads(config))))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Move old community posts from Firestore into the cold archive.")
+    parser.add_argument("--app-id", help="Firebase project id whose posts are archived.")
+    parser.add_argument("--days", type=float, default=POST_RETENTION_DAYS, help="Archive posts older than this many days.")
+    parser.add_argument("--archive-dir", default=POST_ARCHIVE_DIR, help="Where archive segments are written.")
+    parser.add_argument("--local-store", help="Use the local Firestore stand-in saved in this JSON file.")
+    parser.add_argument("--dry-run", action="store_true", help="Count the first batch of posts to archive without moving them.")
+    parser.add_argument("--bench", action="store_true", help="Seed a stand-in with a year of posts and measure archiving and search.")
+    parser.add_argument("--posts", type=int, default=20_000, help="Posts seeded by --bench.")
+    args = parser.parse_args(argv)
+
+    if args.bench:
+        _benchmark(args.posts, args.days)
+        return
+    if not args.app_id:
+        parser.error("--app-id is required")
+    stats = archive_posts(_firestore_client(args.local_store), collection_path(args.app_id), args.archive_dir, args.days, dry_run=args.dry_run)
+    print(f"{'Would archive' if args.dry_run else 'Archived'} {stats['archived']} posts ({stats['bytes_written']} bytes in {stats['segments']} segments).")
+
+
+if __name__ == "__main__":
+    main()
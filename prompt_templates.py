@@ -0,0 +1,307 @@
+"""Prompt templates with a static prefix compiled once per route and knowledge base version.
+
+A chat prompt is split into a prefix that is the same for every question on a route (the
+instructions, the knowledge base context and the route's instruction) and a short
+per-question suffix. Prefixes are compiled once per knowledge base version, with their
+size and token count precomputed, and shared by every session. The prefix and suffix are
+sent as separate parts, so no request copies the knowledge base into a new string.
+
+A prefix-cache backend lets the model client reference a prefix stored upstream instead
+of resending it. Configure with PROMPT_PREFIX_CACHE:
+    gemini  use Gemini context caching for prefixes large enough to qualify (default)
+    local   in-process stand-in that behaves like an upstream cache; for tests and benches
+    none    always send the whole prompt
+Bytes sent per request, and bytes saved by the prefix cache, are counted in prompt_stats().
+"""
+import datetime
+import hashlib
+import os
+import re
+import threading
+import time
+
+from app_logging import get_logger
+from kb_locales import DEFAULT_LOCALE
+from kb_search import PROMPT_CORPUS_BYTES, context_text, relevant_sections
+from text_analysis import contains_any
+
+PROMPT_PREFIX_CACHE = os.getenv("PROMPT_PREFIX_CACHE", "gemini")
+# Context caching needs a pinned model version, e.g. "gemini-1.5-flash-001"; by default the answering
+# model's own name is used. A pinned version of any other model is refused, never silently swapped in.
+GEMINI_CACHE_MODEL = os.getenv("GEMINI_CACHE_MODEL", "")
+GEMINI_MIN_CACHE_TOKENS = int(os.getenv("GEMINI_MIN_CACHE_TOKENS", "32768")) # Smaller prefixes are rejected upstream
+PREFIX_CACHE_TTL = 60 * 60
+SEND_LOG_SAMPLE = 0.05
+
+BASE_INSTRUCTIONS = """You are a compassionate and empathetic information assistant specializing in general knowledge about miscarriage.
+Your primary goal is to provide accurate, general information and point users towards types of support, always emphasizing seeking professional medical and psychological help.
+Do NOT provide medical diagnosis, personalized medical advice, or therapeutic counseling.
+"""
+# Words that route a question, per locale: (route, keywords) pairs checked in order
+ROUTE_KEYWORDS = {
+    "en": [
+        ("myths", ["myth", "fact", "misconception"]),
+        ("how_to_talk", ["talk", "communicate", "say", "phrase"]),
+    ],
+    "sw": [
+        ("myths", ["uongo", "ukweli", "imani potofu", "dhana potofu", "hadithi"]),
+        ("how_to_talk", ["kuzungumza", "kuongea", "kusema", "niseme", "nimwambie", "maneno"]),
+    ],
+}
+# route -> (section title prefix, instruction); the general route uses the whole knowledge base
+ROUTE_SECTIONS = {
+    "myths": ("MYTHS AND FACTS", 'Answer this based ONLY on the "MYTHS AND FACTS ABOUT MISCARRIAGE" section:'),
+    "how_to_talk": ("HOW TO TALK", 'Answer this based ONLY on the "HOW TO TALK ABOUT MISCARRIAGE & WHAT TO SAY" section:'),
+}
+
+_log = get_logger("prompt")
+
+
+def route(user_input, locale=DEFAULT_LOCALE):
+    """Returns which prompt template a question is routed to: "myths", "how_to_talk" or "general"."""
+    for route_name, keywords in ROUTE_KEYWORDS.get(locale, ROUTE_KEYWORDS[DEFAULT_LOCALE]):
+        if contains_any(user_input, keywords, locale):
+            return route_name
+    return "general"
+
+
+def estimate_tokens(text):
+    """Rough token count for when the model does not report usage: about four characters per token."""
+    return -(-len(text) // 4)
+
+
+def _knowledge_base_block(text):
+    return f"\n--- KNOWLEDGE BASE ---\n{text}\n"
+
+
+class CompiledPrefix:
+    """The static start of every prompt on one route for one knowledge base version."""
+
+    def __init__(self, route_name, knowledge_base_version, text, retrieved_tail=None, template="", section_ids=None):
+        self.route = route_name
+        self.knowledge_base_version = knowledge_base_version
+        self.text = text
+        self.size = len(text.encode("utf-8"))
+        self.tokens = estimate_tokens(text)
+        self.digest = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        # Set when the knowledge base is too large to inline: each suffix then carries the chunks
+        # retrieved for its question, followed by this route instruction
+        self.retrieved_tail = retrieved_tail
+        # Identifies the instructions apart from the knowledge base text, for dependency keys
+        self.template_digest = hashlib.sha1(f"{route_name}\n{template}".encode("utf-8")).hexdigest()[:16]
+        self.section_ids = section_ids # The route's section and subsections, or None for the general context
+
+
+def _compile(knowledge_base, route_name):
+    title_prefix, instruction = ROUTE_SECTIONS.get(route_name, (None, ""))
+    instruction_line = f"{instruction}\n" if instruction else ""
+    # Routes whose section is missing fall back to the general context but keep their instruction
+    section = knowledge_base.find_section(title_prefix) if title_prefix else None
+    template = BASE_INSTRUCTIONS + instruction_line
+    if section is not None:
+        context = knowledge_base.section_text(section, max_bytes=PROMPT_CORPUS_BYTES)
+    elif knowledge_base.corpus_size <= PROMPT_CORPUS_BYTES:
+        context = knowledge_base.text()
+    else:
+        return CompiledPrefix(route_name, knowledge_base.version, BASE_INSTRUCTIONS, instruction_line, "retrieved\n" + template)
+    return CompiledPrefix(
+        route_name, knowledge_base.version, BASE_INSTRUCTIONS + _knowledge_base_block(context) + instruction_line, None,
+        template, tuple(knowledge_base.section_subtree(section)) if section is not None else None,
+    )
+
+
+def compiled_prefix(knowledge_base, route_name):
+    """Returns the compiled prefix for a route, compiling it once per knowledge base version."""
+    return knowledge_base.derived(f"prompt_prefix:{route_name}", lambda kb: _compile(kb, route_name))
+
+
+def prompt_parts(knowledge_base, user_input, locale=DEFAULT_LOCALE):
+    """Returns (compiled prefix, per-question suffix) for a question."""
+    prefix = compiled_prefix(knowledge_base, route(user_input, locale))
+    suffix = f"User: {user_input}\n"
+    if prefix.retrieved_tail is not None:
+        suffix = _knowledge_base_block(context_text(knowledge_base, user_input, locale=locale)) + prefix.retrieved_tail + suffix
+    return prefix, suffix
+
+
+def answer_fingerprint(knowledge_base, user_input, locale=DEFAULT_LOCALE):
+    """Returns a key for what an answer depends on: its prompt template and the knowledge base sections behind it.
+
+    A routed answer depends on its route's section; a general answer on the sections that
+    mention the question's words, or on the whole knowledge base if none do. Editing any
+    other section leaves the key, and so cached and precomputed answers, unchanged.
+    """
+    prefix = compiled_prefix(knowledge_base, route(user_input, locale))
+    section_ids = prefix.section_ids or relevant_sections(knowledge_base, user_input, locale)
+    return f"{prefix.template_digest}-{knowledge_base.fingerprint(section_ids) if section_ids else knowledge_base.version}"
+
+
+def build_prompt(knowledge_base, user_input, locale=DEFAULT_LOCALE):
+    """Returns the whole prompt for a question as one string, e.g. for measuring it."""
+    prefix, suffix = prompt_parts(knowledge_base, user_input, locale)
+    return prefix.text + suffix
+
+
+class LocalPrefixCache:
+    """Stand-in for an upstream context cache.
+
+    Prefixes are "uploaded" once and then referenced; the wrapped model still receives the
+    full prompt locally, but only the suffix counts as sent. Used for tests and benches.
+    """
+
+    def __init__(self, min_tokens=0):
+        self.min_tokens = min_tokens
+        self.uploaded = {} # prefix digest -> bytes uploaded once
+        self._lock = threading.Lock()
+
+    def lookup(self, model_instance, prefix):
+        if prefix.tokens < self.min_tokens:
+            return None
+        with self._lock:
+            uploaded_now = prefix.digest not in self.uploaded
+            self.uploaded.setdefault(prefix.digest, prefix.size)
+        return _LocalCachedModel(model_instance, prefix), (prefix.size if uploaded_now else 0)
+
+
+class _LocalCachedModel:
+    def __init__(self, model_instance, prefix):
+        self._model = model_instance
+        self._prefix = prefix
+
+    def generate_content(self, contents, stream=False):
+        return self._model.generate_content([self._prefix.text] + list(contents), stream=stream)
+
+
+def _base_model_name(name):
+    # "models/gemini-1.5-flash-001" -> "gemini-1.5-flash"
+    return re.sub(r"-\d{3}$", "", name.rsplit("/", 1)[-1])
+
+
+class GeminiPrefixCache:
+    """Gemini context caching: each prefix is uploaded once per TTL and referenced by name.
+
+    The cached content is created for the model that would answer (or the pinned version of
+    it named by model_name), since a model bound to cached content answers with that model.
+    Uploads happen outside the lock: while one is in flight, other requests for the same
+    prefix keep using the previous upload or send the prefix in full rather than waiting.
+    """
+
+    def __init__(self, model_name=GEMINI_CACHE_MODEL, min_tokens=GEMINI_MIN_CACHE_TOKENS, ttl=PREFIX_CACHE_TTL):
+        self.model_name = model_name
+        self.min_tokens = min_tokens
+        self.ttl = ttl
+        self._models = {} # prefix digest -> (model bound to the cached content, refresh after)
+        self._failed = set() # digests the service refused to cache; sent in full from then on
+        self._in_flight = set() # digests being uploaded
+        self._lock = threading.Lock()
+
+    def _cache_model(self, model_instance):
+        """Returns the model name to cache for, or None if model_name pins a different model."""
+        if not self.model_name:
+            return model_instance.model_name
+        if _base_model_name(self.model_name) != _base_model_name(model_instance.model_name):
+            return None
+        return self.model_name
+
+    def lookup(self, model_instance, prefix):
+        # Only real Gemini models can reference cached content, and only above the size minimum
+        if prefix.tokens < self.min_tokens or not hasattr(model_instance, "model_name") or prefix.digest in self._failed:
+            return None
+        with self._lock:
+            cached = self._models.get(prefix.digest)
+            if cached is not None and (cached[1] > time.time() or prefix.digest in self._in_flight):
+                return cached[0], 0 # While a refresh is in flight the old upload has not expired yet
+            if prefix.digest in self._in_flight:
+                return None
+            self._in_flight.add(prefix.digest)
+        try:
+            cache_model = self._cache_model(model_instance)
+            if cache_model is None:
+                _log.error("prefix_cache_model_mismatch", extra={
+                    "stage": "prefix_cache", "cache_model": self.model_name, "model": model_instance.model_name,
+                    "hint": "GEMINI_CACHE_MODEL must be a pinned version of the answering model; prompts are sent in full",
+                })
+                self._failed.add(prefix.digest)
+                return None
+            try:
+                import google.generativeai as genai
+                from google.generativeai import caching
+
+                content = caching.CachedContent.create(
+                    model=cache_model,
+                    display_name=f"kb-{prefix.knowledge_base_version}-{prefix.route}",
+                    contents=[prefix.text],
+                    ttl=datetime.timedelta(seconds=self.ttl),
+                )
+                bound = genai.GenerativeModel.from_cached_content(cached_content=content)
+            except Exception:
+                _log.warning("prefix_cache_failed", exc_info=True, extra={"stage": "prefix_cache", "route": prefix.route})
+                self._failed.add(prefix.digest)
+                return None
+            with self._lock:
+                # Refresh a little before the upstream copy expires
+                self._models[prefix.digest] = (bound, time.time() + self.ttl * 0.9)
+        finally:
+            with self._lock:
+                self._in_flight.discard(prefix.digest)
+        _log.info("prefix_cached", extra={"stage": "prefix_cache", "route": prefix.route, "prefix_bytes": prefix.size, "model": cache_model})
+        return bound, prefix.size
+
+
+class _NoPrefixCache:
+    def lookup(self, model_instance, prefix):
+        return None
+
+
+_backend = None
+_backend_lock = threading.Lock()
+_stats = {"requests": 0, "bytes_sent": 0, "bytes_saved": 0, "prefix_uploads": 0}
+_stats_lock = threading.Lock()
+
+
+def get_prefix_cache():
+    """Returns the process-wide prefix-cache backend chosen by PROMPT_PREFIX_CACHE."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = {"local": LocalPrefixCache, "none": _NoPrefixCache}.get(PROMPT_PREFIX_CACHE, GeminiPrefixCache)()
+        return _backend
+
+
+def set_prefix_cache(backend):
+    """Replaces the prefix-cache backend, e.g. with a LocalPrefixCache in tests."""
+    global _backend
+    with _backend_lock:
+        _backend = backend
+
+
+def send_prompt(model_instance, prefix, suffix, stream=False):
+    """Sends a prompt to the model, referencing a cached prefix when the backend has one.
+
+    Returns (response, bytes sent for this request).
+    """
+    cached = get_prefix_cache().lookup(model_instance, prefix)
+    suffix_size = len(suffix.encode("utf-8"))
+    if cached is not None:
+        bound_model, uploaded = cached
+        response = bound_model.generate_content([suffix], stream=stream)
+        sent, saved = suffix_size + uploaded, prefix.size - uploaded
+    else:
+        response = model_instance.generate_content([prefix.text, suffix], stream=stream) # Parts, not one concatenated copy
+        sent, saved, uploaded = prefix.size + suffix_size, 0, 0
+    with _stats_lock:
+        _stats["requests"] += 1
+        _stats["bytes_sent"] += sent
+        _stats["bytes_saved"] += saved
+        _stats["prefix_uploads"] += 1 if uploaded else 0
+    _log.info("sent", extra={
+        "stage": "model", "route": prefix.route, "bytes_sent": sent, "bytes_saved": saved,
+        "prefix_tokens": prefix.tokens, "sample": SEND_LOG_SAMPLE,
+    })
+    return response, sent
+
+
+def prompt_stats():
+    """Returns totals since start-up: requests, bytes_sent, bytes_saved and prefix_uploads."""
+    with _stats_lock:
+        return dict(_stats)
@@ -0,0 +1,167 @@
+"""Per-user token-bucket rate limits for chat messages and forum posts.
+
+Each policy gives a user a bucket of `capacity` tokens that refills at `refill_rate` tokens
+per second; an action costs one token and is refused when the bucket is empty, so short
+bursts are allowed but a steady flood is not.
+
+Bucket state lives in a store shared by every session in the process. Set
+RATE_LIMIT_DB=/path/to/rate_limits.sqlite3 to share it between worker processes on one host
+instead.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+# policy -> (capacity, refill rate in tokens per second); override with e.g. RATE_LIMIT_CHAT="5,0.2"
+DEFAULT_POLICIES = {
+    "chat": (6, 6 / 60), # Bursts of 6 messages, then one every 10 seconds
+    "post": (3, 3 / 300), # Bursts of 3 posts, then one every 100 seconds
+    "partner": (120, 1.0), # All chat requests from one API partner: bursts of 120, then one a second
+}
+PRUNE_EVERY = 1000 # Consumes between sweeps of buckets that have refilled completely
+
+
+def _load_policies():
+    policies = {}
+    for name, default in DEFAULT_POLICIES.items():
+        value = os.getenv(f"RATE_LIMIT_{name.upper()}", "")
+        try:
+            capacity, refill_rate = (float(part) for part in value.split(","))
+        except ValueError:
+            capacity, refill_rate = default
+        policies[name] = (capacity, refill_rate)
+    return policies
+
+
+POLICIES = _load_policies()
+
+
+def _refill(tokens, updated, now, capacity, refill_rate):
+    return min(capacity, tokens + max(0.0, now - updated) * refill_rate)
+
+
+class MemoryBucketStore:
+    """Bucket state held in this process, guarded by a lock."""
+
+    def __init__(self):
+        self._buckets = {} # (policy, user id) -> (tokens, updated at)
+        self._lock = threading.Lock()
+        self._consumes = 0
+
+    def consume(self, policy, user_id, capacity, refill_rate, cost, now):
+        with self._lock:
+            tokens, updated = self._buckets.get((policy, user_id), (capacity, now))
+            tokens = _refill(tokens, updated, now, capacity, refill_rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[(policy, user_id)] = (tokens, now)
+            self._consumes += 1
+            if self._consumes % PRUNE_EVERY == 0:
+                self._prune(now)
+            return allowed, tokens
+
+    def _prune(self, now):
+        # A bucket that has refilled completely behaves exactly like a missing one
+        for key, (tokens, updated) in list(self._buckets.items()):
+            capacity, refill_rate = POLICIES.get(key[0], (0, 0))
+            if _refill(tokens, updated, now, capacity, refill_rate) >= capacity:
+                del self._buckets[key]
+
+
+class SqliteBucketStore:
+    """Bucket state in a SQLite file, shared by every worker process on the host."""
+
+    def __init__(self, path):
+        self._path = path
+        self._local = threading.local() # SQLite connections cannot be shared between threads
+        self._consumes = 0
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                "policy TEXT NOT NULL, user_id TEXT NOT NULL, tokens REAL NOT NULL, updated REAL NOT NULL, "
+                "PRIMARY KEY (policy, user_id))"
+            )
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self._path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def consume(self, policy, user_id, capacity, refill_rate, cost, now):
+        connection = self._connection()
+        # BEGIN IMMEDIATE takes the write lock up front, so two processes cannot both spend the last token
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute(
+                "SELECT tokens, updated FROM buckets WHERE policy = ? AND user_id = ?", (policy, user_id)
+            ).fetchone()
+            tokens, updated = row if row else (capacity, now)
+            tokens = _refill(tokens, updated, now, capacity, refill_rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            connection.execute(
+                "INSERT OR REPLACE INTO buckets (policy, user_id, tokens, updated) VALUES (?, ?, ?, ?)",
+                (policy, user_id, tokens, now),
+            )
+            self._consumes += 1
+            if self._consumes % PRUNE_EVERY == 0:
+                # Rows untouched for longer than any bucket takes to refill are equivalent to missing ones
+                longest_refill = max(capacity / refill_rate for capacity, refill_rate in POLICIES.values() if refill_rate)
+                connection.execute("DELETE FROM buckets WHERE updated < ?", (now - longest_refill,))
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        return allowed, tokens
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_bucket_store():
+    """Returns the process-wide bucket store, SQLite-backed if RATE_LIMIT_DB is set."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            path = os.getenv("RATE_LIMIT_DB", "")
+            _store = SqliteBucketStore(path) if path else MemoryBucketStore()
+        return _store
+
+
+def consume(policy, user_id, cost=1, now=None):
+    """Spends tokens from a user's bucket for a policy.
+
+    Returns (allowed, seconds until the action would be allowed again; 0 if it was allowed).
+    """
+    capacity, refill_rate = POLICIES[policy]
+    # Wall-clock time, since a SQLite store is shared between processes
+    now = time.time() if now is None else now
+    allowed, tokens = get_bucket_store().consume(policy, user_id, capacity, refill_rate, cost, now)
+    if allowed:
+        return True, 0
+    return False, (cost - tokens) / refill_rate if refill_rate else float("inf")
+
+
+def refund(policy, user_id, cost=1, now=None):
+    """Gives back tokens spent by consume() for an action that was refused later on."""
+    capacity, refill_rate = POLICIES[policy]
+    now = time.time() if now is None else now
+    # A negative cost always succeeds; the next refill caps the bucket at its capacity again
+    get_bucket_store().consume(policy, user_id, capacity, refill_rate, -cost, now)
+
+
+def describe_wait(seconds):
+    """Returns a friendly description of a wait, e.g. "about a minute"."""
+    if seconds < 10:
+        return "a few seconds"
+    if seconds < 60:
+        return f"about {round(seconds / 10) * 10} seconds"
+    minutes = round(seconds / 60)
+    return "about a minute" if minutes <= 1 else f"about {minutes} minutes"
@@ -0,0 +1,327 @@
+"""Compact session snapshots, so a reconnect or worker restart resumes where the user left off.
+
+The session state keys worth keeping (the chat transcript, journal entries, search state,
+page and language) are stored as zlib-compressed JSON under a random resume token that
+the app keeps in the page URL. The forum user id is deliberately not kept, so a copied link
+can never be used to post as someone else. Each key is its own row tagged with
+SNAPSHOT_VERSION: after a script run only the keys whose value changed are written, and
+resuming reads every row of a token in one query. The transcript and journal only grow, so
+they are split into pages of PAGE_ITEMS items and a new message rewrites just the last page.
+Rows written by another snapshot version are ignored, and a snapshot that does not decode is
+deleted, so either way the session starts afresh instead of failing.
+
+Configure with SESSION_STORE=sqlite|memory|off, SESSION_STORE_PATH and SESSION_TTL_DAYS.
+Snapshots hold private journal text: the SQLite file lives in the app's private data
+directory (see app_storage) with 0600 permissions, and entries expire after the TTL.
+"""
+import hashlib
+import json
+import os
+import secrets
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+
+from app_logging import get_logger
+from app_storage import private_dir, private_file
+
+SESSION_STORE = os.getenv("SESSION_STORE", "sqlite")
+SESSION_STORE_PATH = os.getenv("SESSION_STORE_PATH") # Defaults to sessions.sqlite3 in the private data directory
+SESSION_TTL = float(os.getenv("SESSION_TTL_DAYS", "7")) * 24 * 60 * 60
+SNAPSHOT_VERSION = 1 # Bump when a stored key changes shape
+RESUME_PARAM = "resume" # Query parameter holding the resume token
+SNAPSHOT_KEYS = (
+    "locale", "current_page", "messages", "journal_entries",
+    "knowledge_search_query_input", "last_search_query_submitted",
+    "search_analyzed", "search_results", "search_suggestion",
+)
+PAGED_KEYS = ("messages", "journal_entries") # Append-only lists, stored in pages
+PAGE_ITEMS = 16
+DIGESTS_KEY = "_snapshot_digests" # Session state key holding the digest of each value last written
+COMPRESS_LEVEL = 6
+PRUNE_EVERY = 200 # Saves between sweeps of expired snapshots
+
+_log = get_logger("session")
+
+
+def _restore_analyzed(analyzed):
+    # JSON turns tuples into lists; search caches need them hashable again
+    return tuple((term, weight, typed, tuple(variants)) for term, weight, typed, variants in analyzed)
+
+
+_RESTORERS = {"search_analyzed": _restore_analyzed}
+
+
+class MemorySnapshotStore:
+    """Snapshots held in this process; survives reconnects but not restarts."""
+
+    def __init__(self):
+        self._rows = {} # token -> {key: (version, value, updated at)}
+        self._lock = threading.Lock()
+
+    def load(self, token):
+        cutoff = time.time() - SESSION_TTL
+        with self._lock:
+            rows = self._rows.get(token, {})
+            return {key: value for key, (version, value, updated) in rows.items() if version == SNAPSHOT_VERSION and updated >= cutoff}
+
+    def save(self, token, values):
+        now = time.time()
+        with self._lock:
+            rows = self._rows.setdefault(token, {})
+            rows.update((key, (SNAPSHOT_VERSION, value, now)) for key, value in values.items())
+            for key, (version, value, _) in rows.items():
+                rows[key] = (version, value, now) # The whole snapshot stays alive while any of it changes
+
+    def delete(self, token):
+        with self._lock:
+            self._rows.pop(token, None)
+
+
+class SqliteSnapshotStore:
+    """Snapshots in a SQLite file, shared by every worker process on the host."""
+
+    def __init__(self, path):
+        self._path = private_file(path, create=True) # 0600; raises PermissionError for another user's file
+        self._local = threading.local() # SQLite connections cannot be shared between threads
+        self._saves = 0
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS snapshots (token TEXT NOT NULL, key TEXT NOT NULL, version INTEGER NOT NULL,"
+            " value BLOB NOT NULL, updated REAL NOT NULL, PRIMARY KEY (token, key))"
+        )
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self._path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL") # Losing the last change after a power cut is acceptable
+            self._local.connection = connection
+        return connection
+
+    def load(self, token):
+        rows = self._connection().execute(
+            "SELECT key, value FROM snapshots WHERE token = ? AND version = ? AND updated >= ?",
+            (token, SNAPSHOT_VERSION, time.time() - SESSION_TTL),
+        ).fetchall()
+        return dict(rows)
+
+    def save(self, token, values):
+        connection = self._connection()
+        now = time.time()
+        connection.execute("BEGIN")
+        try:
+            connection.executemany(
+                "INSERT OR REPLACE INTO snapshots (token, key, version, value, updated) VALUES (?, ?, ?, ?, ?)",
+                [(token, key, SNAPSHOT_VERSION, value, now) for key, value in values.items()],
+            )
+            # The whole snapshot stays alive while any of it changes
+            connection.execute("UPDATE snapshots SET updated = ? WHERE token = ?", (now, token))
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        self._saves += 1
+        if self._saves % PRUNE_EVERY == 0:
+            connection.execute("DELETE FROM snapshots WHERE updated < ?", (now - SESSION_TTL,))
+
+    def delete(self, token):
+        self._connection().execute("DELETE FROM snapshots WHERE token = ?", (token,))
+
+
+class _NoSnapshotStore:
+    def load(self, token):
+        return {}
+
+    def save(self, token, values):
+        pass
+
+    def delete(self, token):
+        pass
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_snapshot_store():
+    """Returns the process-wide snapshot store, configured from SESSION_STORE and SESSION_STORE_PATH."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            if SESSION_STORE == "off":
+                _store = _NoSnapshotStore()
+            elif SESSION_STORE == "memory":
+                _store = MemorySnapshotStore()
+            else:
+                path = SESSION_STORE_PATH
+                try:
+                    path = path or os.path.join(private_dir(), "sessions.sqlite3")
+                    _store = SqliteSnapshotStore(path)
+                except (sqlite3.Error, OSError) as e:
+                    # OSError includes PermissionError for a file or directory another user owns
+                    _log.warning("store_unavailable", extra={"path": path, "error": str(e), "fallback": "memory"})
+                    _store = MemorySnapshotStore()
+        return _store
+
+
+def new_token():
+    """Returns a new resume token; it is unguessable because it unlocks the session's journal."""
+    return secrets.token_urlsafe(18)
+
+
+def _encode(value):
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _snapshot_rows(state):
+    """Yields (row key, JSON bytes) for the snapshot keys present in state.
+
+    A paged list is stored as a row holding its page count plus one "key:page" row per page;
+    rows for pages past the count are left behind and ignored on restore.
+    """
+    for key in SNAPSHOT_KEYS:
+        if key not in state:
+            continue
+        value = state[key]
+        if key in PAGED_KEYS and isinstance(value, list):
+            pages = -(-len(value) // PAGE_ITEMS)
+            yield key, _encode({"pages": pages})
+            for page in range(pages):
+                yield f"{key}:{page}", _encode(value[page * PAGE_ITEMS:(page + 1) * PAGE_ITEMS])
+        else:
+            yield key, _encode(value)
+
+
+def restore_session(state, token, store=None):
+    """Fills state from the snapshot saved under token; returns whether one was found.
+
+    A snapshot that does not decode is deleted and reported as not found, so the caller
+    starts a fresh session instead of failing on every reload of the same link.
+    """
+    if not token:
+        return False
+    store = store or get_snapshot_store()
+    start = time.perf_counter()
+    try:
+        rows = store.load(token)
+    except sqlite3.Error:
+        _log.warning("restore_failed", exc_info=True, extra={"stage": "resume"})
+        return False
+    if not rows:
+        return False
+    try:
+        digests, values, restored = {}, {}, {}
+        for key, value in rows.items():
+            raw = zlib.decompress(value)
+            digests[key] = hashlib.sha1(raw).digest()
+            values[key] = json.loads(raw)
+        for key in SNAPSHOT_KEYS:
+            if key not in values:
+                continue
+            value = values[key]
+            if key in PAGED_KEYS:
+                value = [item for page in range(value["pages"]) for item in values[f"{key}:{page}"]]
+            restored[key] = _RESTORERS.get(key, lambda restored: restored)(value)
+    except (zlib.error, ValueError, KeyError, TypeError):
+        # JSONDecodeError is a ValueError; KeyError and TypeError come from rows of the wrong shape
+        _log.warning("snapshot_corrupt", exc_info=True, extra={"stage": "resume", "rows": len(rows)})
+        try:
+            store.delete(token)
+        except sqlite3.Error:
+            pass
+        return False
+    state.update(restored) # Only once everything decoded, so a bad row never leaves a half-restored session
+    state[DIGESTS_KEY] = digests # What is stored already, so the next save writes nothing
+    _log.info("resumed", extra={
+        "stage": "resume", "rows": len(rows), "snapshot_bytes": sum(len(value) for value in rows.values()),
+        "duration_ms": round((time.perf_counter() - start) * 1000, 2),
+    })
+    return True
+
+
+def save_session(state, token, store=None):
+    """Writes the snapshot keys whose values changed since the last save; returns the bytes written."""
+    digests = state.get(DIGESTS_KEY)
+    if digests is None:
+        digests = state[DIGESTS_KEY] = {}
+    changed, new_digests = {}, {}
+    for key, raw in _snapshot_rows(state):
+        digest = hashlib.sha1(raw).digest()
+        if digests.get(key) != digest:
+            changed[key] = zlib.compress(raw, COMPRESS_LEVEL)
+            new_digests[key] = digest
+    if not changed:
+        return 0
+    try:
+        (store or get_snapshot_store()).save(token, changed)
+    except sqlite3.Error:
+        _log.warning("save_failed", exc_info=True, extra={"stage": "snapshot"})
+        return 0
+    digests.update(new_digests)
+    written = sum(len(value) for value in changed.values())
+    _log.debug("saved", extra={"stage": "snapshot", "rows": sorted(changed), "snapshot_bytes": written})
+    return written
+
+
+def _benchmark(turns, entries, rounds=50):
+    import random
+    import statistics
+
+    rng = random.Random(7)
+    words = "grief baby loss partner hospital bleeding hope today week support love scan doctor family tired".split()
+    text = lambda count: " ".join(rng.choice(words) for _ in range(count))
+    state = {
+        "user_id": "user_" + os.urandom(4).hex(), "locale": "en", "current_page": "Chat with AI",
+        "messages": [{"role": role, "content": text(150 if role == "assistant" else 20)} for _ in range(turns) for role in ("user", "assistant")],
+        "journal_entries": [{"timestamp": f"2026-10-{1 + i % 28:02d} 21:00:00", "content": text(100)} for i in range(entries)],
+        "knowledge_search_query_input": "bleeding", "last_search_query_submitted": "bleeding",
+        "search_analyzed": (("bleeding", 1.0, "bleeding", ("bleeding",)),),
+        "search_results": {"total": 12, "page": 0, "pages": 2, "groups": [{"section": "SIGNS", "hits": [text(30) for _ in range(5)]}]},
+        "search_suggestion": None,
+    }
+    raw_bytes = sum(len(_encode(state[key])) for key in SNAPSHOT_KEYS)
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = SqliteSnapshotStore(os.path.join(directory, "sessions.sqlite3"))
+        token = new_token()
+        start = time.perf_counter()
+        full_bytes = save_session(state, token, store)
+        full_ms = (time.perf_counter() - start) * 1000
+
+        save_times, save_bytes, restore_times = [], [], []
+        for _ in range(rounds):
+            state["messages"].append({"role": "user", "content": text(20)})
+            start = time.perf_counter()
+            save_bytes.append(save_session(state, token, store))
+            save_times.append((time.perf_counter() - start) * 1000)
+            start = time.perf_counter()
+            restored = {}
+            restore_session(restored, token, store)
+            restore_times.append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        unchanged = save_session(state, token, store)
+        unchanged_ms = (time.perf_counter() - start) * 1000
+        assert all(restored[key] == state[key] for key in SNAPSHOT_KEYS)
+
+    print(
+        f"Snapshot of {turns} chat turns and {entries} journal entries: {full_bytes / 1024:.1f} KiB compressed "
+        f"({raw_bytes / 1024:.1f} KiB as JSON), first save {full_ms:.2f} ms."
+    )
+    print(
+        f"After one new message: {statistics.median(save_bytes) / 1024:.1f} KiB written in {statistics.median(save_times):.2f} ms; "
+        f"a run that changed nothing writes {unchanged} bytes in {unchanged_ms:.2f} ms."
+    )
+    print(f"Resume (one read and decode): {statistics.median(restore_times):.2f} ms median, {max(restore_times):.2f} ms max.")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Measure session snapshot size and save/resume latency.")
+    parser.add_argument("--turns", type=int, default=40, help="Chat turns in the benchmark session.")
+    parser.add_argument("--entries", type=int, default=20, help="Journal entries in the benchmark session.")
+    args = parser.parse_args()
+    _benchmark(args.turns, args.entries)
@@ -0,0 +1,306 @@
+"""Cache shared by every app process on a host.
+
+Several Streamlit processes behind a load balancer would otherwise each redo the same
+upstream work: model answers, Firestore feed reads and index builds. Values go through a
+small backend interface (get, set, add, delete) that a Redis-like service maps onto
+directly (GET, SET EX, SET NX EX, DEL); the default backend is shared_cache.sqlite3 in the
+app's private data directory, so processes on one host share it without extra infrastructure.
+
+Keys are versioned: callers pass the version of whatever the value was derived from (for
+example the knowledge base version), so a new version simply misses and old entries age
+out. On a miss, only one caller computes the value while the others wait for it.
+
+Values are stored as JSON, or as raw array bytes for indexes (pack_arrays), and never
+pickled: anything able to write the backend could otherwise run code in every app process.
+A value that does not decode is treated as a miss. The SQLite file is created with 0600
+permissions in a 0700 directory (see app_storage) and is refused if another user owns it.
+
+Configure with SHARED_CACHE=sqlite|memory|off and SHARED_CACHE_PATH.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import struct
+import sys
+import threading
+import time
+from array import array
+
+from app_logging import get_logger
+from app_storage import private_dir, private_file
+from kb_artifact import FORMAT_VERSION
+
+SHARED_CACHE = os.getenv("SHARED_CACHE", "sqlite")
+SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH") # Defaults to shared_cache.sqlite3 in the private data directory
+DEFAULT_TTL = 60 * 60
+INDEX_TTL = 7 * 24 * 60 * 60 # Indexes are keyed by knowledge base version, so they only need to age out
+LOCK_TTL = 30 # A computing caller that dies releases its lock after this long
+LOCK_POLL_SECONDS = 0.05
+PRUNE_EVERY = 500 # Writes between sweeps of expired SQLite entries
+HIT_LOG_SAMPLE = 0.01
+
+_log = get_logger("cache")
+
+
+class MemoryCacheBackend:
+    """In-process backend, for single-process deployments and development."""
+
+    def __init__(self):
+        self._entries = {} # key -> (value, expires at)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value, expires = self._entries.get(key, (None, 0))
+            if value is not None and expires < time.time():
+                del self._entries[key]
+                return None
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.time() + ttl)
+            if len(self._entries) % PRUNE_EVERY == 0:
+                now = time.time()
+                for stale in [k for k, (_, expires) in self._entries.items() if expires < now]:
+                    del self._entries[stale]
+
+    def add(self, key, value, ttl):
+        """Sets key only if it is missing or expired; returns whether it was set."""
+        with self._lock:
+            _, expires = self._entries.get(key, (None, 0))
+            if expires >= time.time():
+                return False
+            self._entries[key] = (value, time.time() + ttl)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class SqliteCacheBackend:
+    """Backend in a SQLite file, shared by every process that opens the same path."""
+
+    def __init__(self, path):
+        self._path = private_file(path, create=True) # 0600; raises PermissionError for another user's file
+        self._local = threading.local() # SQLite connections cannot be shared between threads
+        self._writes = 0
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL NOT NULL)"
+        )
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self._path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL") # A lost cache write after a power cut is harmless
+            self._local.connection = connection
+        return connection
+
+    def get(self, key):
+        row = self._connection().execute(
+            "SELECT value FROM cache WHERE key = ? AND expires >= ?", (key, time.time())
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def set(self, key, value, ttl):
+        connection = self._connection()
+        connection.execute("INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)", (key, value, time.time() + ttl))
+        self._writes += 1
+        if self._writes % PRUNE_EVERY == 0:
+            connection.execute("DELETE FROM cache WHERE expires < ?", (time.time(),))
+
+    def add(self, key, value, ttl):
+        """Sets key only if it is missing or expired; returns whether it was set."""
+        connection = self._connection()
+        now = time.time()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute("DELETE FROM cache WHERE key = ? AND expires < ?", (key, now))
+            added = connection.execute(
+                "INSERT OR IGNORE INTO cache (key, value, expires) VALUES (?, ?, ?)", (key, value, now + ttl)
+            ).rowcount == 1
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        return added
+
+    def delete(self, key):
+        self._connection().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+
+def _encode_json(value):
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _decode_json(data):
+    return json.loads(data)
+
+
+def pack_arrays(*arrays):
+    """Serializes arrays as raw bytes: a count, then per array its typecode, length and little-endian items."""
+    parts = [struct.pack("<I", len(arrays))]
+    for values in arrays:
+        if sys.byteorder == "big":
+            values = array(values.typecode, values)
+            values.byteswap()
+        parts.append(struct.pack("<cQ", values.typecode.encode("ascii"), len(values)))
+        parts.append(values.tobytes())
+    return b"".join(parts)
+
+
+def unpack_arrays(data):
+    """Reverses pack_arrays; raises ValueError or struct.error for malformed data."""
+    (count,), offset = struct.unpack_from("<I", data), 4
+    arrays = []
+    for _ in range(count):
+        typecode, length = struct.unpack_from("<cQ", data, offset)
+        offset += struct.calcsize("<cQ")
+        values = array(typecode.decode("ascii"))
+        end = offset + length * values.itemsize
+        if end > len(data):
+            raise ValueError("Truncated array data")
+        values.frombytes(data[offset:end])
+        if sys.byteorder == "big":
+            values.byteswap()
+        arrays.append(values)
+        offset = end
+    return arrays
+
+
+def pack_strings(strings):
+    """Returns strings as one array of UTF-8 bytes for pack_arrays; strings must not contain NUL."""
+    return array("B", "\0".join(strings).encode("utf-8"))
+
+
+def unpack_strings(values):
+    """Reverses pack_strings."""
+    text = values.tobytes().decode("utf-8")
+    return text.split("\0") if text else []
+
+
+class SharedCache:
+    """Versioned get-or-compute over a backend, with one computing caller per key.
+
+    Values go through encode/decode functions, JSON by default.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    @staticmethod
+    def key(namespace, version, *parts):
+        """Returns the backend key for a value; long or arbitrary parts are hashed."""
+        digest = hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()
+        return f"{namespace}:{version}:{digest}"
+
+    def get(self, key, decode=_decode_json):
+        data = self.backend.get(key)
+        if data is None:
+            return None
+        try:
+            return decode(data)
+        except Exception:
+            _log.warning("undecodable", extra={"namespace": key.split(":", 1)[0]})
+            return None
+
+    def set(self, key, value, ttl=DEFAULT_TTL, encode=_encode_json):
+        self.backend.set(key, encode(value), ttl)
+
+    def delete(self, key):
+        self.backend.delete(key)
+
+    def get_or_compute(self, key, compute, ttl=DEFAULT_TTL, encode=_encode_json, decode=_decode_json):
+        """Returns the cached value for key, or computes, stores and returns it.
+
+        If another caller is already computing the same key, waits up to LOCK_TTL for its
+        result instead of repeating the work. None results are not cached.
+        """
+        value = self.get(key, decode)
+        if value is not None:
+            _log.debug("hit", extra={"namespace": key.split(":", 1)[0], "sample": HIT_LOG_SAMPLE})
+            return value
+        lock_key = f"lock:{key}"
+        deadline = time.monotonic() + LOCK_TTL
+        while not self.backend.add(lock_key, b"1", LOCK_TTL):
+            time.sleep(LOCK_POLL_SECONDS)
+            value = self.get(key, decode)
+            if value is not None:
+                return value
+            if time.monotonic() > deadline:
+                return compute() # The other caller is stuck; compute without storing rather than wait forever
+        try:
+            # Someone may have stored the value between our miss and taking the lock
+            value = self.get(key, decode)
+            if value is None:
+                value = compute()
+                if value is not None:
+                    self.set(key, value, ttl, encode)
+            return value
+        finally:
+            self.backend.delete(lock_key)
+
+
+class _NoCache(SharedCache):
+    """Stand-in used when SHARED_CACHE=off: every lookup misses and nothing is stored."""
+
+    def __init__(self):
+        super().__init__(None)
+
+    def get(self, key, decode=_decode_json):
+        return None
+
+    def set(self, key, value, ttl=DEFAULT_TTL, encode=_encode_json):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def get_or_compute(self, key, compute, ttl=DEFAULT_TTL, encode=_encode_json, decode=_decode_json):
+        return compute()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_shared_cache():
+    """Returns the process-wide shared cache, configured from SHARED_CACHE and SHARED_CACHE_PATH."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            if SHARED_CACHE == "off":
+                _cache = _NoCache()
+            elif SHARED_CACHE == "memory":
+                _cache = SharedCache(MemoryCacheBackend())
+            else:
+                path = SHARED_CACHE_PATH
+                try:
+                    path = path or os.path.join(private_dir(), "shared_cache.sqlite3")
+                    _cache = SharedCache(SqliteCacheBackend(path))
+                except (sqlite3.Error, OSError) as e:
+                    # OSError includes PermissionError for a file or directory another user owns
+                    _log.warning("backend_unavailable", extra={"path": path, "error": str(e), "fallback": "memory"})
+                    _cache = SharedCache(MemoryCacheBackend())
+        return _cache
+
+
+def shared_index(knowledge_base, name, index_class):
+    """Returns a derived index of a knowledge base, built by one process and loaded by the rest.
+
+    index_class(knowledge_base) builds the index; index.to_bytes() and
+    index_class.from_bytes(data, knowledge_base) store and load it, reattaching whatever the
+    index reads from the mapped artifact.
+    """
+    def _build(knowledge_base):
+        # Indexes hold term ids, which change with the artifact format even when the text does not
+        cache_key = SharedCache.key("index", knowledge_base.version, FORMAT_VERSION, name)
+        return get_shared_cache().get_or_compute(
+            cache_key, lambda: index_class(knowledge_base), ttl=INDEX_TTL,
+            encode=lambda index: index.to_bytes(), decode=lambda data: index_class.from_bytes(data, knowledge_base),
+        )
+    return knowledge_base.derived(name, _build)
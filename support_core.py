@@ -0,0 +1,166 @@
+"""The chat, search and resource pipeline, independent of Streamlit.
+
+The Streamlit pages and the HTTP API (api_server.py) both call into this module, so a
+question asked through a partner app gets the same prompt, knowledge base context,
+cached answers and resource suggestions as one asked in the UI. Prompt assembly itself
+lives in prompt_templates.py.
+"""
+import os
+import time
+
+from faq_answers import find_precomputed
+from kb_locales import DEFAULT_LOCALE, get_knowledge_base
+from kb_search import analyze_query, did_you_mean, search_page
+from prompt_templates import answer_fingerprint, estimate_tokens, prompt_parts, send_prompt
+from shared_cache import SharedCache, get_shared_cache
+from text_analysis import contains_any, text_key
+
+GEMINI_MODEL_NAME = "gemini-1.5-flash"
+CHAT_ANSWER_TTL = 6 * 60 * 60
+FALLBACK_ANSWER = "I wasn't able to provide an answer at the moment."
+
+# Resource suggestion rules per locale: (keywords, suggestion) pairs checked against the user's message
+RESOURCE_RULES = {
+    "en": [
+        (["grief", "sadness", "cope", "emotional", "support group", "counseling"],
+         "Consider reaching out to a professional counselor specializing in reproductive loss or joining a peer support group like those offered by *Still A Mum*."),
+        (["medical", "doctor", "symptoms", "bleeding", "pain", "hospital"],
+         "For any medical concerns or symptoms, it is crucial to consult a qualified healthcare provider immediately."),
+        (["partner", "family", "friend", "how to help"],
+         "Resources are available for partners, family, and friends on how to offer compassionate compassionate support. Look for guides on supporting someone through grief."),
+        (["crisis", "urgent", "immediate help"],
+         "If you need immediate support, crisis lines and helplines suchs as Marie Stopes Kenya can offer a safe space to talk."),
+    ],
+    "sw": [
+        (["huzuni", "majonzi", "kukabiliana", "hisia", "kikundi cha msaada", "ushauri"],
+         "Fikiria kuwasiliana na mshauri wa kitaalamu anayeshughulikia kupoteza ujauzito, au kujiunga na kikundi cha msaada kama vile vinavyotolewa na *Still A Mum*."),
+        (["daktari", "dalili", "damu", "maumivu", "hospitali", "matibabu"],
+         "Kwa wasiwasi wowote wa kiafya au dalili, ni muhimu kumwona mtoa huduma za afya aliyehitimu mara moja."),
+        (["mwenzi", "mume", "familia", "rafiki", "jinsi ya kusaidia"],
+         "Kuna rasilimali kwa wenzi, familia na marafiki kuhusu jinsi ya kutoa msaada kwa huruma. Tafuta miongozo ya kumsaidia mtu anayepitia huzuni."),
+        (["dharura", "msaada wa haraka", "hatari"],
+         "Ikiwa unahitaji msaada wa haraka, simu za msaada kama vile Marie Stopes Kenya zinaweza kukupa nafasi salama ya kuzungumza."),
+    ],
+}
+
+
+def suggest_resources(prompt_text, locale=DEFAULT_LOCALE):
+    """Suggests resources based on the user's prompt, using the rules for the given locale."""
+    rules = RESOURCE_RULES.get(locale, RESOURCE_RULES[DEFAULT_LOCALE])
+    suggestions = [suggestion for keywords, suggestion in rules if contains_any(prompt_text, keywords, locale)]
+    return " ".join(suggestions) if suggestions else ""
+
+
+def _answer_key(knowledge_base, user_input, locale):
+    # The same question from any session or process shares one model call, whatever its case,
+    # accents or spacing; an edit to the knowledge base only invalidates answers drawing on the
+    # sections it touched
+    return SharedCache.key("chat_answer", answer_fingerprint(knowledge_base, user_input, locale), text_key(user_input, locale))
+
+
+def answer(model_instance, user_input, locale=DEFAULT_LOCALE):
+    """Answers a question: returns {"answer": text, "resources": suggestion or "", "source": ...}.
+
+    source is "curated" or "generated" for a precomputed answer and "model" otherwise.
+    """
+    knowledge_base = get_knowledge_base(locale)
+    resources = suggest_resources(user_input, locale)
+    precomputed = find_precomputed(user_input, locale, knowledge_base)
+    if precomputed is not None:
+        return {"answer": precomputed[0]["answer"], "resources": resources, "source": precomputed[0]["source"]}
+    text = get_shared_cache().get_or_compute(
+        _answer_key(knowledge_base, user_input, locale),
+        lambda: send_prompt(model_instance, *prompt_parts(knowledge_base, user_input, locale))[0].text or None,
+        ttl=CHAT_ANSWER_TTL,
+    )
+    return {"answer": text or FALLBACK_ANSWER, "resources": resources, "source": "model"}
+
+
+def stream_answer(model_instance, user_input, locale=DEFAULT_LOCALE):
+    """Yields the answer to a question in pieces as the model produces them.
+
+    Precomputed and cached answers are yielded whole; a freshly streamed one is cached once it completes.
+    """
+    knowledge_base = get_knowledge_base(locale)
+    precomputed = find_precomputed(user_input, locale, knowledge_base)
+    if precomputed is not None:
+        yield precomputed[0]["answer"]
+        return
+    cache = get_shared_cache()
+    key = _answer_key(knowledge_base, user_input, locale)
+    cached = cache.get(key)
+    if cached is not None:
+        yield cached
+        return
+    pieces = []
+    response, _ = send_prompt(model_instance, *prompt_parts(knowledge_base, user_input, locale), stream=True)
+    for chunk in response:
+        if chunk.text:
+            pieces.append(chunk.text)
+            yield chunk.text
+    if pieces:
+        cache.set(key, "".join(pieces), ttl=CHAT_ANSWER_TTL)
+    else:
+        yield FALLBACK_ANSWER
+
+
+def search(query, locale=DEFAULT_LOCALE, page=0):
+    """Searches the knowledge base; returns a page of results plus any spelling correction.
+
+    Snippets are HTML-escaped text with matches wrapped in <mark>.
+    """
+    knowledge_base = get_knowledge_base(locale)
+    analyzed = analyze_query(knowledge_base, query, locale) if query.strip() else ()
+    results = search_page(knowledge_base, analyzed, page)
+    return dict(results, query=query, suggestion=did_you_mean(analyzed))
+
+
+def create_model():
+    """Returns a Gemini model configured from GOOGLE_API_KEY; raises ValueError if the key is missing."""
+    import google.generativeai as genai
+
+    api_key = os.getenv("GOOGLE_API_KEY")
+    if not api_key:
+        raise ValueError("GOOGLE_API_KEY environment variable not set or is empty.")
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel(GEMINI_MODEL_NAME)
+
+
+class _LocalUsage:
+    def __init__(self, prompt_token_count, candidates_token_count):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+
+
+class _LocalResponse:
+    def __init__(self, text, prompt=""):
+        self.text = text
+        self.usage_metadata = _LocalUsage(estimate_tokens(prompt), estimate_tokens(text))
+
+
+class LocalModel:
+    """Offline stand-in for the Gemini model, for load tests and development without an API key.
+
+    Answers with a fixed text after a delay, streaming it in a few pieces when asked.
+    """
+
+    def __init__(self, delay=0.2, pieces=4):
+        self.delay = delay
+        self.pieces = pieces
+
+    def _text(self, prompt):
+        question = prompt[-1].rsplit("User:", 1)[-1].strip()
+        return f"(local model) You asked: {question} Please speak to a healthcare provider about your situation."
+
+    def generate_content(self, prompt, stream=False):
+        text = self._text(prompt)
+        if not stream:
+            time.sleep(self.delay)
+            return _LocalResponse(text, "".join(prompt))
+        return self._stream(text)
+
+    def _stream(self, text):
+        size = -(-len(text) // self.pieces)
+        for start in range(0, len(text), size):
+            time.sleep(self.delay / self.pieces)
+            yield _LocalResponse(text[start:start + size])
@@ -0,0 +1,136 @@
+"""Shared text analysis: Unicode normalization, tokenization, stopwords and light stemming.
+
+Every component that compares words — knowledge base indexing and search, prompt routing,
+resource suggestions, precomputed-answer matching and answer cache keys — goes through
+this module, so "Miscarriages", "miscarriage" and "MISCARRIAGE" are treated alike
+everywhere, in English and Kiswahili.
+
+Analysis of short texts (questions, queries, keywords) is memoized in a bounded LRU
+cache; longer texts such as knowledge base chunks are analyzed once when the artifact is
+compiled, never per query.
+"""
+import functools
+import re
+import unicodedata
+
+ANALYSIS_CACHE_SIZE = 4096 # Distinct short texts whose analysis is kept
+MAX_CACHED_CHARS = 512 # Longer texts are analyzed without caching so the cache stays small
+MIN_STEM_CHARS = 3
+
+# Word characters in any script, plus combining accents so decomposed text stays one token
+TOKEN_RE = re.compile(r"[\w\u0300-\u036f]+", re.UNICODE)
+
+STOPWORDS = {
+    "en": frozenset("""
+        a about am an and any are as at be been being but by can could do does did for from had has have
+        how i if in into is it its just me my of on or our so than that the their them then there these
+        they this those to too us was we were what when where which who why will with would you your
+    """.split()),
+    "sw": frozenset("""
+        au bado baada cha hadi hata hii hilo hiyo hizi huo ili je juu kabla katika kama kuhusu kuwa kwa
+        kwamba la lakini mimi na ndani ni nini pia sana sisi tu vipi vya wa wake wao wewe ya yake yangu
+        yeye za zake
+    """.split()),
+}
+# Suffixes stripped by the light stemmers, tried in order; at most one is removed
+_SUFFIXES = {
+    "en": ("ing", "ed", "s"),
+    # Common verb extensions: causative, passive, stative and reciprocal
+    "sw": ("ishwa", "eshwa", "iwa", "ewa", "ika", "eka", "ana"),
+}
+_KEEP_S = ("ss", "us", "is") # English words that end in s without being plurals
+
+
+def normalize(text):
+    """Returns text in canonical form: NFKC, case-folded, with accents removed."""
+    if text.isascii():
+        return text.lower()
+    folded = unicodedata.normalize("NFKD", unicodedata.normalize("NFKC", text).casefold())
+    return unicodedata.normalize("NFC", "".join(c for c in folded if not unicodedata.combining(c)))
+
+
+def normalize_token(token):
+    """Normalizes one token found by TOKEN_RE, e.g. while indexing with byte offsets."""
+    return token.lower() if token.isascii() else normalize(token)
+
+
+def stem(term, locale="en"):
+    """Strips a common inflectional suffix from a normalized term.
+
+    Deliberately light: stems only need to be consistent, so a question and a knowledge
+    base passage that use different forms of a word still meet.
+    """
+    if len(term) <= MIN_STEM_CHARS + 1 or not term.isalpha():
+        return term
+    if locale == "sw":
+        for suffix in _SUFFIXES["sw"]:
+            if term.endswith(suffix) and len(term) - len(suffix) >= MIN_STEM_CHARS:
+                term = term[:-len(suffix)]
+                break
+        # Noun and verb final vowels vary with inflection (huzuni / huzunika)
+        return term[:-1] if term[-1] in "aeiou" and len(term) > MIN_STEM_CHARS else term
+    if term.endswith("ies"):
+        return term[:-3] + "y"
+    for suffix in _SUFFIXES["en"]:
+        if term.endswith(suffix) and len(term) - len(suffix) >= MIN_STEM_CHARS:
+            if suffix == "s" and term.endswith(_KEEP_S) or suffix == "ed" and term.endswith("eed"):
+                break
+            term = term[:-len(suffix)]
+            break
+    # cause, causes, caused and causing all become "caus"
+    return term[:-1] if term.endswith("e") and len(term) > MIN_STEM_CHARS + 1 else term
+
+
+def _analyze(text, locale, keep_stopwords):
+    terms = TOKEN_RE.findall(normalize(text))
+    if not keep_stopwords:
+        stopwords = STOPWORDS.get(locale, STOPWORDS["en"])
+        terms = [term for term in terms if term not in stopwords]
+    return tuple(stem(term, locale) for term in terms)
+
+
+_cached_analyze = functools.lru_cache(maxsize=ANALYSIS_CACHE_SIZE)(_analyze)
+_cached_tokenize = functools.lru_cache(maxsize=ANALYSIS_CACHE_SIZE)(lambda text: tuple(TOKEN_RE.findall(normalize(text))))
+
+
+def tokenize(text):
+    """Returns the normalized tokens of a text, without stopword removal or stemming."""
+    if len(text) > MAX_CACHED_CHARS:
+        return tuple(TOKEN_RE.findall(normalize(text)))
+    return _cached_tokenize(text)
+
+
+def analyze(text, locale="en", keep_stopwords=False, cache=True):
+    """Returns the stemmed terms of a text, in order, with stopwords removed unless asked to keep them.
+
+    Pass cache=False for texts analyzed once in bulk, so they do not push questions out of the cache.
+    """
+    if not cache or len(text) > MAX_CACHED_CHARS:
+        return _analyze(text, locale, keep_stopwords)
+    return _cached_analyze(text, locale, keep_stopwords)
+
+
+def contains_any(text, phrases, locale="en"):
+    """Checks whether any phrase occurs in the text as whole words, comparing stemmed forms.
+
+    Stopwords are kept, so "how to help" only matches that phrase, not any mention of "help".
+    """
+    terms = analyze(text, locale, keep_stopwords=True)
+    present = set(terms)
+    for phrase in phrases:
+        wanted = analyze(phrase, locale, keep_stopwords=True)
+        if not wanted or not present.issuperset(wanted):
+            continue
+        if len(wanted) == 1 or any(terms[i:i + len(wanted)] == wanted for i in range(len(terms) - len(wanted) + 1)):
+            return True
+    return False
+
+
+def text_key(text, locale="en"):
+    """Returns a canonical form of a question for cache keys: the same words in any case or spacing give the same key."""
+    return " ".join(analyze(text, locale, keep_stopwords=True))
+
+
+def analysis_cache_info():
+    """Returns hit and miss counts for the analysis caches."""
+    return {"analyze": _cached_analyze.cache_info()._asdict(), "tokenize": _cached_tokenize.cache_info()._asdict()}
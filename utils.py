@@ -5,29 +5,40 @@ import json
 import firebase_admin
 from firebase_admin import credentials
 from firebase_admin import firestore
+from app_logging import get_logger
+from journal_index import JournalIndex
+from kb_locales import DEFAULT_LOCALE, get_knowledge_base, knowledge_base_path
+from session_snapshot import RESUME_PARAM, new_token, restore_session, save_session
+from support_core import GEMINI_MODEL_NAME
 
 # Global variables (will be populated by functions)
-KNOWLEDGE_BASE = ""
 GEMINI_API_KEY = ""
 model = None # This global 'model' will be initially None, and then the actual model will be stored in session_state
+_log = get_logger("gemini")
 
 def _load_knowledge_base():
-    """Loads the knowledge base content from a text file."""
-    global KNOWLEDGE_BASE
+    """Makes sure the knowledge base for the session's locale is loaded, recompiling it only when the source changed."""
     try:
-        with open("knowledge_base.txt", "r", encoding="utf-8") as f:
-            KNOWLEDGE_BASE = f.read()
+        _get_knowledge_base()
     except FileNotFoundError:
-        st.error("knowledge_base.txt not found. Please create it in the same directory as app.py")
+        st.error(f"{knowledge_base_path(_get_locale())} not found. Please create it in the same directory as app.py")
         st.stop() # Still stop if critical file is missing
 
+def _get_locale():
+    """Returns the locale picked for this session."""
+    return st.session_state.get("locale", DEFAULT_LOCALE)
+
+def _get_knowledge_base():
+    """Returns the knowledge base for the session's locale, loading it on first use."""
+    return get_knowledge_base(_get_locale())
+
 def _configure_gemini():
     """Confgures the Google Gemini API and stores the model in session_state."""
     global GEMINI_API_KEY # Only need global for GEMINI_API_KEY
     
     # Check if model is already initialized in session state
     if "gemini_model" in st.session_state and st.session_state.gemini_model is not None:
-        print("DEBUG: Reusing Gemini model from session state.")
+        _log.debug("model_reused", extra={"stage": "configure"})
         st.session_state.gemini_initialized = True
         return # Model already exists, no need to re-initialize
 
@@ -41,33 +52,56 @@ def _configure_gemini():
         
         try:
             # Attempt to instantiate the model
-            st.session_state.gemini_model = genai.GenerativeModel('gemini-1.5-flash') # Store in session state
+            st.session_state.gemini_model = genai.GenerativeModel(GEMINI_MODEL_NAME) # Store in session state
             st.session_state.gemini_initialized = True # Set flag to True on success
-            print("DEBUG: Gemini model initialized successfully and stored in session state.") # Success message to terminal
+            _log.info("model_initialized", extra={"stage": "configure"})
         except Exception as model_init_error:
             # Catch errors specifically from model instantiation
             st.error(f"Failed to load Gemini AI model: {model_init_error}. Please check your API key and network connection.")
             st.session_state.gemini_initialized = False
             st.session_state.gemini_model = None # Ensure model is None in session state
-            print(f"DEBUG: Gemini model instantiation failed: {model_init_error}") # Log specific model error to terminal
+            _log.error("model_init_failed", exc_info=True, extra={"stage": "configure"})
 
     except ValueError as e:
         # This catches if GOOGLE_API_KEY is not set or is empty
         st.error(f"API Key Error: {e}. Please ensure your GOOGLE_API_KEY environment variable is set correctly.")
         st.session_state.gemini_initialized = False
         st.session_state.gemini_model = None # Ensure model is None in session state
-        print(f"DEBUG: Gemini configuration failed (ValueError): {e}") # Log error to terminal
+        _log.warning("api_key_missing", extra={"stage": "configure", "error": str(e)})
     except Exception as e:
         # This catches any other exceptions during genai.configure (less likely if ValueError handles empty key)
         st.error(f"An unexpected error occurred during Gemini AI setup: {e}. The AI chat may not function.")
         st.session_state.gemini_initialized = False
         st.session_state.gemini_model = None # Ensure model is None in session state
-        print(f"DEBUG: Gemini configuration failed (General Exception): {e}") # Log error to terminal
+        _log.error("configure_failed", exc_info=True, extra={"stage": "configure"})
+
+def _resume_session():
+    """Restores the session named by the resume token in the URL, or gives the session a new token."""
+    token = st.query_params.get(RESUME_PARAM)
+    if token and restore_session(st.session_state, token):
+        st.session_state.resume_token = token
+        st.session_state.resume_notice = True # app.py warns that the link itself gives access
+        # Entry ids are list positions, so the index must cover restored entries before new ones are added
+        st.session_state.journal_index = JournalIndex(_get_locale())
+        st.session_state.journal_index.sync(st.session_state.get("journal_entries", []))
+        return
+    # Never adopt an unknown token from the URL; a corrupt snapshot has been deleted, so this starts afresh
+    st.session_state.resume_token = new_token()
+    st.query_params[RESUME_PARAM] = st.session_state.resume_token
+
+def _save_session():
+    """Saves the parts of session state that changed in this run under the session's resume token."""
+    if "resume_token" in st.session_state:
+        save_session(st.session_state, st.session_state.resume_token)
 
 def _initialize_session_state():
-    """Initializes all necessary session state variables."""
+    """Initializes all necessary session state variables, resuming a saved session when the URL names one."""
+    if "resume_token" not in st.session_state:
+        _resume_session()
     if "current_page" not in st.session_state:
         st.session_state.current_page = "Chat with AI"
+    if "locale" not in st.session_state:
+        st.session_state.locale = DEFAULT_LOCALE
     if "messages" not in st.session_state:
         st.session_state.messages = [
             {
@@ -78,6 +112,8 @@ def _initialize_session_state():
 
     if "journal_entries" not in st.session_state:
         st.session_state.journal_entries = []
+    if "journal_index" not in st.session_state:
+        st.session_state.journal_index = JournalIndex(_get_locale())
     if "current_journal_text" not in st.session_state:
         st.session_state.current_journal_text = ""
     if "community_posts" not in st.session_state:
@@ -92,12 +128,22 @@ def _initialize_session_state():
         st.session_state.knowledge_search_query_input = ""
     if "search_results" not in st.session_state:
         st.session_state.search_results = None
+    if "search_analyzed" not in st.session_state:
+        st.session_state.search_analyzed = ()
+    if "search_suggestion" not in st.session_state:
+        st.session_state.search_suggestion = None
     if "last_search_query_submitted" not in st.session_state:
         st.session_state.last_search_query_submitted = ""
     if "firebase_app_initialized" not in st.session_state:
         st.session_state.firebase_app_initialized = False
     if "community_post_message" not in st.session_state:
         st.session_state.community_post_message = ""
+    if "community_post_reason" not in st.session_state:
+        st.session_state.community_post_reason = ""
+    if "community_post_retry_after" not in st.session_state:
+        st.session_state.community_post_retry_after = 0
+    if "chat_notice" not in st.session_state:
+        st.session_state.chat_notice = ""
     if "gemini_initialized" not in st.session_state: # NEW: Flag for Gemini initialization status
         st.session_state.gemini_initialized = False
     if "gemini_model" not in st.session_state: # NEW: Initialize gemini_model in session state
@@ -566,22 +612,6 @@ div[data-testid="column"] {
         unsafe_allow_html=True
     )
 
-def _suggest_resources(prompt_text):
-    """Suggests resources based on the user's prompt."""
-    prompt_lower = prompt_text.lower()
-    suggestions = []
-
-    if any(keyword in prompt_lower for keyword in ["grief", "sadness", "cope", "emotional", "support group", "counseling"]):
-        suggestions.append("Consider reaching out to a professional counselor specializing in reproductive loss or joining a peer support group like those offered by *Still A Mum*.")
-    if any(keyword in prompt_lower for keyword in ["medical", "doctor", "symptoms", "bleeding", "pain", "hospital"]):
-        suggestions.append("For any medical concerns or symptoms, it is crucial to consult a qualified healthcare provider immediately.")
-    if any(keyword in prompt_lower for keyword in ["partner", "family", "friend", "how to help"]):
-        suggestions.append("Resources are available for partners, family, and friends on how to offer compassionate compassionate support. Look for guides on supporting someone through grief.")
-    if any(keyword in prompt_lower for keyword in ["crisis", "urgent", "immediate help"]):
-        suggestions.append("If you need immediate support, crisis lines and helplines suchs as Marie Stopes Kenya can offer a safe space to talk.")
-
-    return " ".join(suggestions) if suggestions else ""
-
 def _render_footer():
     """Renders the application footer."""
     st.markdown(